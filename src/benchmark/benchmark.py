@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+import pandas as pd
+import logging
+from benchmark.synthetic_dataset import genera_dataset
+from data_prep.istat_reference import FILE_CACHE_ISTAT, FILE_CODICI_ISTAT
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Numero di righe dei dataset sintetici su cui viene misurata la pipeline
+SCALE_DEFAULT = [100_000, 1_000_000, 10_000_000]
+
+# Fasi misurate, nell'ordine di esecuzione
+FASI_BENCHMARK = ['load_dataset', 'data_cleaning', 'feature_selection', 'feature_extraction', 'incremento',
+                  'data_transformation', 'costruisci_matrice', 'riduci_dimensionalita', 'plot_elbow_method', 'apply_clustering', 'compute_silhouette_score',
+                  'compute_purity']
+
+# Misure di ogni fase salvate nei risultati e confrontate con la baseline (con la relativa tolleranza assoluta)
+MISURE_CONFRONTATE = {'tempo_s': 'tolleranza_s', 'memoria_mb': 'tolleranza_mb'}
+
+# Cartelle dei dataset sintetici e dei risultati, relative alla cartella src
+CARTELLA_DATASET = 'datasets/synthetic'
+CARTELLA_RISULTATI = 'benchmark/risultati'
+
+# Silhouette ha costo quadratico nel numero di righe: oltre questa soglia viene calcolato su un campione
+MAX_RIGHE_SILHOUETTE = 20_000
+
+
+def esegui_benchmark(scale=None, seed=0, soglia=0.2, tolleranza_s=0.05, tolleranza_mb=20.0, baseline=None,
+                     cartella_risultati=CARTELLA_RISULTATI, aggiorna_baseline=False,
+                     max_righe_silhouette=MAX_RIGHE_SILHOUETTE) -> bool:
+    """
+    Misura le fasi della pipeline (FASI_BENCHMARK) su dataset sintetici di diverse dimensioni, salva i risultati in
+    formato JSON e li confronta con quelli dell'esecuzione precedente (la baseline).
+    Ogni scala viene eseguita in un processo separato, in una cartella di lavoro temporanea: le misure di memoria
+    non dipendono dalle scale precedenti e i file scritti dalla pipeline (month_dataset, graphs) non vengono
+    sovrascritti. La baseline viene aggiornata solo se non ci sono regressioni (o se aggiorna_baseline è True).
+    :param scale: numeri di righe dei dataset sintetici (opzionale, di default SCALE_DEFAULT)
+    :param seed: seme del generatore dei dataset sintetici
+    :param soglia: aumento relativo oltre il quale una misura è una regressione (es. 0.2 per il 20%)
+    :param tolleranza_s: aumento minimo del tempo, in secondi, per considerare una regressione
+    :param tolleranza_mb: aumento minimo della memoria, in MB, per considerare una regressione
+    :param baseline: percorso dei risultati con cui confrontare (opzionale, di default l'ultima esecuzione)
+    :param cartella_risultati: cartella in cui salvare i risultati
+    :param aggiorna_baseline: se True, la baseline viene aggiornata anche in presenza di regressioni
+    :param max_righe_silhouette: numero massimo di righe su cui calcolare compute_silhouette_score
+    :return: True se non ci sono regressioni
+    """
+    scale = SCALE_DEFAULT if scale is None else scale
+    ultimo = os.path.join(cartella_risultati, 'ultimo.json')
+    baseline = ultimo if baseline is None else baseline
+
+    risultati = {
+        'creato': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'piattaforma': platform.platform(),
+        'cpu': os.cpu_count(),
+        'parametri': {'seed': seed, 'max_righe_silhouette': max_righe_silhouette},
+        'scale': {}
+    }
+    for righe in scale:
+        file_path = dataset_sintetico(righe, seed)
+        logging.info(f"Benchmark su {righe} righe")
+        risultati['scale'][str(righe)] = esegui_scala(file_path, max_righe_silhouette)
+
+    os.makedirs(cartella_risultati, exist_ok=True)
+    file_risultati = os.path.join(cartella_risultati, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    salva_risultati(risultati, file_risultati)
+
+    regressioni = pd.DataFrame()
+    if os.path.isfile(baseline):
+        with open(baseline) as file:
+            confronto = confronta_risultati(json.load(file), risultati, soglia,
+                                            {'tolleranza_s': tolleranza_s, 'tolleranza_mb': tolleranza_mb})
+        logging.info(f"Confronto con {baseline}:")
+        logging.info(confronto.round(3).to_string())
+        regressioni = confronto[confronto['regressione']]
+    else:
+        logging.info(f"Nessuna baseline in {baseline}: i risultati diventano la nuova baseline")
+
+    if regressioni.empty or aggiorna_baseline:
+        shutil.copyfile(file_risultati, ultimo)
+    for (scala, fase, misura), riga in regressioni.iterrows():
+        logging.error(f"Regressione di {fase} su {scala} righe: {misura} {riga['baseline']:.3f} -> "
+                      f"{riga['corrente']:.3f} (+{riga['variazione']:.0%})")
+    return regressioni.empty
+
+
+def dataset_sintetico(righe, seed) -> str:
+    """
+    Restituisce il percorso del dataset sintetico con il numero di righe e il seme specificati, generandolo se non
+    esiste: il generatore è deterministico, quindi il file può essere riutilizzato fra esecuzioni diverse.
+    :param righe: numero di righe
+    :param seed: seme del generatore
+    :return: percorso del file Parquet
+    """
+    file_path = os.path.join(CARTELLA_DATASET, f'teleassistenza_{righe}_seed{seed}.parquet')
+    if not os.path.isfile(file_path):
+        # Il file viene rinominato solo a generazione completata: un'esecuzione interrotta non lascia file parziali
+        genera_dataset(file_path + '.tmp', righe, seed=seed)
+        os.replace(file_path + '.tmp', file_path)
+    return file_path
+
+
+def esegui_scala(file_path, max_righe_silhouette) -> dict:
+    """
+    Esegue misura_pipeline in un nuovo processo Python e ne restituisce le misure.
+    :param file_path: percorso del dataset sintetico
+    :param max_righe_silhouette: numero massimo di righe su cui calcolare compute_silhouette_score
+    :return: dizionario {fase: misure}
+    """
+    # Il processo deve poter importare sia i moduli di src sia il pacchetto src (usato dal clustering)
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pythonpath = os.pathsep.join(filter(None, [src, os.path.dirname(src), os.environ.get('PYTHONPATH')]))
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_') as cartella:
+        file_misure = os.path.join(cartella, 'misure.json')
+        subprocess.run([sys.executable, '-m', 'benchmark.benchmark', '--scala', os.path.abspath(file_path),
+                        '--misure', file_misure, '--max-righe-silhouette', str(max_righe_silhouette)],
+                       check=True, cwd=src, env={**os.environ, 'PYTHONPATH': pythonpath})
+        with open(file_misure) as file:
+            return json.load(file)
+
+
+def misura_pipeline(file_path, file_misure, max_righe_silhouette):
+    """
+    Esegue le fasi della pipeline sul dataset e salva le misure di ciascuna: tempo, tempo di CPU, picco di memoria
+    residente della fase (campionato) e righe in ingresso e in uscita. La pipeline viene eseguita in una cartella di
+    lavoro temporanea che contiene solo il file dei codici ISTAT e la relativa cache.
+    :param file_path: percorso assoluto del dataset sintetico
+    :param file_misure: percorso del file JSON in cui salvare le misure
+    :param max_righe_silhouette: numero massimo di righe su cui calcolare compute_silhouette_score
+    :return: None
+    """
+    # Import locali: il processo principale non deve caricare la pipeline (né misurarne la memoria)
+    from instrumentation.instrumentation import configura_strumentazione, report_fasi
+    from data_prep.data_loading import FILTRO_DISDETTE, colonne_utilizzate, load_dataset
+    from data_prep.data_cleaning import data_cleaning
+    from data_prep.features_selection import feature_selection
+    from data_prep.istat_reference import carica_comuni_istat
+    from feature_extraction.features_extraction import feature_extraction
+    from feature_extraction.extract_increment import incremento
+    from data_transformation.data_transformation import costruisci_matrice, data_transformation
+    from src.clustering.clustering_execution import apply_clustering, plot_elbow_method, riduci_dimensionalita
+    from src.clustering.clustering_metrics import compute_purity, compute_silhouette_score
+
+    src = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='pipeline_') as cartella:
+        os.makedirs(os.path.join(cartella, os.path.dirname(FILE_CACHE_ISTAT)))
+        os.makedirs(os.path.join(cartella, 'graphs'))
+        shutil.copy2(os.path.join(src, FILE_CODICI_ISTAT), os.path.join(cartella, FILE_CODICI_ISTAT))
+        if os.path.isfile(os.path.join(src, FILE_CACHE_ISTAT)):
+            shutil.copy2(os.path.join(src, FILE_CACHE_ISTAT), os.path.join(cartella, FILE_CACHE_ISTAT))
+        os.chdir(cartella)
+
+        # La lettura dei codici ISTAT non fa parte delle fasi misurate
+        carica_comuni_istat()
+        configura_strumentazione(campiona_rss=True)
+
+        df = load_dataset(file_path, columns=colonne_utilizzate(file_path), filtro=FILTRO_DISDETTE)
+        df = data_cleaning(df)
+        df = feature_selection(df)
+        df = feature_extraction(df)
+        df = incremento(df)
+        df = data_transformation(df)[0]
+
+        matrice = costruisci_matrice(df)
+
+        svd_data = riduci_dimensionalita(matrice)
+        modelli = plot_elbow_method(svd_data, max_clusters=10)
+        labels, _ = apply_clustering(matrice, n_clusters=4, svd_data=svd_data, modello=modelli[4])
+        df['Cluster'] = labels
+        campione = df.sample(max_righe_silhouette, random_state=0) if len(df) > max_righe_silhouette else df
+        compute_silhouette_score(campione, matrice[df.index.get_indexer(campione.index)])
+        compute_purity(df, 'incremento')
+
+        report = report_fasi()
+        os.chdir(src)
+
+    report = report[report['livello'] == 0].set_index('fase')
+    report['memoria_mb'] = report['picco_rss_fase_mb'] - report['rss_iniziale_mb']
+    misure = report.loc[FASI_BENCHMARK, ['tempo_s', 'cpu_s', 'memoria_mb', 'picco_rss_fase_mb', 'righe_in',
+                                         'righe_out']]
+    salva_risultati(json.loads(misure.to_json(orient='index')), file_misure)
+
+
+def confronta_risultati(baseline, risultati, soglia, tolleranze) -> pd.DataFrame:
+    """
+    Confronta le misure di due esecuzioni del benchmark, per le scale e le fasi presenti in entrambe.
+    Una misura è una regressione se aumenta più della soglia relativa e più della tolleranza assoluta (per non
+    segnalare le variazioni dovute al rumore delle fasi più brevi).
+    :param baseline: risultati dell'esecuzione precedente
+    :param risultati: risultati dell'esecuzione corrente
+    :param soglia: aumento relativo oltre il quale una misura è una regressione
+    :param tolleranze: dizionario {'tolleranza_s': ..., 'tolleranza_mb': ...}
+    :return: DataFrame indicizzato per (scala, fase, misura) con 'baseline', 'corrente', 'variazione', 'regressione'
+    """
+    righe = []
+    for scala, fasi in risultati['scale'].items():
+        fasi_baseline = baseline['scale'].get(scala, {})
+        for fase, misure in fasi.items():
+            if fase not in fasi_baseline:
+                continue
+            for misura, tolleranza in MISURE_CONFRONTATE.items():
+                precedente, corrente = fasi_baseline[fase].get(misura), misure.get(misura)
+                if precedente is None or corrente is None:
+                    continue
+                aumento = corrente - precedente
+                variazione = aumento / precedente if precedente > 0 else 0.0
+                righe.append({'scala': scala, 'fase': fase, 'misura': misura, 'baseline': precedente,
+                              'corrente': corrente, 'variazione': variazione,
+                              'regressione': variazione > soglia and aumento > tolleranze[tolleranza]})
+
+    return pd.DataFrame(righe, columns=['scala', 'fase', 'misura', 'baseline', 'corrente', 'variazione',
+                                        'regressione']).set_index(['scala', 'fase', 'misura'])
+
+
+def salva_risultati(risultati, file_path):
+    """
+    Salva i risultati in formato JSON.
+    :param risultati: dizionario dei risultati
+    :param file_path: percorso del file JSON
+    :return: None
+    """
+    with open(file_path, 'w') as file:
+        json.dump(risultati, file, indent=2)
+    logging.info(f"Risultati del benchmark salvati in {file_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark delle fasi della pipeline su dataset sintetici.')
+    parser.add_argument('--righe', type=int, nargs='+', default=SCALE_DEFAULT,
+                        help='numeri di righe dei dataset sintetici')
+    parser.add_argument('--seed', type=int, default=0, help='seme del generatore dei dataset sintetici')
+    parser.add_argument('--soglia', type=float, default=0.2,
+                        help='aumento relativo oltre il quale una fase è in regressione (es. 0.2 per il 20%%)')
+    parser.add_argument('--tolleranza-s', type=float, default=0.05,
+                        help='aumento minimo del tempo, in secondi, per considerare una regressione')
+    parser.add_argument('--tolleranza-mb', type=float, default=20.0,
+                        help='aumento minimo della memoria, in MB, per considerare una regressione')
+    parser.add_argument('--baseline', help='risultati con cui confrontare (di default l\'esecuzione precedente)')
+    parser.add_argument('--risultati', default=CARTELLA_RISULTATI, help='cartella in cui salvare i risultati')
+    parser.add_argument('--aggiorna-baseline', action='store_true',
+                        help='aggiorna la baseline anche in presenza di regressioni')
+    parser.add_argument('--max-righe-silhouette', type=int, default=MAX_RIGHE_SILHOUETTE,
+                        help='numero massimo di righe su cui calcolare l\'indice di Silhouette')
+    # Uso interno: misura una singola scala nel processo corrente
+    parser.add_argument('--scala', help=argparse.SUPPRESS)
+    parser.add_argument('--misure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scala:
+        misura_pipeline(args.scala, args.misure, args.max_righe_silhouette)
+    else:
+        ok = esegui_benchmark(args.righe, seed=args.seed, soglia=args.soglia, tolleranza_s=args.tolleranza_s,
+                              tolleranza_mb=args.tolleranza_mb, baseline=args.baseline,
+                              cartella_risultati=args.risultati, aggiorna_baseline=args.aggiorna_baseline,
+                              max_righe_silhouette=args.max_righe_silhouette)
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,375 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import logging
+from data_prep.istat_reference import FILE_CODICI_ISTAT, carica_comuni_istat
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Numero di righe di ogni row group del file generato (e di ogni blocco generato in memoria)
+RIGHE_PER_ROW_GROUP = 500_000
+
+# Tipologie di professionista sanitario: (tipologia, codice, peso, attività, codice attività, durata media in minuti).
+# I pesi riproducono la distribuzione osservata nel dataset della challenge
+TIPOLOGIE_PROFESSIONISTA = [
+    ('Infermiere', 'INF', 0.560, 'Teleassistenza infermieristica', 1, 40),
+    ('Psicologo', 'PSI', 0.105, 'Colloquio psicologico a distanza', 2, 45),
+    ('Dietista', 'DIE', 0.100, 'Teleconsulenza nutrizionale', 3, 35),
+    ('Fisioterapista', 'FIS', 0.035, 'Teleriabilitazione motoria', 4, 50),
+    ('Logopedista', 'LOG', 0.033, 'Teleriabilitazione logopedica', 5, 45),
+    ('Assistente sanitario', 'ASS', 0.028, 'Telemonitoraggio', 6, 25),
+    ('Ostetrica/o', 'OST', 0.016, 'Teleassistenza ostetrica', 7, 35),
+    ('Terapista Occupazionale', 'TOC', 0.006, 'Teleriabilitazione occupazionale', 8, 45),
+    ('Tecnico Riabilitazione Psichiatrica', 'TRP', 0.005, 'Teleriabilitazione psichiatrica', 9, 50),
+    ('Podologo', 'POD', 0.005, 'Teleconsulenza podologica', 10, 30),
+    ('Terapista della Neuro e Psicomotricità dell\'Età Evolutiva', 'TNP', 0.004,
+     'Teleriabilitazione neuropsicomotoria', 11, 45),
+    ('Educatore Professionale', 'EDU', 0.004, 'Teleassistenza educativa', 12, 40)
+]
+
+# Tipologie di struttura di erogazione: (tipologia, codice, peso)
+TIPOLOGIE_STRUTTURA = [
+    ('Ospedale a gestione diretta', '01', 0.660),
+    ('Azienda Ospedaliera', '02', 0.130),
+    ('Azienda Ospedaliera Universitaria', '03', 0.130),
+    ('IRCCS privato', '04', 0.030),
+    ('IRCCS pubblico', '05', 0.025),
+    ('Fondazione IRCCS', '06', 0.015),
+    ('Policlinico universitario privato', '07', 0.014),
+    ('Ente di Ricerca', '08', 0.001)
+]
+
+# Colonne del dataset, nell'ordine del file della challenge
+COLONNE_DATASET = ['id_prenotazione', 'id_paziente', 'data_nascita', 'sesso', 'regione_residenza',
+                   'codice_regione_residenza', 'asl_residenza', 'codice_asl_residenza', 'provincia_residenza',
+                   'codice_provincia_residenza', 'comune_residenza', 'codice_comune_residenza', 'tipologia_servizio',
+                   'descrizione_attivita', 'codice_descrizione_attivita', 'data_contatto', 'regione_erogazione',
+                   'codice_regione_erogazione', 'asl_erogazione', 'codice_asl_erogazione', 'provincia_erogazione',
+                   'codice_provincia_erogazione', 'struttura_erogazione', 'codice_struttura_erogazione',
+                   'tipologia_struttura_erogazione', 'codice_tipologia_struttura_erogazione',
+                   'id_professionista_sanitario', 'tipologia_professionista_sanitario',
+                   'codice_tipologia_professionista_sanitario', 'data_erogazione', 'ora_inizio_erogazione',
+                   'ora_fine_erogazione', 'data_disdetta']
+
+# Formato delle date con orario (ora locale italiana con offset, es. 2021-03-01T10:30:00+0100)
+FORMATO_DATA_ORA = '%Y-%m-%dT%H:%M:%S%z'
+
+SECONDI_GIORNO = 86400
+
+
+def genera_dataset(file_path, righe, seed=0, righe_per_row_group=RIGHE_PER_ROW_GROUP, anno_inizio=2019,
+                   anno_fine=2022, tasso_disdette=0.06, tasso_orari_mancanti=0.01, tasso_fuori_provincia=0.05,
+                   prenotazioni_per_paziente=4,
+                   strutture_per_provincia=3, professionisti_per_struttura=10,
+                   file_istat=FILE_CODICI_ISTAT) -> str:
+    """
+    Genera un dataset sintetico di prenotazioni di teleassistenza con lo schema del dataset della challenge e lo
+    salva in formato Parquet, un row group alla volta: la memoria occupata dipende da righe_per_row_group e non dal
+    numero totale di righe, quindi la pipeline può essere provata a qualsiasi scala (1M, 10M, 50M righe).
+    I codici di comune, provincia e regione sono quelli ISTAT; come nel dataset originale, il codice della provincia
+    di Napoli ('NA') è nullo e il nome del comune 'None' (codice 1168) è mancante.
+    A parità di parametri il file generato è identico: anagrafiche e blocchi di righe hanno generatori casuali
+    derivati da seed.
+    :param file_path: percorso del file Parquet da creare
+    :param righe: numero di prenotazioni da generare
+    :param seed: seme dei generatori casuali
+    :param righe_per_row_group: righe di ogni row group
+    :param anno_inizio: primo anno delle date di erogazione
+    :param anno_fine: ultimo anno delle date di erogazione
+    :param tasso_disdette: frazione di prenotazioni disdette ('data_disdetta' valorizzata)
+    :param tasso_orari_mancanti: frazione di prenotazioni senza 'ora_inizio_erogazione' e 'ora_fine_erogazione'
+    :param tasso_fuori_provincia: frazione di prenotazioni erogate da una struttura di una provincia estratta a caso
+                                  (di norma in un'altra regione) invece che della provincia di residenza
+    :param prenotazioni_per_paziente: numero medio di prenotazioni di ogni paziente
+    :param strutture_per_provincia: numero di strutture di erogazione di ogni provincia
+    :param professionisti_per_struttura: numero di professionisti sanitari di ogni struttura
+    :param file_istat: percorso del file excel dei codici ISTAT
+    :return: file_path
+    """
+    inizio = time.perf_counter()
+    anagrafiche = crea_anagrafiche(carica_comuni_istat(file_istat), righe, np.random.default_rng([seed, 0]),
+                                   anno_inizio, anno_fine, prenotazioni_per_paziente, strutture_per_provincia,
+                                   professionisti_per_struttura)
+    periodo = (pd.Timestamp(f'{anno_inizio}-01-01', tz='UTC').value // 10 ** 9,
+               pd.Timestamp(f'{anno_fine + 1}-01-01', tz='UTC').value // 10 ** 9)
+
+    cartella = os.path.dirname(file_path)
+    if cartella:
+        os.makedirs(cartella, exist_ok=True)
+
+    with pq.ParquetWriter(file_path, schema_dataset()) as writer:
+        for blocco, prima_riga in enumerate(range(0, righe, righe_per_row_group)):
+            righe_blocco = min(righe_per_row_group, righe - prima_riga)
+            table = genera_blocco(anagrafiche, prima_riga, righe_blocco, np.random.default_rng([seed, 1, blocco]),
+                                  periodo, tasso_disdette, tasso_orari_mancanti, tasso_fuori_provincia)
+            writer.write_table(table, row_group_size=righe_blocco)
+
+    logging.info(f"Dataset sintetico di {righe} righe salvato in {file_path} "
+                 f"({time.perf_counter() - inizio:.1f} s)")
+    return file_path
+
+
+def crea_anagrafiche(comuni, righe, rng, anno_inizio, anno_fine, prenotazioni_per_paziente,
+                     strutture_per_provincia, professionisti_per_struttura) -> dict:
+    """
+    Crea le anagrafiche da cui vengono estratte le prenotazioni: province (con ASL), strutture di erogazione,
+    professionisti sanitari e pazienti. Ogni paziente risiede in un comune ISTAT ed è assistito dalle strutture della
+    propria provincia (salvo le prenotazioni fuori provincia, genera_blocco); ogni professionista ha un tasso di
+    crescita annuo delle televisite, in modo che l'incremento della teleassistenza vari fra professionisti.
+    :param comuni: tabella dei comuni ISTAT (carica_comuni_istat)
+    :param righe: numero di prenotazioni da generare
+    :param rng: generatore casuale
+    :param anno_inizio: primo anno delle date di erogazione
+    :param anno_fine: ultimo anno delle date di erogazione
+    :param prenotazioni_per_paziente: numero medio di prenotazioni di ogni paziente
+    :param strutture_per_provincia: numero di strutture di erogazione di ogni provincia
+    :param professionisti_per_struttura: numero di professionisti sanitari di ogni struttura
+    :return: dizionario delle anagrafiche (array numpy e pyarrow indicizzati per posizione)
+    """
+    # Province: codici e nomi ISTAT, ASL numerata all'interno della regione
+    province = comuni.drop_duplicates('codice_provincia').sort_values('codice_provincia').reset_index(drop=True)
+    numero_asl = province.groupby('codice_regione').cumcount() + 1
+    codice_asl = province['codice_regione'] * 100 + numero_asl
+    # Come nel dataset originale, la sigla 'NA' di Napoli è letta come valore mancante
+    sigla = province['sigla_provincia'].where(province['provincia'] != 'Napoli')
+    provincia_comune = province.reset_index().set_index('codice_provincia')['index'].reindex(
+        comuni['codice_provincia']).to_numpy()
+
+    # Strutture: strutture_per_provincia strutture consecutive per ogni provincia
+    numero_strutture = len(province) * strutture_per_provincia
+    tipologia_struttura = rng.choice(len(TIPOLOGIE_STRUTTURA), size=numero_strutture,
+                                     p=pesi_normalizzati(TIPOLOGIE_STRUTTURA))
+    provincia_struttura = np.repeat(np.arange(len(province)), strutture_per_provincia)
+    numero_struttura = np.tile(np.arange(1, strutture_per_provincia + 1), len(province))
+    nomi_tipologie_struttura = np.array([tipologia[0] for tipologia in TIPOLOGIE_STRUTTURA], dtype=object)
+    nomi_strutture = [f'{tipologia} {provincia} {numero}' for tipologia, provincia, numero in
+                      zip(nomi_tipologie_struttura[tipologia_struttura],
+                          province['provincia'].to_numpy()[provincia_struttura], numero_struttura)]
+
+    # Professionisti: professionisti_per_struttura professionisti consecutivi per ogni struttura
+    numero_professionisti = numero_strutture * professionisti_per_struttura
+    tipologia_professionista = rng.choice(len(TIPOLOGIE_PROFESSIONISTA), size=numero_professionisti,
+                                          p=pesi_normalizzati(TIPOLOGIE_PROFESSIONISTA))
+    # Crescita annua delle televisite del professionista, espressa come tasso continuo sull'intero periodo
+    crescita = np.log1p(np.clip(rng.normal(0.15, 0.35, numero_professionisti), -0.6, None))
+
+    # Pazienti: comune di residenza, sesso e data di nascita (età a metà periodo fra 0 e 100 anni)
+    numero_pazienti = max(righe // prenotazioni_per_paziente, 1)
+    meta_periodo = pd.Timestamp(f'{(anno_inizio + anno_fine + 1) // 2}-07-01').value // 10 ** 9 // SECONDI_GIORNO
+    eta_giorni = np.clip(rng.normal(45, 18, numero_pazienti), 0, 100) * 365.25
+
+    return {
+        'comuni': {
+            'comune': pa.array(comuni['comune'], pa.string()),
+            'codice_comune': comuni['codice_comune'].to_numpy(np.int64),
+            'provincia': provincia_comune
+        },
+        'province': {
+            'regione': pa.array(province['regione'], pa.string()),
+            'codice_regione': province['codice_regione'].to_numpy(np.int64),
+            'asl': pa.array('ASL ' + province['provincia'], pa.string()),
+            'codice_asl': codice_asl.to_numpy(np.int64),
+            'provincia': pa.array(province['provincia'], pa.string()),
+            'sigla': pa.array(sigla, pa.string())
+        },
+        'strutture': {
+            'struttura': pa.array(nomi_strutture, pa.string()),
+            'codice_struttura': (province['codice_provincia'].to_numpy(np.int64)[provincia_struttura] * 100 +
+                                 numero_struttura),
+            'tipologia': tipologia_struttura,
+            'provincia': provincia_struttura
+        },
+        'professionisti': {
+            'tipologia': tipologia_professionista,
+            'crescita': crescita * (anno_fine - anno_inizio + 1)
+        },
+        'pazienti': {
+            'comune': rng.integers(0, len(comuni), numero_pazienti),
+            'femmina': rng.random(numero_pazienti) < 0.54,
+            'nascita': meta_periodo - eta_giorni.astype(np.int64)
+        },
+        'strutture_per_provincia': strutture_per_provincia,
+        'professionisti_per_struttura': professionisti_per_struttura
+    }
+
+
+def genera_blocco(anagrafiche, prima_riga, righe, rng, periodo, tasso_disdette, tasso_orari_mancanti,
+                  tasso_fuori_provincia=0.0) -> pa.Table:
+    """
+    Genera un blocco di prenotazioni.
+    :param anagrafiche: anagrafiche create da crea_anagrafiche
+    :param prima_riga: posizione della prima prenotazione del blocco (usata per gli identificativi)
+    :param righe: numero di prenotazioni del blocco
+    :param rng: generatore casuale del blocco
+    :param periodo: (inizio, fine) delle date di erogazione, in secondi dal 1970-01-01 UTC
+    :param tasso_disdette: frazione di prenotazioni disdette
+    :param tasso_orari_mancanti: frazione di prenotazioni senza orari di inizio e fine
+    :param tasso_fuori_provincia: frazione di prenotazioni erogate da una struttura di una provincia estratta a caso
+    :return: Table pyarrow con le colonne COLONNE_DATASET
+    """
+    comuni, province = anagrafiche['comuni'], anagrafiche['province']
+    strutture, professionisti = anagrafiche['strutture'], anagrafiche['professionisti']
+    pazienti = anagrafiche['pazienti']
+
+    # Paziente, struttura della provincia di erogazione e professionista della struttura
+    paziente = rng.integers(0, len(pazienti['comune']), righe)
+    comune = pazienti['comune'][paziente]
+    provincia = comuni['provincia'][comune]
+
+    # Provincia di erogazione: quella di residenza, o per tasso_fuori_provincia delle prenotazioni una provincia
+    # estratta a caso. Le estrazioni usano un generatore derivato, quindi le altre colonne restano le stesse per ogni
+    # valore di tasso_fuori_provincia
+    rng_erogazione = rng.spawn(1)[0]
+    fuori_provincia = rng_erogazione.random(righe) < tasso_fuori_provincia
+    provincia_erogazione = np.where(fuori_provincia, rng_erogazione.integers(0, len(province['provincia']), righe),
+                                    provincia)
+    struttura = (provincia_erogazione * anagrafiche['strutture_per_provincia'] +
+                 rng.integers(0, anagrafiche['strutture_per_provincia'], righe))
+    professionista = (struttura * anagrafiche['professionisti_per_struttura'] +
+                      rng.integers(0, anagrafiche['professionisti_per_struttura'], righe))
+    tipologia = professionisti['tipologia'][professionista]
+
+    # Data di erogazione: densità proporzionale a exp(crescita * t) sul periodo, in un giorno lavorativo fra le 7 e
+    # le 18 UTC, a multipli di 5 minuti
+    crescita = professionisti['crescita'][professionista]
+    u = rng.random(righe)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(np.abs(crescita) < 1e-9, u, np.log1p(u * np.expm1(crescita)) / crescita)
+    giorno = (periodo[0] + (t * (periodo[1] - periodo[0])).astype(np.int64)) // SECONDI_GIORNO
+    giorno -= np.maximum((giorno + 3) % 7 - 4, 0)  # Sabato e domenica diventano venerdì
+    erogazione = giorno * SECONDI_GIORNO + 7 * 3600 + rng.integers(0, 11 * 12, righe) * 300
+
+    # Durata: log-normale attorno alla durata media dell'attività
+    durata_media = np.array([tipo[5] for tipo in TIPOLOGIE_PROFESSIONISTA], dtype=np.float64)[tipologia]
+    durata = np.maximum(durata_media * rng.lognormal(-0.045, 0.3, righe), 5) * 60
+    fine = erogazione + durata.astype(np.int64)
+
+    # Contatto da 1 a circa 90 giorni prima dell'erogazione, disdetta fra contatto ed erogazione
+    contatto = erogazione - (SECONDI_GIORNO + rng.exponential(15 * SECONDI_GIORNO, righe).astype(np.int64))
+    disdetta = rng.random(righe) < tasso_disdette
+    data_disdetta = contatto + (rng.random(righe) * (erogazione - contatto)).astype(np.int64)
+    orari_mancanti = rng.random(righe) < tasso_orari_mancanti
+
+    provincia_struttura = strutture['provincia'][struttura]
+    colonne = {
+        'id_prenotazione': identificativi('PR', np.arange(prima_riga, prima_riga + righe)),
+        'id_paziente': identificativi('PZ', paziente),
+        'data_nascita': formatta_date(pazienti['nascita'][paziente] * SECONDI_GIORNO, '%Y-%m-%d'),
+        'sesso': pa.array(np.where(pazienti['femmina'][paziente], 'female', 'male'), pa.string()),
+        'regione_residenza': province['regione'].take(provincia),
+        'codice_regione_residenza': province['codice_regione'][provincia],
+        'asl_residenza': province['asl'].take(provincia),
+        'codice_asl_residenza': province['codice_asl'][provincia],
+        'provincia_residenza': province['provincia'].take(provincia),
+        'codice_provincia_residenza': province['sigla'].take(provincia),
+        'comune_residenza': comuni['comune'].take(comune),
+        'codice_comune_residenza': comuni['codice_comune'][comune],
+        'tipologia_servizio': pa.array(np.full(righe, 'Teleassistenza'), pa.string()),
+        'descrizione_attivita': valori_tabella(TIPOLOGIE_PROFESSIONISTA, 3, tipologia),
+        'codice_descrizione_attivita': np.array([tipo[4] for tipo in TIPOLOGIE_PROFESSIONISTA])[tipologia],
+        'data_contatto': formatta_date(contatto),
+        'regione_erogazione': province['regione'].take(provincia_struttura),
+        'codice_regione_erogazione': province['codice_regione'][provincia_struttura],
+        'asl_erogazione': province['asl'].take(provincia_struttura),
+        'codice_asl_erogazione': province['codice_asl'][provincia_struttura],
+        'provincia_erogazione': province['provincia'].take(provincia_struttura),
+        'codice_provincia_erogazione': province['sigla'].take(provincia_struttura),
+        'struttura_erogazione': strutture['struttura'].take(struttura),
+        'codice_struttura_erogazione': strutture['codice_struttura'][struttura],
+        'tipologia_struttura_erogazione': valori_tabella(TIPOLOGIE_STRUTTURA, 0, strutture['tipologia'][struttura]),
+        'codice_tipologia_struttura_erogazione': valori_tabella(TIPOLOGIE_STRUTTURA, 1,
+                                                                strutture['tipologia'][struttura]),
+        'id_professionista_sanitario': identificativi('PS', professionista),
+        'tipologia_professionista_sanitario': valori_tabella(TIPOLOGIE_PROFESSIONISTA, 0, tipologia),
+        'codice_tipologia_professionista_sanitario': valori_tabella(TIPOLOGIE_PROFESSIONISTA, 1, tipologia),
+        'data_erogazione': formatta_date(erogazione),
+        'ora_inizio_erogazione': formatta_date(erogazione, mancanti=orari_mancanti),
+        'ora_fine_erogazione': formatta_date(fine, mancanti=orari_mancanti),
+        'data_disdetta': formatta_date(data_disdetta, mancanti=~disdetta)
+    }
+    return pa.Table.from_pydict(colonne, schema=schema_dataset())
+
+
+def schema_dataset() -> pa.Schema:
+    """
+    Schema Parquet del dataset sintetico: codici numerici di regione, ASL, comune, attività e struttura in int64,
+    tutte le altre colonne (date comprese) come stringhe.
+    :return: schema pyarrow con le colonne COLONNE_DATASET
+    """
+    interi = {'codice_regione_residenza', 'codice_asl_residenza', 'codice_comune_residenza',
+              'codice_descrizione_attivita', 'codice_regione_erogazione', 'codice_asl_erogazione',
+              'codice_struttura_erogazione'}
+    return pa.schema([(colonna, pa.int64() if colonna in interi else pa.string()) for colonna in COLONNE_DATASET])
+
+
+def pesi_normalizzati(tabella) -> np.ndarray:
+    """
+    Probabilità di ogni voce di una tabella di tipologie, dai pesi in terza posizione.
+    :param tabella: lista di tuple (descrizione, codice, peso, ...)
+    :return: array delle probabilità
+    """
+    pesi = np.array([voce[2] for voce in tabella], dtype=np.float64)
+    return pesi / pesi.sum()
+
+
+def valori_tabella(tabella, campo, indici) -> pa.Array:
+    """
+    Valori di un campo di una tabella di tipologie per ogni riga.
+    :param tabella: lista di tuple
+    :param campo: posizione del campo nella tupla
+    :param indici: array delle posizioni nella tabella
+    :return: array pyarrow di stringhe
+    """
+    return pa.array([voce[campo] for voce in tabella], pa.string()).take(indici)
+
+
+def identificativi(prefisso, numeri) -> pa.Array:
+    """
+    Identificativi testuali composti da un prefisso e da un numero (es. 'PR000000012345').
+    :param prefisso: prefisso dell'identificativo
+    :param numeri: array di interi non negativi
+    :return: array pyarrow di stringhe
+    """
+    numeri = pc.cast(pa.array(numeri, pa.int64()), pa.string())
+    return pc.binary_join_element_wise(prefisso, pc.utf8_lpad(numeri, 12, padding='0'), '')
+
+
+def formatta_date(secondi, formato=FORMATO_DATA_ORA, mancanti=None) -> pa.Array:
+    """
+    Converte i secondi dal 1970-01-01 UTC in stringhe nell'ora locale italiana, come nel dataset originale.
+    :param secondi: array di interi
+    :param formato: formato strftime
+    :param mancanti: maschera dei valori da lasciare nulli (opzionale)
+    :return: array pyarrow di stringhe
+    """
+    date = pa.array(secondi, pa.timestamp('s', tz='Europe/Rome'), mask=mancanti)
+    return pc.strftime(date, format=formato)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera un dataset sintetico di prenotazioni di teleassistenza.')
+    parser.add_argument('righe', type=int, help='numero di prenotazioni da generare')
+    parser.add_argument('--output', default='datasets/synthetic/teleassistenza.parquet',
+                        help='percorso del file Parquet da creare')
+    parser.add_argument('--seed', type=int, default=0, help='seme dei generatori casuali')
+    parser.add_argument('--righe-per-row-group', type=int, default=RIGHE_PER_ROW_GROUP,
+                        help='righe di ogni row group')
+    parser.add_argument('--anno-inizio', type=int, default=2019, help='primo anno delle date di erogazione')
+    parser.add_argument('--anno-fine', type=int, default=2022, help='ultimo anno delle date di erogazione')
+    parser.add_argument('--tasso-disdette', type=float, default=0.06, help='frazione di prenotazioni disdette')
+    parser.add_argument('--tasso-orari-mancanti', type=float, default=0.01,
+                        help='frazione di prenotazioni senza orari di inizio e fine')
+    parser.add_argument('--tasso-fuori-provincia', type=float, default=0.05,
+                        help='frazione di prenotazioni erogate in una provincia diversa da quella di residenza')
+    args = parser.parse_args()
+
+    genera_dataset(args.output, args.righe, seed=args.seed, righe_per_row_group=args.righe_per_row_group,
+                   anno_inizio=args.anno_inizio, anno_fine=args.anno_fine, tasso_disdette=args.tasso_disdette,
+                   tasso_orari_mancanti=args.tasso_orari_mancanti, tasso_fuori_provincia=args.tasso_fuori_provincia)
@@ -0,0 +1,260 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import logging
+from instrumentation.instrumentation import misura
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Cartella di default dei checkpoint
+CARTELLA_CHECKPOINT = 'datasets/cache/checkpoint'
+
+# Cartella dei sorgenti del progetto, i cui moduli entrano nella versione del codice delle fasi
+CARTELLA_SORGENTI = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Formati supportati e relative estensioni
+FORMATI_CHECKPOINT = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def impronta_dataset(file_path, **parametri) -> str:
+    """
+    Calcola l'impronta del dataset di input: dimensione e data di modifica del file, numero di righe e schema
+    Parquet, parametri di lettura (es. colonne e filtro) e versioni delle librerie che producono i DataFrame.
+    Non legge il contenuto del file, quindi ha costo costante anche sui dataset più grandi.
+    :param file_path: percorso del file Parquet
+    :param parametri: parametri di lettura del dataset e altri valori da cui dipendono i checkpoint (es. hash dei
+                      file di riferimento)
+    :return: impronta esadecimale
+    """
+    stat = os.stat(file_path)
+    metadata = pq.read_metadata(file_path)
+    return calcola_hash({
+        'file': os.path.basename(file_path),
+        'dimensione': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'righe': metadata.num_rows,
+        'schema': metadata.schema.to_arrow_schema().to_string(show_schema_metadata=False),
+        'parametri': parametri,
+        'librerie': {'pandas': pd.__version__, 'numpy': np.__version__, 'pyarrow': pa.__version__}
+    })
+
+
+def versione_codice(*oggetti) -> str:
+    """
+    Calcola la versione del codice di una fase: hash del sorgente completo dei moduli che definiscono gli oggetti
+    specificati e dei moduli del progetto che questi importano, direttamente o indirettamente (es. data_cleaning
+    include istat_reference e schema). Una modifica a qualsiasi funzione di questi moduli (anche non chiamata dalla
+    fase) invalida i checkpoint della fase.
+    :param oggetti: funzioni o moduli da cui dipende la fase
+    :return: versione esadecimale
+    """
+    sha256 = hashlib.sha256()
+    for modulo in sorted(moduli_progetto(oggetti), key=lambda m: m.__name__):
+        sha256.update(modulo.__name__.encode())
+        with open(inspect.getsourcefile(modulo), 'rb') as file:
+            sha256.update(file.read())
+    return sha256.hexdigest()
+
+
+def moduli_progetto(oggetti) -> set:
+    """
+    Restituisce i moduli che definiscono gli oggetti specificati e, ricorsivamente, i moduli del progetto (sorgenti
+    nella cartella src) da cui questi importano moduli, funzioni o classi. Le librerie esterne sono escluse: le loro
+    versioni fanno parte dell'impronta del dataset.
+    :param oggetti: funzioni o moduli
+    :return: insieme dei moduli
+    """
+    moduli = set()
+    da_visitare = [inspect.getmodule(oggetto) for oggetto in oggetti]
+    while da_visitare:
+        modulo = da_visitare.pop()
+        if modulo is None or modulo in moduli or not modulo_progetto(modulo):
+            continue
+        moduli.add(modulo)
+        da_visitare.extend(inspect.getmodule(valore) for valore in vars(modulo).values()
+                           if inspect.ismodule(valore) or inspect.isfunction(valore) or inspect.isclass(valore))
+    return moduli
+
+
+def modulo_progetto(modulo) -> bool:
+    """
+    Verifica se un modulo è un sorgente del progetto (cartella src).
+    :param modulo: modulo
+    :return: True se il file del modulo si trova nella cartella src
+    """
+    file_path = getattr(modulo, '__file__', None)
+    return file_path is not None and os.path.abspath(file_path).startswith(CARTELLA_SORGENTI + os.sep)
+
+
+def chiave_fase(chiave_precedente, nome, versione, parametri=None) -> str:
+    """
+    Calcola la chiave del checkpoint di una fase concatenando la chiave della fase precedente (o l'impronta del
+    dataset, per la prima fase), il nome e la versione del codice della fase e i suoi parametri: un cambiamento in
+    una fase invalida i checkpoint di tutte le fasi successive.
+    :param chiave_precedente: chiave della fase precedente o impronta del dataset
+    :param nome: nome della fase
+    :param versione: versione del codice della fase (versione_codice)
+    :param parametri: dizionario dei parametri della fase, serializzabile in JSON (opzionale)
+    :return: chiave esadecimale
+    """
+    return calcola_hash({'precedente': chiave_precedente, 'fase': nome, 'versione': versione,
+                         'parametri': parametri or {}})
+
+
+def calcola_hash(valore) -> str:
+    """
+    Calcola l'hash SHA-256 della rappresentazione JSON canonica di un valore.
+    :param valore: valore serializzabile in JSON (i valori non serializzabili vengono convertiti in stringa)
+    :return: hash esadecimale
+    """
+    return hashlib.sha256(json.dumps(valore, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def esegui_con_checkpoint(fasi, carica_input, impronta, cartella=CARTELLA_CHECKPOINT, formato='parquet'):
+    """
+    Esegue una sequenza di fasi salvando il DataFrame prodotto da ciascuna come checkpoint. Le chiavi di tutte le
+    fasi vengono calcolate prima dell'esecuzione: l'esecuzione riprende dal checkpoint valido più profondo, senza
+    leggere il dataset di input né eseguire le fasi precedenti.
+    Ogni fase è un dizionario con:
+    - 'nome': nome della fase;
+    - 'funzione': funzione che riceve il DataFrame della fase precedente e restituisce quello della fase;
+    - 'codice': funzioni o moduli da cui dipende la fase (versione_codice);
+    - 'parametri': parametri della fase (opzionale);
+    - 'artefatti': file scritti dalla fase e letti dalle fasi successive o dalle esecuzioni seguenti (opzionale),
+      salvati insieme al checkpoint della fase e di tutte le fasi successive e ripristinati quando l'esecuzione
+      riprende da una di esse.
+    :param fasi: lista delle fasi, nell'ordine di esecuzione
+    :param carica_input: funzione senza argomenti che restituisce l'input della prima fase
+    :param impronta: impronta del dataset di input (impronta_dataset)
+    :param cartella: cartella dei checkpoint
+    :param formato: 'parquet' o 'arrow' (Arrow IPC: lettura e scrittura più veloci, file più grandi)
+    :return: DataFrame prodotto dall'ultima fase
+    """
+    chiavi = []
+    chiave = impronta
+    for fase in fasi:
+        chiave = chiave_fase(chiave, fase['nome'], versione_codice(*fase['codice']), fase.get('parametri'))
+        chiavi.append(chiave)
+
+    # Ogni checkpoint comprende anche gli artefatti delle fasi precedenti, che non vengono eseguite alla ripresa
+    artefatti = []
+    fasi_cumulative = []
+    for fase in fasi:
+        artefatti = artefatti + [artefatto for artefatto in fase.get('artefatti', []) if artefatto not in artefatti]
+        fasi_cumulative.append({**fase, 'artefatti': artefatti})
+    fasi = fasi_cumulative
+
+    # Checkpoint valido più profondo
+    ripresa = next((i for i in reversed(range(len(fasi)))
+                    if checkpoint_valido(fasi[i], chiavi[i], cartella, formato)), None)
+
+    if ripresa is None:
+        df = carica_input()
+    else:
+        logging.info(f"Ripresa dal checkpoint della fase {fasi[ripresa]['nome']}")
+        df = carica_checkpoint(fasi[ripresa], chiavi[ripresa], cartella, formato)
+
+    inizio = 0 if ripresa is None else ripresa + 1
+    for fase, chiave in zip(fasi[inizio:], chiavi[inizio:]):
+        df = fase['funzione'](df)
+        salva_checkpoint(df, fase, chiave, cartella, formato)
+
+    return df
+
+
+def percorso_checkpoint(cartella, nome, chiave, formato) -> str:
+    """
+    Percorso del file di checkpoint di una fase.
+    :param cartella: cartella dei checkpoint
+    :param nome: nome della fase
+    :param chiave: chiave della fase (chiave_fase)
+    :param formato: 'parquet' o 'arrow'
+    :return: percorso del file
+    """
+    return os.path.join(cartella, f'{nome}_{chiave[:24]}{FORMATI_CHECKPOINT[formato]}')
+
+
+def checkpoint_valido(fase, chiave, cartella, formato) -> bool:
+    """
+    Verifica se il checkpoint di una fase esiste, insieme a tutti i suoi artefatti.
+    :param fase: dizionario della fase
+    :param chiave: chiave della fase
+    :param cartella: cartella dei checkpoint
+    :param formato: 'parquet' o 'arrow'
+    :return: True se il checkpoint può essere usato
+    """
+    file_path = percorso_checkpoint(cartella, fase['nome'], chiave, formato)
+    return os.path.isfile(file_path) and all(os.path.isfile(os.path.join(file_path + '.artefatti', artefatto))
+                                             for artefatto in fase.get('artefatti', []))
+
+
+@misura()
+def salva_checkpoint(df, fase, chiave, cartella=CARTELLA_CHECKPOINT, formato='parquet'):
+    """
+    Salva il DataFrame prodotto da una fase e i suoi artefatti. I checkpoint precedenti della stessa fase (con
+    chiavi diverse) vengono eliminati, per limitare lo spazio occupato. Il file viene scritto con un nome
+    temporaneo e rinominato solo a scrittura completata: un'esecuzione interrotta non lascia checkpoint parziali.
+    :param df: DataFrame prodotto dalla fase
+    :param fase: dizionario della fase
+    :param chiave: chiave della fase
+    :param cartella: cartella dei checkpoint
+    :param formato: 'parquet' o 'arrow'
+    :return: None
+    """
+    os.makedirs(cartella, exist_ok=True)
+    for precedente in glob.glob(os.path.join(glob.escape(cartella), f"{fase['nome']}_*")):
+        if os.path.isdir(precedente):
+            shutil.rmtree(precedente)
+        else:
+            os.remove(precedente)
+
+    file_path = percorso_checkpoint(cartella, fase['nome'], chiave, formato)
+    for artefatto in fase.get('artefatti', []):
+        destinazione = os.path.join(file_path + '.artefatti', artefatto)
+        os.makedirs(os.path.dirname(destinazione), exist_ok=True)
+        shutil.copy2(artefatto, destinazione)
+
+    table = pa.Table.from_pandas(df)
+    table = table.replace_schema_metadata({**table.schema.metadata, b'chiave': chiave.encode(),
+                                           b'fase': fase['nome'].encode()})
+    temporaneo = file_path + '.tmp'
+    if formato == 'arrow':
+        with pa.OSFile(temporaneo, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, temporaneo)
+    os.replace(temporaneo, file_path)
+    logging.info(f"Checkpoint della fase {fase['nome']} salvato in {file_path}")
+
+
+@misura()
+def carica_checkpoint(fase, chiave, cartella=CARTELLA_CHECKPOINT, formato='parquet') -> pd.DataFrame:
+    """
+    Carica il DataFrame salvato da una fase e ripristina i suoi artefatti nei percorsi originali.
+    :param fase: dizionario della fase
+    :param chiave: chiave della fase
+    :param cartella: cartella dei checkpoint
+    :param formato: 'parquet' o 'arrow'
+    :return: DataFrame prodotto dalla fase
+    """
+    file_path = percorso_checkpoint(cartella, fase['nome'], chiave, formato)
+    for artefatto in fase.get('artefatti', []):
+        if os.path.dirname(artefatto):
+            os.makedirs(os.path.dirname(artefatto), exist_ok=True)
+        shutil.copy2(os.path.join(file_path + '.artefatti', artefatto), artefatto)
+
+    if formato == 'arrow':
+        with pa.memory_map(file_path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    else:
+        table = pq.read_table(file_path)
+    return table.to_pandas()
@@ -4,12 +4,14 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import matplotlib.ticker as mticker
+from instrumentation.instrumentation import misura
 
 # Configuro il logger
 logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
                     format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
 
 
+@misura()
 def analyze_clustering(df, numerical_features, categorical_features, reverse_mapping, cluster_year_mapping):
     """
     Genera grafici per analizzare la distribuzione delle feature nei cluster.
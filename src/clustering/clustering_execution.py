@@ -1,22 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import logging
+import numpy as np
 from matplotlib import pyplot as plt
 from sklearn.cluster import KMeans
 from sklearn.decomposition import TruncatedSVD
-from sklearn.pipeline import Pipeline
+from threadpoolctl import threadpool_limits
 from src.clustering.clustering_analyzer import analyze_clustering
 from src.clustering.clustering_metrics import compute_all_metrics
+from src.clustering.shared_matrix import condividi_matrice, rilascia_matrice, valuta_in_parallelo
+from data_transformation.data_transformation import costruisci_matrice, costruisci_matrice_sparsa
+from instrumentation.instrumentation import misura
 
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
 
-def execute_clustering(df, label_encoders, numerical_features, categorical_features, reverse_mapping):
+# Matrice delle feature e sua proiezione TruncatedSVD calcolata da adatta_kmeans_proiezione (es. in un processo worker)
+_proiezioni = {}
+
+
+@misura()
+def execute_clustering(df, label_encoders, numerical_features, categorical_features, reverse_mapping,
+                       condivisione=None, processi=None, codifica='label', pesi_frequenza=False, n_clusters=4,
+                       thread=None, thread_blas=1):
     """
     Metodo che esegue tutti i metodi del file clustering_execution
     :param df: dataFrame
+    :param label_encoders: vocabolari delle feature categoriche (data_transformation)
+    :param condivisione: se 'memmap' o 'shm' la matrice delle feature viene scritta una sola volta in un file .npy o
+                         in memoria condivisa e l'elbow method viene valutato in processi separati che la aprono senza
+                         copiarla e ne calcolano la proiezione TruncatedSVD (shared_matrix); se None l'elbow method
+                         viene valutato su un pool di thread
+    :param processi: numero di processi worker con condivisione (di default il numero di CPU)
+    :param codifica: 'label' per la matrice densa dei codici (costruisci_matrice), 'onehot' per la matrice CSR con
+                     codifica one-hot delle feature categoriche (costruisci_matrice_sparsa)
+    :param pesi_frequenza: con codifica 'onehot' pesa i codici con l'inverso della radice della frequenza
+    :param n_clusters: numero di cluster, o 'auto' per usare il gomito della curva dell'inertia (trova_gomito)
+    :param thread: numero di thread dell'elbow method senza condivisione (di default il numero di CPU)
+    :param thread_blas: numero massimo di thread BLAS e OpenMP di ogni worker dell'elbow method (None: nessun limite)
     :return: df
     """
-    # Calcolo del numero ottimale di cluster
-    plot_elbow_method(df, max_clusters=10)
+    # Matrice float32 delle feature, condivisa da elbow method, clustering e silhouette
+    if codifica == 'onehot':
+        matrice = costruisci_matrice_sparsa(df, categorical_features, label_encoders, pesi_frequenza=pesi_frequenza)
+    elif codifica == 'label':
+        matrice = costruisci_matrice(df)
+    else:
+        raise ValueError(f"Codifica non valida: {codifica} (valori ammessi: 'label', 'onehot')")
+
+    # Proiezione TruncatedSVD, calcolata una sola volta per elbow method e clustering
+    svd_data = riduci_dimensionalita(matrice)
+
+    # Calcolo del numero ottimale di cluster: i modelli adattati vengono riutilizzati dal clustering
+    modelli = plot_elbow_method(svd_data, max_clusters=10, condivisione=condivisione, processi=processi,
+                                thread=thread, thread_blas=thread_blas, matrice=matrice)
+    if n_clusters == 'auto':
+        n_clusters = trova_gomito(list(modelli), [modello.inertia_ for modello in modelli.values()])
 
     # Applicazione del clustering
-    labels, svd_data = apply_clustering(df, n_clusters=4)
+    labels, svd_data = apply_clustering(matrice, n_clusters=n_clusters, svd_data=svd_data,
+                                        modello=modelli.get(n_clusters))
 
     # Aggiungiamo le etichette e le componenti principali al dataframe originale
     df['Cluster'] = labels
@@ -28,28 +72,72 @@ def execute_clustering(df, label_encoders, numerical_features, categorical_featu
     analyze_clustering(df, numerical_features, categorical_features, reverse_mapping, cluster_year_mapping)
 
     # Calcolo delle metriche
-    compute_all_metrics(df, target_column='incremento')
+    compute_all_metrics(df, target_column='incremento', matrice=matrice)
 
     return df, labels, svd_data
 
 
-def plot_elbow_method(data, max_clusters=10):
+@misura()
+def riduci_dimensionalita(data, n_components=None):
     """
-    Visualizza l'elbow method per la ricerca del numero ottimale di cluster.
-    :param data: dati del clustering
-    :param max_clusters: numero massimo di cluster da esplorare
-    :return: None
+    Riduce la dimensionalità dei dati con TruncatedSVD (anche su matrici sparse, senza convertirle in dense).
+    :param data: dati del clustering (matrice di costruisci_matrice o costruisci_matrice_sparsa, o dataFrame)
+    :param n_components: numero di componenti (di default al più 10, e non più del numero di feature)
+    :return: dati trasformati con TruncatedSVD
     """
-    inertia = []  # Lista per memorizzare l'inertia (somma delle distanze al quadrato dai centroidi)
+    if n_components is None:
+        n_components = min(10, data.shape[1])  # Imposta il numero massimo di componenti in base al numero di feature
+
+    return TruncatedSVD(n_components=n_components, random_state=42).fit_transform(data)
 
-    for n_clusters in range(1, max_clusters + 1):
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        kmeans.fit(data)
-        inertia.append(kmeans.inertia_)  # Aggiungi l'inertia per il numero corrente di cluster
 
-    # Plot dell'Elbow Method
+@misura()
+def plot_elbow_method(data, max_clusters=10, condivisione=None, processi=None, thread=None, thread_blas=1,
+                      matrice=None) -> dict:
+    """
+    Visualizza l'elbow method per la ricerca del numero ottimale di cluster. I valori di k vengono valutati in
+    parallelo, ognuno con al più thread_blas thread BLAS e OpenMP: su un pool di thread, o con condivisione su un
+    pool di processi che aprono la matrice senza copiarla (shared_matrix).
+    :param data: dati del clustering (di norma la proiezione di riduci_dimensionalita)
+    :param max_clusters: numero massimo di cluster da esplorare
+    :param condivisione: None per il pool di thread, 'memmap' o 'shm' per il pool di processi
+    :param processi: numero di processi worker (di default il numero di CPU)
+    :param thread: numero di thread worker (di default il numero di CPU)
+    :param thread_blas: numero massimo di thread BLAS e OpenMP di ogni worker (None: nessun limite)
+    :param matrice: matrice delle feature da cui è stato proiettato data (opzionale). Con condivisione viene condivisa
+                    la matrice invece di data, e ogni processo worker ne calcola una sola volta la proiezione con
+                    riduci_dimensionalita, riutilizzata per tutti i suoi valori di k.
+    :return: dizionario {numero di cluster: KMeans adattato}
+    """
+    # Un K-Means per ogni numero di cluster
+    valori_k = list(range(1, max_clusters + 1))
+    configurazioni = [{'n_clusters': n_clusters} for n_clusters in valori_k]
+    if condivisione:
+        if matrice is None:
+            descrittore, funzione = condividi_matrice(data, condivisione), adatta_kmeans
+        else:
+            descrittore, funzione = condividi_matrice(matrice, condivisione), adatta_kmeans_proiezione
+            for configurazione in configurazioni:
+                configurazione['n_components'] = data.shape[1]
+        try:
+            modelli = valuta_in_parallelo(descrittore, funzione, configurazioni, processi=processi,
+                                          thread_blas=thread_blas)
+        finally:
+            rilascia_matrice(descrittore)
+    else:
+        # I limiti vengono impostati una sola volta, attorno all'intera valutazione e non nei singoli K-Means che
+        # verrebbero eseguiti in parallelo: quello dei thread BLAS vale per tutto il processo, quello dei thread OpenMP
+        # viene impostato da ogni thread worker alla sua creazione
+        with threadpool_limits(limits=thread_blas, user_api='blas'), \
+                ThreadPoolExecutor(max_workers=min(thread or os.cpu_count(), len(valori_k)),
+                                   initializer=threadpool_limits, initargs=(thread_blas, 'openmp')) as executor:
+            modelli = list(executor.map(lambda configurazione: adatta_kmeans(data, **configurazione),
+                                        configurazioni))
+    modelli = dict(zip(valori_k, modelli))
+
+    # Plot dell'Elbow Method con l'inertia (somma delle distanze al quadrato dai centroidi)
     plt.figure(figsize=(8, 6))
-    plt.plot(range(1, max_clusters + 1), inertia, marker='o')
+    plt.plot(valori_k, [modello.inertia_ for modello in modelli.values()], marker='o')
     plt.xlabel('Numero di Cluster')
     plt.ylabel('Inertia')
     plt.title('Metodo del Gomito')
@@ -58,27 +146,74 @@ def plot_elbow_method(data, max_clusters=10):
     plt.savefig('graphs/elbow_method.png')
     plt.close()
 
+    return modelli
 
-def apply_clustering(data, n_clusters=4, n_components=None):
+
+def adatta_kmeans(data, n_clusters) -> KMeans:
     """
-    Esegue il clustering K-Means applicando una riduzione della dimensionalità dei dati con TruncatedSVD.
-    :param data: dataFrame dei dati
+    Adatta il K-Means con n_clusters cluster, con i limiti dei thread BLAS e OpenMP impostati dal chiamante (es.
+    plot_elbow_method).
+    :param data: dati del clustering
     :param n_clusters: numero di cluster
-    :param n_components:
-    :return labels, svd_data: etichette del clusterin e dati trasformati con Truncated SVD
+    :return: KMeans adattato
     """
+    return KMeans(n_clusters=n_clusters, random_state=42).fit(data)
 
-    if n_components is None:
-        n_components = min(10, data.shape[1])  # Imposta il numero massimo di componenti in base al numero di feature
 
-    # Pipeline per il clustering con TruncatedSVD
-    pipeline = Pipeline(steps=[
-        ('dim_reduction', TruncatedSVD(n_components=n_components)),
-        ('clustering', KMeans(n_clusters=n_clusters, random_state=42))
-    ])
-    labels = pipeline.fit_predict(data)
-    svd_data = pipeline.named_steps['dim_reduction'].transform(data)
-    return labels, svd_data
+def adatta_kmeans_proiezione(matrice, n_clusters, n_components=None) -> KMeans:
+    """
+    Adatta il K-Means con n_clusters cluster sulla proiezione TruncatedSVD della matrice delle feature. La proiezione
+    viene calcolata alla prima chiamata e riutilizzata dalle chiamate successive sulla stessa matrice (es. tutti i
+    valori di k valutati da un processo worker di valuta_in_parallelo).
+    :param matrice: matrice delle feature (es. aperta da apri_matrice)
+    :param n_clusters: numero di cluster
+    :param n_components: numero di componenti di TruncatedSVD
+    :return: KMeans adattato
+    """
+    # Il riferimento alla matrice viene mantenuto con la proiezione, quindi il suo id non può essere riutilizzato
+    chiave = (id(matrice), n_components)
+    if chiave not in _proiezioni:
+        _proiezioni.clear()
+        _proiezioni[chiave] = (matrice, riduci_dimensionalita(matrice, n_components))
+    return adatta_kmeans(_proiezioni[chiave][1], n_clusters)
+
+
+def trova_gomito(valori_k, inertia) -> int:
+    """
+    Rileva il gomito della curva dell'inertia (metodo Kneedle): dopo aver normalizzato k e inertia in [0, 1], è il
+    valore di k in cui la curva è più lontana, in verticale, dalla retta che unisce il primo e l'ultimo punto.
+    :param valori_k: numeri di cluster valutati, in ordine crescente
+    :param inertia: inertia di ogni numero di cluster
+    :return: numero di cluster consigliato
+    """
+    x = np.asarray(valori_k, dtype=np.float64)
+    y = np.asarray(inertia, dtype=np.float64)
+    if len(x) < 3 or y[0] <= y[-1]:
+        return int(x[0])
+
+    x = (x - x[0]) / (x[-1] - x[0])
+    y = (y - y[-1]) / (y[0] - y[-1])
+    gomito = int(valori_k[int(np.argmax((1 - x) - y))])
+    logging.info(f"Gomito della curva dell'inertia: {gomito} cluster")
+    return gomito
+
+
+@misura()
+def apply_clustering(data, n_clusters=4, n_components=None, svd_data=None, modello=None):
+    """
+    Esegue il clustering K-Means applicando una riduzione della dimensionalità dei dati con TruncatedSVD.
+    :param data: dati del clustering (matrice di costruisci_matrice o costruisci_matrice_sparsa, o dataFrame)
+    :param n_clusters: numero di cluster
+    :param n_components: numero di componenti di TruncatedSVD
+    :param svd_data: dati già trasformati con riduci_dimensionalita (se None la riduzione viene calcolata)
+    :param modello: KMeans con n_clusters cluster già adattato su svd_data (es. da plot_elbow_method)
+    :return labels, svd_data: etichette del clusterin e dati trasformati con Truncated SVD
+    """
+    if svd_data is None:
+        svd_data = riduci_dimensionalita(data, n_components)
+    if modello is None:
+        modello = adatta_kmeans(svd_data, n_clusters)
+    return modello.labels_, svd_data
 
 
 def generate_cluster_year_mapping(df, year_column='year', month_column='month'):
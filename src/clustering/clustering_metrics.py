@@ -5,25 +5,28 @@ from sklearn.metrics import silhouette_samples
 import numpy as np
 from sklearn.preprocessing import LabelEncoder
 import logging
+from data_transformation.data_transformation import costruisci_matrice
+from instrumentation.instrumentation import misura
 
 # Configuro il logger
 logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
                     format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
 
 
-def compute_all_metrics(df: pd.DataFrame, target_column='incremento'):
+@misura()
+def compute_all_metrics(df: pd.DataFrame, target_column='incremento', matrice=None):
     """
      Calcola tutte le metriche e genera i grafici per il clustering.
      :param df: DataFrame contenente i dati, inclusi i cluster.
-     :param label_encoders: Dizionario di LabelEncoders per la decodifica.
      :param target_column: La colonna target rispetto alla quale calcolare le metriche.
+     :param matrice: matrice delle feature usata per il clustering (costruisci_matrice), opzionale
      """
 
     # Calcolo la purezza di ogni cluster e la purezza media del clustering
     cluster_purity, purity_score = compute_purity(df, target_column)
 
     # Calcolo dell'indice di Silhouette
-    silhouette_score = compute_silhouette_score(df)
+    silhouette_score = compute_silhouette_score(df, matrice)
 
     # Plot della purezza dei cluster
     plot_purity_bars(cluster_purity, purity_score)
@@ -33,26 +36,32 @@ def compute_all_metrics(df: pd.DataFrame, target_column='incremento'):
     print(f"\nLa metrica finale è : {final_metric:.2f}")
 
 
-def compute_silhouette_score(df: pd.DataFrame):
+@misura()
+def compute_silhouette_score(df: pd.DataFrame, matrice=None):
     """
     Calcola e restituisce il Silhouette Score per il clustering effettuato,
     normalizzato nel range [0, 1].
     :param df: DataFrame con i dati (inclusa la colonna 'Cluster')
+    :param matrice: matrice delle feature usata per il clustering (costruisci_matrice), con le righe di df. Se non
+                    specificata viene costruita dalle colonne di df diverse da 'Cluster'
     :return: Valore normalizzato del Silhouette Score
     """
-
-    # Rimuoviamo la colonna Cluster dalle feature per il calcolo del silhouette
-    encoded_features = df.drop(columns=['Cluster'])
     labels = df['Cluster']
 
-    # Convertiamo le colonne categoriali in numeriche utilizzando LabelEncoder
-    for col in encoded_features.columns:
-        if encoded_features[col].dtype == 'object' or encoded_features[col].dtype.name == 'category':
-            le = LabelEncoder()
-            encoded_features[col] = le.fit_transform(encoded_features[col])
+    if matrice is None:
+        # Rimuoviamo la colonna Cluster dalle feature per il calcolo del silhouette
+        encoded_features = df.drop(columns=['Cluster'])
+
+        # Convertiamo le colonne categoriali in numeriche utilizzando LabelEncoder
+        for col in encoded_features.columns:
+            if encoded_features[col].dtype == 'object' or encoded_features[col].dtype.name == 'category':
+                le = LabelEncoder()
+                encoded_features[col] = le.fit_transform(encoded_features[col])
+
+        matrice = costruisci_matrice(encoded_features)
 
     # Calcola i valori del silhouette per ciascun campione
-    silhouette_values = silhouette_samples(encoded_features, labels)
+    silhouette_values = silhouette_samples(matrice, labels)
 
     # Normalizza i valori del silhouette nel range [0, 1]
     normalized_silhouette_values = (silhouette_values - silhouette_values.min()) / (
@@ -61,11 +70,12 @@ def compute_silhouette_score(df: pd.DataFrame):
     # Calcola il silhouette score medio normalizzato
     final_score = np.mean(normalized_silhouette_values)
 
-    print(f"L'indice di Silhouette medio normalizzato è : {final_score}")
+    logging.info(f"L'indice di Silhouette medio normalizzato è : {final_score}")
 
     return final_score
 
 
+@misura()
 def compute_purity(df: pd.DataFrame, target_column: str):
     """
     Calcola la purezza del clustering per ciascun cluster e la purezza media ponderata.
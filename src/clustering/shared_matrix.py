@@ -0,0 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import time
+import numpy as np
+from scipy import sparse
+from threadpoolctl import threadpool_limits
+import logging
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Modalità di condivisione della matrice delle feature fra processi
+MODI_CONDIVISIONE = ['memmap', 'shm']
+
+# Cartella dei file .npy delle matrici condivise in modalità memmap
+CARTELLA_MATRICI = 'datasets/matrici'
+
+# Blocchi di memoria condivisa aperti dal processo, da mantenere finché la matrice è in uso
+_blocchi = {}
+
+# Matrice aperta da ogni processo worker (valuta_in_parallelo)
+_matrice_worker = None
+
+
+def condividi_matrice(matrice, modo='memmap', cartella=CARTELLA_MATRICI) -> dict:
+    """
+    Scrive una sola volta la matrice delle feature in un file .npy (modo 'memmap') o in un blocco di memoria condivisa
+    (modo 'shm'), da cui gli altri processi la aprono con apri_matrice senza copiarla. Di una matrice sparsa CSR
+    vengono condivisi i tre array data, indices e indptr.
+    :param matrice: matrice densa (es. costruisci_matrice) o CSR (es. costruisci_matrice_sparsa)
+    :param modo: 'memmap' o 'shm'
+    :param cartella: cartella dei file .npy in modalità memmap
+    :return: descrittore da passare ad apri_matrice e rilascia_matrice
+    """
+    if sparse.issparse(matrice):
+        matrice = matrice.tocsr()
+        return {'formato': 'csr', 'shape': matrice.shape,
+                'parti': {parte: condividi_array(getattr(matrice, parte), modo, cartella)
+                          for parte in ('data', 'indices', 'indptr')}}
+    return condividi_array(matrice, modo, cartella)
+
+
+def condividi_array(array, modo='memmap', cartella=CARTELLA_MATRICI) -> dict:
+    """
+    Scrive una sola volta un array denso in un file .npy (modo 'memmap') o in un blocco di memoria condivisa (modo
+    'shm').
+    :param array: array denso
+    :param modo: 'memmap' o 'shm'
+    :param cartella: cartella del file .npy in modalità memmap
+    :return: descrittore {'modo', 'nome', 'shape', 'dtype'}
+    """
+    array = np.ascontiguousarray(array)
+    if modo == 'memmap':
+        os.makedirs(cartella, exist_ok=True)
+        nome = os.path.abspath(os.path.join(cartella, f'matrice-{os.getpid()}-{time.time_ns()}.npy'))
+        np.save(nome, array)
+    elif modo == 'shm':
+        blocco = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=blocco.buf)[...] = array
+        nome = blocco.name
+        _blocchi[nome] = blocco
+    else:
+        raise ValueError(f"Modalità di condivisione non valida: {modo} (valori ammessi: {MODI_CONDIVISIONE})")
+
+    logging.info(f"Array {array.shape} condiviso in modalità {modo} ({array.nbytes / 2 ** 20:.1f} MB): {nome}")
+    return {'modo': modo, 'nome': nome, 'shape': array.shape, 'dtype': array.dtype.str}
+
+
+def apri_matrice(descrittore):
+    """
+    Apre in sola lettura, senza copiarla, una matrice scritta da condividi_matrice.
+    :param descrittore: descrittore restituito da condividi_matrice
+    :return: matrice (np.memmap o array sul blocco di memoria condivisa, o matrice CSR costruita su di essi)
+    """
+    if descrittore.get('formato') == 'csr':
+        parti = {parte: apri_array(parte_descrittore) for parte, parte_descrittore in descrittore['parti'].items()}
+        return sparse.csr_matrix((parti['data'], parti['indices'], parti['indptr']), shape=descrittore['shape'],
+                                 copy=False)
+    return apri_array(descrittore)
+
+
+def apri_array(descrittore) -> np.ndarray:
+    """
+    Apre in sola lettura, senza copiarlo, un array scritto da condividi_array.
+    :param descrittore: descrittore restituito da condividi_array
+    :return: np.memmap o array sul blocco di memoria condivisa
+    """
+    if descrittore['modo'] == 'memmap':
+        return np.load(descrittore['nome'], mmap_mode='r')
+
+    blocco = _blocchi.get(descrittore['nome'])
+    if blocco is None:
+        blocco = _blocchi[descrittore['nome']] = shared_memory.SharedMemory(name=descrittore['nome'])
+    array = np.ndarray(descrittore['shape'], dtype=descrittore['dtype'], buffer=blocco.buf)
+    array.flags.writeable = False
+    return array
+
+
+def rilascia_matrice(descrittore):
+    """
+    Elimina i file o i blocchi di memoria condivisa di una matrice scritta da condividi_matrice (da chiamare nel
+    processo che l'ha creata, quando i worker hanno terminato).
+    :param descrittore: descrittore restituito da condividi_matrice
+    :return: None
+    """
+    for parte in descrittore['parti'].values() if descrittore.get('formato') == 'csr' else [descrittore]:
+        if parte['modo'] == 'memmap':
+            if os.path.isfile(parte['nome']):
+                os.remove(parte['nome'])
+            continue
+
+        blocco = _blocchi.pop(parte['nome'], None)
+        if blocco is not None:
+            blocco.close()
+            blocco.unlink()
+
+
+def valuta_in_parallelo(descrittore, funzione, configurazioni, processi=None, thread_blas=None) -> list:
+    """
+    Valuta più configurazioni del clustering in processi separati: ogni worker apre una sola volta la matrice
+    condivisa, quindi la memoria occupata non cresce con il numero di processi. La funzione viene chiamata come
+    funzione(matrice, **configurazione) e deve essere definita al livello di un modulo, per poter essere inviata ai
+    worker. Con il metodo di avvio 'spawn' (Windows, macOS) lo script chiamante deve essere protetto da
+    if __name__ == '__main__'.
+    :param descrittore: descrittore restituito da condividi_matrice
+    :param funzione: funzione da valutare
+    :param configurazioni: lista di dizionari di parametri, uno per valutazione
+    :param processi: numero di processi worker (di default il numero di CPU)
+    :param thread_blas: numero massimo di thread BLAS e OpenMP di ogni worker (None: nessun limite)
+    :return: lista dei risultati, nell'ordine delle configurazioni
+    """
+    processi = min(processi or os.cpu_count(), max(len(configurazioni), 1))
+    with ProcessPoolExecutor(max_workers=processi, initializer=inizializza_worker,
+                             initargs=(descrittore, thread_blas)) as executor:
+        futures = [executor.submit(valuta_configurazione, funzione, configurazione)
+                   for configurazione in configurazioni]
+        return [future.result() for future in futures]
+
+
+def inizializza_worker(descrittore, thread_blas=None):
+    """
+    Apre la matrice condivisa in un processo worker di valuta_in_parallelo e limita i suoi thread BLAS e OpenMP.
+    :param descrittore: descrittore restituito da condividi_matrice
+    :param thread_blas: numero massimo di thread BLAS e OpenMP (None: nessun limite)
+    :return: None
+    """
+    global _matrice_worker
+    _matrice_worker = apri_matrice(descrittore)
+    threadpool_limits(limits=thread_blas)
+
+
+def valuta_configurazione(funzione, configurazione):
+    """
+    Valuta una configurazione sulla matrice aperta dal processo worker.
+    :param funzione: funzione da valutare
+    :param configurazione: dizionario dei parametri
+    :return: risultato della funzione
+    """
+    return funzione(_matrice_worker, **configurazione)
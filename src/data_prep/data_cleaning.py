@@ -1,12 +1,22 @@
+import numpy as np
 import pandas as pd
 import logging
+from data_prep.istat_reference import codice_comune_to_nome, dict_province
+from data_prep.schema import COLONNE_TEMPORALI, NAT_INT64, epoch_ns, da_epoch_ns
+from instrumentation.instrumentation import misura
 
 # Configuro il logger
 logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
                     format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
 
+# Durata media per attività e limiti IQR calcolati sull'intero dataset, salvati per pulire i nuovi dati con gli
+# stessi parametri (modalità incrementale)
+FILE_MEDIA_DURATA = 'datasets/media_durata.parquet'
+FILE_LIMITI_OUTLIERS = 'datasets/limiti_outliers.parquet'
 
-def data_cleaning(df) -> pd.DataFrame:
+
+@misura()
+def data_cleaning(df, media_durata=None, limiti=None, salva_parametri=False) -> pd.DataFrame:
     """
     Esegue le operazioni di pulizia del dataset df.
     1) imputazione dei valori mancanti e rimozione dei campioni con 'data_disdetta' non nullo.
@@ -14,10 +24,19 @@ def data_cleaning(df) -> pd.DataFrame:
     3) Gestione dei dati rumorosi.
     4) Rimozione dei duplicati.
     :param df:
+    :param media_durata: durata media per 'codice_descrizione_attivita' già calcolata (opzionale, es. caricata con
+                         carica_parametri_pulizia). Se None, viene calcolata sul dataset.
+    :param limiti: limiti IQR delle colonne temporali già calcolati (opzionale, es. caricati con
+                   carica_parametri_pulizia). Se None, vengono calcolati sul dataset.
+    :param salva_parametri: se True salva la durata media e i limiti usati (salva_parametri_pulizia)
     :return:
     """
+    # Durata media delle attività, calcolata prima dell'imputazione degli orari
+    if media_durata is None:
+        media_durata = calcola_media_durata(df)
+
     # Imputazione dei valori mancanti
-    df = imputate_missing_values(df)
+    df = imputate_missing_values(df, media_durata)
 
     # Rimozione dei campioni con 'data_disdetta' non nullo
     df = remove_disdette(df)
@@ -28,13 +47,18 @@ def data_cleaning(df) -> pd.DataFrame:
     logging.info(df[colonne_con_mancanti].isnull().sum())
     logging.info('-----------------------------------')
 
+    # Limiti IQR, calcolati dopo l'imputazione e la rimozione delle televisite disdette
+    if limiti is None:
+        limiti = calcola_limiti_outliers(df, COLONNE_TEMPORALI)
+
+    if salva_parametri:
+        salva_parametri_pulizia(media_durata, limiti)
+
     # Identificazione e rimozione outliers dalle colonne specificate
-    df = identify_and_remove_outliers(df, ['data_nascita', 'data_contatto', 'data_erogazione', 'ora_inizio_erogazione',
-                                           'ora_fine_erogazione'])
+    df = identify_and_remove_outliers(df, COLONNE_TEMPORALI, limiti)
 
     # Gestione dei dati rumorosi nella colonna specificata
-    df = smooth_noisy_data(df, ['data_nascita', 'data_contatto', 'data_erogazione', 'ora_inizio_erogazione',
-                                'ora_fine_erogazione'])
+    df = smooth_noisy_data(df, COLONNE_TEMPORALI)
 
     # Rimozione dei duplicati
     df = remove_duplicati(df)
@@ -45,7 +69,8 @@ def data_cleaning(df) -> pd.DataFrame:
     return df
 
 
-def imputate_missing_values(df) -> pd.DataFrame:
+@misura()
+def imputate_missing_values(df, media_durata=None) -> pd.DataFrame:
     """
     Imputa i valori mancanti del dataset df. Dopo una prima analisi si hanno i seguenti risultati:
     Statistiche valori mancanti prima dell'imputazione:
@@ -62,6 +87,7 @@ def imputate_missing_values(df) -> pd.DataFrame:
     produce risultati in quanto i valori mancanti sono relativi al comune di 'None', motivo per il quale non si può
     parlare di missing values. 'ora_inizio_erogazione' e 'ora_fine_erogazione' vengono imputati correttamente.
     :param df:
+    :param media_durata: durata media per 'codice_descrizione_attivita' già calcolata (opzionale).
     :return:
     """
     # Visualizzo le statistiche dei valori mancanti prima dell'imputazione
@@ -70,27 +96,47 @@ def imputate_missing_values(df) -> pd.DataFrame:
     logging.info(df[colonne_con_mancanti].isnull().sum())
     logging.info('-----------------------------------')
 
+    df = applica_imputazioni(df, media_durata)
+
+    # Visualizzo le statistiche dei valori mancanti dopo l'imputazione
+    logging.info("Statistiche valori mancanti dopo la rimozione dei campioni relativi a televisite disdette:")
+    colonne_con_mancanti = df.columns[df.isnull().any()]
+    logging.info(df[colonne_con_mancanti].isnull().sum())
+    logging.info('-----------------------------------')
+
+    return df
+
+
+def applica_imputazioni(df, media_durata=None) -> pd.DataFrame:
+    """
+    Applica le imputazioni dei valori mancanti alle colonne presenti nel DataFrame. Le imputazioni relative a
+    colonne non caricate (es. lettura con proiezione delle colonne) vengono saltate.
+    :param df:
+    :param media_durata: durata media per 'codice_descrizione_attivita' già calcolata (opzionale).
+    :return:
+    """
+    def colonne_presenti(*colonne):
+        return all(col in df.columns for col in colonne)
+
     # Imputazione dei valori mancanti relativi a comune_residenza
-    df = imputate_comune_residenza(df)  # Valori mancanti relativi al comune di 'None' in provincia di Torino.
+    if colonne_presenti('codice_comune_residenza', 'comune_residenza'):
+        df = imputate_comune_residenza(df)  # Valori mancanti relativi al comune di 'None' in provincia di Torino.
 
     # Imputazione dei valori mancanti relativi a codice_provincia_residenza
-    df = imputate_codice_provincia_residenza(df)  # Valori mancanti relativi al codice della provincia di Napoli, 'NA'.
+    if colonne_presenti('codice_provincia_residenza', 'provincia_residenza'):
+        df = imputate_codice_provincia_residenza(df)  # Valori mancanti relativi al codice della provincia di Napoli, 'NA'.
 
     # Imputazione dei valori mancanti relativi a codice_provincia_erogazione
-    df = imputate_codice_provincia_erogazione(df)  # Valori mancanti relativi al codice della provincia di Napoli, 'NA'.
+    if colonne_presenti('codice_provincia_erogazione', 'provincia_erogazione'):
+        df = imputate_codice_provincia_erogazione(df)  # Valori mancanti relativi al codice della provincia di Napoli, 'NA'.
 
     # Imputazione dei valori mancanti relativi a ora_inizio_erogazione e ora_fine_erogazione
-    df = imputate_ora_inizio_erogazione_and_ora_fine_erogazione(df)
-
-    # Visualizzo le statistiche dei valori mancanti dopo l'imputazione
-    logging.info("Statistiche valori mancanti dopo la rimozione dei campioni relativi a televisite disdette:")
-    colonne_con_mancanti = df.columns[df.isnull().any()]
-    logging.info(df[colonne_con_mancanti].isnull().sum())
-    logging.info('-----------------------------------')
+    df = imputate_ora_inizio_erogazione_and_ora_fine_erogazione(df, media_durata)
 
     return df
 
 
+@misura()
 def remove_duplicati(df) -> pd.DataFrame:
     """
     Rimuove i duplicati dal dataset df.
@@ -101,106 +147,268 @@ def remove_duplicati(df) -> pd.DataFrame:
     return df
 
 
-def smooth_noisy_data(df, columns, window_size=3):
+@misura()
+def smooth_noisy_data(df, columns, window_size=3, gruppi=None):
     """
     La funzione ha il compito di smussare i dati rumorosi utilizzando la media mobile. La funzione viene applicata a feature e temporali.
+    Le colonne temporali devono essere già in formato datetime (applica_schema): la media mobile viene calcolata con
+    media_mobile_ns direttamente sulla vista int64 in nanosecondi della colonna ed è esatta al nanosecondo. Rispetto
+    al calcolo precedente sui secondi in float64 (Timestamp.timestamp, arrotondato al microsecondo) i valori
+    differiscono di meno di 1 µs, e il risultato resta in UTC invece di perdere il fuso orario.
     :param df: Il DataFrame originale.
     :param column: La colonna su cui applicare il smoothing.
     :param window_size: La dimensione della finestra per la media mobile.
+    :param gruppi: colonna o lista di colonne (opzionale, es. 'struttura_erogazione'). Se specificato, la media mobile
+                   viene calcolata separatamente all'interno di ciascun gruppo, nell'ordine del DataFrame.
     :return: Un DataFrame con i dati smussati.
     """
+    codici_gruppo = None if gruppi is None else df.groupby(gruppi, sort=False, dropna=False).ngroup().to_numpy()
+
     for column in columns:
         if pd.api.types.is_datetime64_any_dtype(df[column]):
-            # Converto la colonna datetime in timestamp numerico
-            df[column] = pd.to_datetime(df[column], errors='coerce')
-            df[column] = df[column].map(pd.Timestamp.timestamp)
-
-            # Applico la funzione rolling().mean() sul dato numerico
-            df[column] = df[column].rolling(window=window_size, min_periods=1).mean()
-
-            # Riconverto il timestamp in datetime
-            df[column] = pd.to_datetime(df[column], unit='s')
+            media = media_mobile_ns(epoch_ns(df[column]), window_size, codici_gruppo)
+            df[column] = da_epoch_ns(media, df.index)
 
         elif pd.api.types.is_numeric_dtype(df[column]):
             # Se la colonna è numerica, applico la funzione rolling().mean()
-            df[column] = df[column].rolling(window=window_size, min_periods=1).mean()
-
-        elif df[column].dtype == 'object':
-            try:
-                # Provo a convertire la colonna in datetime
-                df[column] = pd.to_datetime(df[column], errors='coerce')
+            if gruppi is None:
+                df[column] = df[column].rolling(window=window_size, min_periods=1).mean()
+            else:
+                df[column] = df.groupby(codici_gruppo)[column].transform(
+                    lambda serie: serie.rolling(window=window_size, min_periods=1).mean())
 
-                # Se la conversione ha successo e la colonna è ora datetime
-                if pd.api.types.is_datetime64_any_dtype(df[column]):
-                    # Converto datetime in timestamp numerico
-                    df[column] = df[column].map(pd.Timestamp.timestamp)
-
-                    # Applico la funzione rolling().mean() sul dato numerico
-                    df[column] = df[column].rolling(window=window_size, min_periods=1).mean()
-
-                    # Riconverto il timestamp in datetime
-                    df[column] = pd.to_datetime(df[column], unit='s')
-                else:
-                    print(f"Colonna {column} non può essere convertita in datetime.")
-
-            except Exception as e:
-                logging.error(f"Errore nella conversione della colonna {column} in datetime: {e}")
         else:
             logging.info(f"La colonna {column} non è di tipo numerico o datetime, quindi non sarà trattata.")
 
     return df
 
 
-def identify_and_remove_outliers(df, columns, original_format='%Y-%m-%dT%H:%M:%S%z') -> pd.DataFrame:
+def media_mobile_ns(valori, window_size, codici_gruppo=None) -> np.ndarray:
+    """
+    Media mobile (finestra di window_size campioni che termina sul campione corrente, min_periods=1) di una colonna
+    datetime rappresentata dalla vista int64 in nanosecondi. I NaT vengono ignorati; se una finestra contiene solo NaT
+    il risultato è NaT.
+    Le somme delle finestre vengono ottenute come differenze di una somma cumulativa uint64: l'aritmetica modulare
+    rende esatta la differenza anche quando la somma cumulativa supera 2^64, purché la somma di una finestra (calcolata
+    sugli scarti dal minimo) non lo superi, ovvero per date che coprono meno di 2^64 / window_size ns (circa 195 anni
+    con window_size=3). La media viene arrotondata al nanosecondo più vicino ed è esatta: rolling().mean() sugli
+    stessi valori convertiti in float64 differisce per l'errore di arrotondamento del calcolo in virgola mobile, al più
+    4 ulp del float64 della media (1024 ns per le date fra il 2006 e il 2043).
+    :param valori: array int64 dei nanosecondi dal 1970-01-01 UTC (NaT come NAT_INT64)
+    :param window_size: dimensione della finestra
+    :param codici_gruppo: array opzionale del gruppo di ciascun campione: le finestre non attraversano i gruppi
+    :return: array int64 delle medie (NaT come NAT_INT64)
+    """
+    n = len(valori)
+    if codici_gruppo is not None:
+        # Ordino per gruppo mantenendo l'ordine originale all'interno di ciascun gruppo
+        ordine = np.argsort(codici_gruppo, kind='stable')
+        valori = valori[ordine]
+        codici_gruppo = codici_gruppo[ordine]
+
+    validi = valori != NAT_INT64
+    minimo = valori[validi].min() if validi.any() else 0
+
+    # Scarti dal minimo (>= 0) e somme cumulative con un elemento iniziale nullo
+    scarti = np.where(validi, valori.view(np.uint64) - np.uint64(minimo), np.uint64(0))
+    somme = np.zeros(n + 1, dtype=np.uint64)
+    np.cumsum(scarti, out=somme[1:])
+    conteggi = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(validi, out=conteggi[1:])
+
+    # La finestra del campione i comprende le posizioni [inizio, fine) delle somme cumulative
+    fine = np.arange(1, n + 1)
+    inizio = np.maximum(fine - window_size, 0)
+    if codici_gruppo is not None:
+        nuovo_gruppo = np.r_[True, codici_gruppo[1:] != codici_gruppo[:-1]]
+        inizio_gruppo = np.maximum.accumulate(np.where(nuovo_gruppo, np.arange(n), 0))
+        inizio = np.maximum(inizio, inizio_gruppo)
+
+    somma = somme[fine] - somme[inizio]
+    conteggio = (conteggi[fine] - conteggi[inizio]).astype(np.uint64)
+    vuota = conteggio == 0
+    conteggio[vuota] = 1
+
+    # Divisione intera arrotondata al nanosecondo più vicino
+    quoziente, resto = np.divmod(somma, conteggio)
+    quoziente += (2 * resto >= conteggio)
+    media = quoziente.astype(np.int64) + minimo
+    media[vuota] = NAT_INT64
+
+    if codici_gruppo is not None:
+        risultato = np.empty(n, dtype=np.int64)
+        risultato[ordine] = media
+        return risultato
+    return media
+
+
+@misura()
+def identify_and_remove_outliers(df, columns, limiti=None) -> pd.DataFrame:
     """
     Identifica e rimuove outliers utilizzando il metodo IQR. La funzione viene applicata a feature e temporali.
-    :param original_format:
+    I limiti di tutte le colonne vengono calcolati insieme sul DataFrame df (o forniti già calcolati), le maschere
+    delle colonne vengono combinate e il DataFrame viene filtrato una sola volta.
     :param df: Il DataFrame originale.
     :param columns: Le colonne su cui applicare la rimozione degli outliers.
+    :param limiti: DataFrame opzionale dei limiti già calcolati (es. con calcola_limiti_outliers o caricati con
+                   carica_limiti_outliers). Se None, i limiti vengono calcolati sul DataFrame df.
     :return: Un DataFrame senza outliers.
     """
-    for column in columns:
-        converted = False  # Flag che uso per vedificare se gli elementi della feature sono stati convertiti da stringa a datetime
+    valori = vista_numerica(df, columns)
+    limiti = limiti_iqr(valori, columns) if limiti is None else limiti.loc[columns]
+
+    da_rimuovere, scartati = maschera_outliers(valori, limiti)
 
-        # Conversione della colonna in datetime, se necessario
-        if df[column].dtype == 'object':  # Se è una stringa
-            df[column] = pd.to_datetime(df[column], errors='coerce', utc=True)
-            converted = True
+    logging.info("Campioni scartati come outliers per colonna:")
+    logging.info(scartati)
+    logging.info(f"Campioni rimossi: {da_rimuovere.sum()}")
+    logging.info('-----------------------------------')
 
-        Q1 = df[column].quantile(0.25)
-        Q3 = df[column].quantile(0.75)
-        IQR = Q3 - Q1
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-        df = df[(df[column] >= lower_bound) & (df[column] <= upper_bound)]
+    return df[~da_rimuovere]
 
-        # Se in precedenza ho effettuato una conversione, ritorno al formato originale
-        if converted and df[column].dtype != 'object':
-            df[column] = df[column].dt.strftime(original_format)
 
-    return df
+def filtra_outliers(df, limiti):
+    """
+    Rimuove i campioni che in almeno una colonna sono esterni ai limiti (estremi inclusi) o mancanti.
+    :param df: DataFrame da filtrare.
+    :param limiti: DataFrame dei limiti, indicizzato per colonna, con 'lower_bound' e 'upper_bound'.
+    :return: DataFrame filtrato, numero di campioni rimossi, Series con il numero di campioni scartati da ciascuna
+             colonna (un campione può essere scartato da più colonne)
+    """
+    da_rimuovere, scartati = maschera_outliers(vista_numerica(df, limiti.index), limiti)
+    return df[~da_rimuovere], int(da_rimuovere.sum()), scartati
+
+
+def maschera_outliers(valori, limiti):
+    """
+    Calcola la maschera dei campioni da rimuovere: esterni ai limiti (estremi inclusi) o mancanti in almeno una
+    colonna.
+    :param valori: vista numerica delle colonne (vista_numerica), nello stesso ordine dei limiti
+    :param limiti: DataFrame dei limiti, indicizzato per colonna, con 'lower_bound' e 'upper_bound'.
+    :return: maschera dei campioni da rimuovere, Series con il numero di campioni scartati da ciascuna colonna
+    """
+    fuori = ~((valori >= limiti['lower_bound'].to_numpy()) & (valori <= limiti['upper_bound'].to_numpy()))
+    scartati = pd.Series(fuori.sum(axis=0), index=limiti.index, name='scartati')
+    return fuori.any(axis=1), scartati
+
+
+def vista_numerica(df, columns) -> np.ndarray:
+    """
+    Restituisce le colonne specificate come matrice float64 (una colonna per feature), senza conversioni da stringhe:
+    le colonne datetime vengono rappresentate dalla vista int64 in nanosecondi dal 1970-01-01 UTC. I valori mancanti
+    (NaN, NaT) diventano NaN.
+    :param df: DataFrame
+    :param columns: colonne da includere
+    :return: array float64 di forma (campioni, colonne)
+    """
+    valori = np.empty((len(df), len(columns)), dtype=np.float64)
+    for i, column in enumerate(columns):
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            ns = epoch_ns(df[column])
+            valori[:, i] = ns
+            valori[ns == NAT_INT64, i] = np.nan
+        else:
+            valori[:, i] = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+    return valori
+
+
+def calcola_limiti_outliers(df, columns) -> pd.DataFrame:
+    """
+    Calcola i limiti IQR di tutte le colonne sulla vista numerica delle colonne. I limiti possono essere salvati con
+    salva_limiti_outliers e applicati in seguito ad altri dati (es. a ciascun batch in streaming, o a nuovi dati con
+    le soglie calcolate in addestramento).
+    :param df: DataFrame contenente (almeno) le colonne specificate.
+    :param columns: Le colonne per cui calcolare i limiti.
+    :return: DataFrame indicizzato per colonna con 'lower_bound' e 'upper_bound' (in nanosecondi dal 1970-01-01 UTC
+             per le colonne datetime)
+    """
+    return limiti_iqr(vista_numerica(df, columns), columns)
+
+
+def limiti_iqr(valori, columns) -> pd.DataFrame:
+    """
+    Calcola i limiti IQR di tutte le colonne della vista numerica con un'unica chiamata a quantile([0.25, 0.75]).
+    I valori mancanti vengono ignorati.
+    :param valori: vista numerica delle colonne (vista_numerica)
+    :param columns: nomi delle colonne
+    :return: DataFrame indicizzato per colonna con 'lower_bound' e 'upper_bound'
+    """
+    quartili = pd.DataFrame(valori, columns=columns, copy=False).quantile([0.25, 0.75])
+    return limiti_da_quartili(quartili)
+
+
+def limiti_da_quartili(quartili) -> pd.DataFrame:
+    """
+    Calcola i limiti IQR dal primo e dal terzo quartile di ciascuna colonna.
+    :param quartili: DataFrame con le righe 0.25 e 0.75 e una colonna per feature
+    :return: DataFrame indicizzato per colonna con 'lower_bound' e 'upper_bound'
+    """
+    Q1 = quartili.loc[0.25]
+    Q3 = quartili.loc[0.75]
+    IQR = Q3 - Q1
+    return pd.DataFrame({'lower_bound': Q1 - 1.5 * IQR, 'upper_bound': Q3 + 1.5 * IQR})
+
 
+def salva_limiti_outliers(limiti, file_path):
+    """
+    Salva in formato Parquet i limiti calcolati con calcola_limiti_outliers.
+    :param limiti: DataFrame dei limiti
+    :param file_path: percorso del file Parquet
+    :return: None
+    """
+    limiti.to_parquet(file_path)
 
+
+def carica_limiti_outliers(file_path) -> pd.DataFrame:
+    """
+    Carica i limiti salvati con salva_limiti_outliers.
+    :param file_path: percorso del file Parquet
+    :return: DataFrame indicizzato per colonna con 'lower_bound' e 'upper_bound'
+    """
+    return pd.read_parquet(file_path)
+
+
+def salva_parametri_pulizia(media_durata, limiti, file_media_durata=FILE_MEDIA_DURATA,
+                            file_limiti=FILE_LIMITI_OUTLIERS):
+    """
+    Salva la durata media per attività e i limiti IQR calcolati sull'intero dataset, da riutilizzare con
+    carica_parametri_pulizia per pulire i nuovi dati come lo storico (es. run.py --aggiorna).
+    :param media_durata: Series 'durata_media' indicizzata per 'codice_descrizione_attivita'
+    :param limiti: DataFrame dei limiti IQR
+    :param file_media_durata: percorso del file Parquet della durata media
+    :param file_limiti: percorso del file Parquet dei limiti
+    :return: None
+    """
+    salva_media_durata(media_durata, file_media_durata)
+    salva_limiti_outliers(limiti, file_limiti)
+    logging.info(f"Parametri della pulizia salvati in {file_media_durata} e {file_limiti}")
+
+
+def carica_parametri_pulizia(file_media_durata=FILE_MEDIA_DURATA, file_limiti=FILE_LIMITI_OUTLIERS):
+    """
+    Carica la durata media per attività e i limiti IQR salvati con salva_parametri_pulizia.
+    :param file_media_durata: percorso del file Parquet della durata media
+    :param file_limiti: percorso del file Parquet dei limiti
+    :return media_durata: Series 'durata_media' indicizzata per 'codice_descrizione_attivita'
+    :return limiti: DataFrame dei limiti IQR
+    """
+    return carica_media_durata(file_media_durata), carica_limiti_outliers(file_limiti)
+
+
+@misura()
 def imputate_comune_residenza(df) -> pd.DataFrame:
     """
     Imputa i valori mancanti per 'comune_residenza' del dataset df.
     :param df:
     :return:
     """
-    # Carico il dataset relativo ai codici ISTAT dei comuni italiani in modo da poter fare imputation
-    df_istat = pd.read_excel('datasets/Codici-statistici-e-denominazioni-al-30_06_2024.xlsx')
-
-    codice_comune_to_nome = pd.Series(df_istat['Denominazione in italiano'].values,
-                                      index=df_istat['Codice Comune formato alfanumerico'])
+    # Codici ISTAT dei comuni italiani, letti una sola volta e condivisi fra le imputazioni
+    codice_comune_to_nome_dict = codice_comune_to_nome()
 
-    def fill_missing_comune_residenza(row):
-        if row['codice_comune_residenza'] == 1168:
-            return "NONE"
-        if row['comune_residenza'] is None:
-            return codice_comune_to_nome.get(row['codice_comune_residenza'])
-        return row['comune_residenza']
-
-    df['comune_residenza'] = df.apply(fill_missing_comune_residenza, axis=1)
+    comune_residenza = imputa_con_mappa(df['comune_residenza'], df['codice_comune_residenza'],
+                                        codice_comune_to_nome_dict)
+    comune_residenza[(df['codice_comune_residenza'] == 1168).to_numpy()] = "NONE"
+    df['comune_residenza'] = comune_residenza
 
     '''
     # N.B. Dopo l'imputazione i valori mancanti relativi a comune_residenza continuano a risultare mancanti 
@@ -210,6 +418,7 @@ def imputate_comune_residenza(df) -> pd.DataFrame:
     return df
 
 
+@misura()
 def imputate_codice_provincia_residenza(df: pd.DataFrame) -> pd.DataFrame:
     """
     Funzione che imputa i valori mancanti per 'codice_provincia_residenza' nel dataset.
@@ -217,55 +426,54 @@ def imputate_codice_provincia_residenza(df: pd.DataFrame) -> pd.DataFrame:
     :param df:
     :return:
     """
-    # Carica il dataset
-    df_istat = pd.read_excel('datasets/Codici-statistici-e-denominazioni-al-30_06_2024.xlsx')
-
-    # Crea il dizionario
-    dict_province = dict(
-        zip(df_istat['Denominazione dell\'Unità territoriale sovracomunale \n(valida a fini statistici)'],
-            df_istat['Sigla automobilistica']))
-
-    # Rimpiazzo il valore relativo a Napoli con NA poiché Pandas tende ad interpretarlo automaticamente come un nan.
-    dict_province['Napoli'] = 'NA'
-
-    def fill_missing_codice_provincia_residenza(row):
-        if row['codice_provincia_residenza'] is None:
-            return dict_province.get(row['provincia_residenza'])
-        return row['codice_provincia_residenza']
+    # Dizionario provincia -> sigla, con la sigla 'NA' di Napoli già corretta
+    dict_province_sigle = dict_province()
 
-    df['codice_provincia_residenza'] = df.apply(fill_missing_codice_provincia_residenza, axis=1)
+    df['codice_provincia_residenza'] = imputa_con_mappa(df['codice_provincia_residenza'], df['provincia_residenza'],
+                                                        dict_province_sigle)
 
     return df
 
 
+@misura()
 def imputate_codice_provincia_erogazione(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Funzione che imputa i valori mancanti per 'codice_provincia_residenza' nel dataset.
+    Funzione che imputa i valori mancanti per 'codice_provincia_erogazione' nel dataset.
     Caso particolare: 'Napoli' ha codice nullo perché Pandas interpreta il codice 'NA' come NaN.
     :param df:
     :return:
     """
-    # Carica il dataset
-    df_istat = pd.read_excel('datasets/Codici-statistici-e-denominazioni-al-30_06_2024.xlsx')
+    # Dizionario provincia -> sigla, con la sigla 'NA' di Napoli già corretta
+    dict_province_sigle = dict_province()
 
-    # Crea il dizionario
-    dict_province = dict(
-        zip(df_istat['Denominazione dell\'Unità territoriale sovracomunale \n(valida a fini statistici)'],
-            df_istat['Sigla automobilistica']))
+    df['codice_provincia_erogazione'] = imputa_con_mappa(df['codice_provincia_erogazione'],
+                                                         df['provincia_erogazione'], dict_province_sigle)
 
-    # Rimpiazzo il valore relativo a Napoli con NA poiché Pandas tende ad interpretarlo automaticamente come un nan.
-    dict_province['Napoli'] = 'NA'
+    return df
 
-    def fill_missing_codice_provincia_erogazione(row):
-        if row['codice_provincia_erogazione'] is None:
-            return dict_province.get(row['provincia_erogazione'])
-        return row['codice_provincia_erogazione']
 
-    df['codice_provincia_erogazione'] = df.apply(fill_missing_codice_provincia_erogazione, axis=1)
+def imputa_con_mappa(valori: pd.Series, chiavi: pd.Series, mappa) -> np.ndarray:
+    """
+    Sostituisce i valori None di 'valori' con il valore associato in 'mappa' alla chiave corrispondente, o con None
+    se la chiave non è presente (come mappa.get(chiave) applicato riga per riga). Solo None viene considerato
+    mancante, come nel controllo 'is None'; la ricerca viene eseguita con un'unica Series.map sulle sole righe
+    mancanti.
+    :param valori: colonna da imputare
+    :param chiavi: colonna con le chiavi da cercare nella mappa
+    :param mappa: dizionario o Series chiave -> valore
+    :return: array di oggetti con i valori imputati
+    """
+    valori_imputati = valori.to_numpy(dtype=object, copy=True)
+    mancanti = np.equal(valori_imputati, None)
 
-    return df
+    if mancanti.any():
+        imputati = chiavi[mancanti].map(mappa)
+        valori_imputati[mancanti] = imputati.astype(object).where(imputati.notna(), None).to_numpy()
 
+    return valori_imputati
 
+
+@misura()
 def remove_disdette(df) -> pd.DataFrame:
     """
     Rimuove i campioni con 'data_disdetta' non nullo.
@@ -276,48 +484,33 @@ def remove_disdette(df) -> pd.DataFrame:
     return df
 
 
-def imputate_ora_inizio_erogazione_and_ora_fine_erogazione(df) -> pd.DataFrame:
+@misura()
+def imputate_ora_inizio_erogazione_and_ora_fine_erogazione(df, media_durata=None) -> pd.DataFrame:
     """
     Imputa i valori mancanti per 'ora_inizio_erogazione' e 'ora_fine_erogazione' del dataset df.
+    Per i campioni non disdetti con entrambi gli orari mancanti, 'ora_inizio_erogazione' viene posto uguale a
+    'data_erogazione' e 'ora_fine_erogazione' a 'data_erogazione' più la durata media dell'attività.
     :param df:
+    :param media_durata: Series {codice_descrizione_attivita: durata media} già calcolata con calcola_media_durata
+                         (opzionale, es. caricata con carica_media_durata). Se None, viene calcolata sul DataFrame df.
     :return:
     """
     # Verifico se i valori mancanti sono relativi alle medesime righe del dataset:
     check_missing_values_same_row(df)
 
-    # Conversione delle colonne 'data_erogazione', 'ora_inizio_erogazione' e 'ora_fine_erogazione' in formato datetime
-    df['data_erogazione'] = pd.to_datetime(df['data_erogazione'], errors='coerce', utc=True)
-    df['ora_inizio_erogazione'] = pd.to_datetime(df['ora_inizio_erogazione'], errors='coerce', utc=True)
-    df['ora_fine_erogazione'] = pd.to_datetime(df['ora_fine_erogazione'], errors='coerce', utc=True)
-
     # Calcolo della durata media delle attività per ciascun 'codice_descrizione_attivita'
-    df_non_missing = df.dropna(subset=['ora_inizio_erogazione', 'ora_fine_erogazione']).copy()
-    df_non_missing['durata'] = (
-            df_non_missing['ora_fine_erogazione'] - df_non_missing['ora_inizio_erogazione']).dt.total_seconds()
-    media_durata_sec = df_non_missing.groupby('codice_descrizione_attivita')['durata'].mean()
-    media_durata = pd.to_timedelta(media_durata_sec, unit='s')
-
-    # Converti la Series risultante in un dizionario
-    media_durata_dict = media_durata.to_dict()
-
-    # print(media_durata_dict)
-
-    # Funzione di supporto per l'imputazione
-    def imputazione_riga(row):
-        if pd.isnull(row['ora_inizio_erogazione']) and pd.isnull(row['ora_fine_erogazione']) and pd.isnull(
-                row['data_disdetta']):
-            codice_attivita = row['codice_descrizione_attivita']
-            if codice_attivita in media_durata_dict:
-                # print(f"data erogazione: {row['data_erogazione']}. Dati imputati: {row['ora_inizio_erogazione']} , {row['ora_fine_erogazione']}")
-                durata_media = media_durata_dict[codice_attivita]
-                data_erogazione = row['data_erogazione']
-                row['ora_inizio_erogazione'] = data_erogazione
-                row['ora_fine_erogazione'] = data_erogazione + durata_media
-                # print(f"data erogazione: {row['data_erogazione']}. Dati imputati: {row['ora_inizio_erogazione']} , {row['ora_fine_erogazione']}")
-        return row
-
-    # Applica la funzione di imputazione a tutto il DataFrame
-    df = df.apply(imputazione_riga, axis=1)
+    if media_durata is None:
+        media_durata = calcola_media_durata(df)
+
+    # Durata media dell'attività di ogni campione (NaT se l'attività non ha orari noti)
+    durata_media = df['codice_descrizione_attivita'].map(media_durata)
+
+    # Campioni da imputare: orari entrambi mancanti, televisita non disdetta e durata media nota
+    da_imputare = (df['ora_inizio_erogazione'].isna() & df['ora_fine_erogazione'].isna() &
+                   df['data_disdetta'].isna() & durata_media.notna())
+
+    df['ora_inizio_erogazione'] = df['ora_inizio_erogazione'].mask(da_imputare, df['data_erogazione'])
+    df['ora_fine_erogazione'] = df['ora_fine_erogazione'].mask(da_imputare, df['data_erogazione'] + durata_media)
 
     check_missing_values_start(df)
     check_missing_values_end(df)
@@ -325,6 +518,63 @@ def imputate_ora_inizio_erogazione_and_ora_fine_erogazione(df) -> pd.DataFrame:
     return df
 
 
+def calcola_media_durata(df) -> pd.Series:
+    """
+    Calcola la durata media delle attività per ciascun 'codice_descrizione_attivita', considerando solo i campioni
+    con entrambi gli orari noti. La tabella restituita può essere riutilizzata su nuovi dati passandola a
+    imputate_ora_inizio_erogazione_and_ora_fine_erogazione, e salvata con salva_media_durata.
+    :param df: DataFrame con 'ora_inizio_erogazione' e 'ora_fine_erogazione' in formato datetime.
+    :return: Series 'durata_media' (Timedelta) indicizzata per 'codice_descrizione_attivita'
+    """
+    durata = (df['ora_fine_erogazione'] - df['ora_inizio_erogazione']).dt.total_seconds()
+    noti = df['ora_inizio_erogazione'].notna() & df['ora_fine_erogazione'].notna()
+    media_durata_sec = durata[noti].groupby(df.loc[noti, 'codice_descrizione_attivita']).mean()
+    return pd.to_timedelta(media_durata_sec, unit='s').rename('durata_media')
+
+
+def salva_media_durata(media_durata, file_path):
+    """
+    Salva in formato Parquet la durata media per attività calcolata con calcola_media_durata.
+    :param media_durata: Series 'durata_media' indicizzata per 'codice_descrizione_attivita'
+    :param file_path: percorso del file Parquet
+    :return: None
+    """
+    media_durata.to_frame().to_parquet(file_path)
+
+
+def carica_media_durata(file_path) -> pd.Series:
+    """
+    Carica la durata media per attività salvata con salva_media_durata.
+    :param file_path: percorso del file Parquet
+    :return: Series 'durata_media' indicizzata per 'codice_descrizione_attivita'
+    """
+    return pd.read_parquet(file_path)['durata_media']
+
+
+def calcola_somme_durata(df) -> pd.DataFrame:
+    """
+    Calcola, per ciascun 'codice_descrizione_attivita', la somma delle durate (in secondi) e il numero di attività
+    con orari noti. Le somme di più batch possono essere sommate fra loro e ridotte con media_durata_da_somme.
+    :param df: DataFrame con 'codice_descrizione_attivita', 'ora_inizio_erogazione' e 'ora_fine_erogazione' in
+               formato datetime.
+    :return: DataFrame indicizzato per 'codice_descrizione_attivita' con le colonne 'somma' e 'conteggio'.
+    """
+    durata = (df['ora_fine_erogazione'] - df['ora_inizio_erogazione']).dt.total_seconds()
+
+    durata = durata[df['ora_inizio_erogazione'].notna() & df['ora_fine_erogazione'].notna()]
+    return durata.groupby(df['codice_descrizione_attivita']).agg(['sum', 'count']).rename(
+        columns={'sum': 'somma', 'count': 'conteggio'})
+
+
+def media_durata_da_somme(somme) -> pd.Series:
+    """
+    Riduce le somme calcolate con calcola_somme_durata nella durata media per 'codice_descrizione_attivita'.
+    :param somme: DataFrame con le colonne 'somma' e 'conteggio'.
+    :return: Series 'durata_media' (Timedelta) indicizzata per 'codice_descrizione_attivita'
+    """
+    return pd.to_timedelta(somme['somma'] / somme['conteggio'], unit='s').rename('durata_media')
+
+
 def check_missing_values_same_row(df):
     """
     Verifica se i valori mancanti per 'ora_inizio_erogazione' e 'ora_fine_erogazione' riguardano le stesse righe.
@@ -360,14 +610,13 @@ def check_missing_values_end(df):
     logging.info(f"Numero di righe con 'ora_fine_erogazione' mancante: {num_rows_with_end_missing}")
 
 
+@misura()
 def ordina_date(df):
     """
 
     :param df:
     :return:
     """
-    # Assicurati che la colonna delle date sia in formato datetime
-    df['data_erogazione'] = pd.to_datetime(df['data_erogazione'])
     # Ordina il DataFrame in base alla colonna delle date
     df = df.sort_values(by='data_erogazione')
     return df
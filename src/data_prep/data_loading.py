@@ -0,0 +1,128 @@
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import logging
+from data_prep.schema import COLONNE_TEMPORALI, applica_schema
+from data_prep.data_cleaning import calcola_media_durata
+from data_prep.features_selection import FEATURES_PAIRS
+from data_transformation.data_transformation import define_features_types
+from instrumentation.instrumentation import misura
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Filtro delle televisite non disdette, applicato direttamente durante la lettura del file Parquet
+FILTRO_DISDETTE = pc.field('data_disdetta').is_null()
+
+# Colonne da cui vengono estratte le feature numeriche durante la Feature Extraction
+SORGENTI_FEATURE = {
+    'eta_paziente': ['data_nascita'],
+    'durata_televisita': ['ora_inizio_erogazione', 'ora_fine_erogazione'],
+    'year': ['data_erogazione'],
+    'month': ['data_erogazione']
+}
+
+# Colonne necessarie al Data Cleaning: imputazione di 'ora_inizio_erogazione' e 'ora_fine_erogazione' e filtro
+# delle televisite disdette
+COLONNE_DATA_CLEANING = ['codice_descrizione_attivita', 'data_erogazione', 'data_disdetta']
+
+# Colonne da cui viene calcolata la durata media per attività
+COLONNE_DURATA = ['codice_descrizione_attivita', 'ora_inizio_erogazione', 'ora_fine_erogazione']
+
+# Colonne rimosse dalla Features Selection ma usate prima: la rimozione dei duplicati confronta i campioni su tutte le
+# colonne (senza gli identificativi prenotazioni diverse diventerebbero uguali) e 'tipologia_servizio' viene rimossa
+# solo se ha sempre lo stesso valore
+COLONNE_FEATURE_SELECTION = ['id_prenotazione', 'id_paziente', 'id_professionista_sanitario', 'tipologia_servizio']
+
+
+def colonne_utilizzate(file_path) -> list:
+    """
+    Determina le colonne del file Parquet effettivamente usate dalla pipeline configurata: le feature categoriche e
+    le colonne da cui vengono estratte le feature numeriche (define_features_types), le colonne temporali su cui
+    vengono rimossi outliers e dati rumorosi e le colonne necessarie al Data Cleaning. Vengono lette anche tutte le
+    coppie (codice, descrizione): se la correlazione non è univoca (es. comuni omonimi in province diverse) la colonna
+    codice resta nel dataset, quindi l'analisi deve dare lo stesso risultato ottenuto leggendo l'intero dataset.
+    Per lo stesso motivo vengono lette le colonne usate dalla pipeline prima di rimuoverle (COLONNE_FEATURE_SELECTION):
+    gli identificativi, senza i quali la rimozione dei duplicati eliminerebbe prenotazioni diverse, e
+    'tipologia_servizio'. Le colonne del file sconosciute alla pipeline non vengono lette.
+    :param file_path: percorso del file Parquet
+    :return: lista delle colonne da leggere, nell'ordine del file
+    """
+    categorical_features, numerical_features = define_features_types()
+
+    colonne = (set(categorical_features) | set(COLONNE_TEMPORALI) | set(COLONNE_DATA_CLEANING) |
+               set(COLONNE_FEATURE_SELECTION))
+    for feature in numerical_features:
+        colonne.update(SORGENTI_FEATURE.get(feature, [feature]))
+    for codice, descrizione in FEATURES_PAIRS:
+        colonne.update([codice, descrizione])
+
+    # Le feature calcolate dalla pipeline (es. 'incremento') non sono presenti nel file
+    schema = pq.read_schema(file_path)
+    return [col for col in schema.names if col in colonne]
+
+
+@misura()
+def load_dataset(file_path, columns=None, filtro=None):
+    """
+    Carica il dataset leggendo solo le colonne specificate e applicando il filtro durante la lettura: i row group
+    che in base alle statistiche del file non contengono campioni validi non vengono decodificati.
+    Le colonne temporali vengono convertite in datetime64[ns, UTC] (applica_schema).
+    :param file_path: percorso del file Parquet
+    :param columns: colonne da leggere (opzionale, di default tutte)
+    :param filtro: espressione pyarrow da applicare in lettura (es. FILTRO_DISDETTE)
+    :return df: dataFrame
+    """
+    dataset = ds.dataset(file_path, format='parquet')
+    table = dataset.to_table(columns=columns, filter=filtro)
+    logging.info(f"Lette {table.num_rows} righe e {table.num_columns} colonne da {file_path}")
+    return applica_schema(table.to_pandas())
+
+
+@misura()
+def media_durata_dataset(file_path):
+    """
+    Calcola la durata media per attività su tutti i campioni del file, comprese le televisite disdette, leggendo solo
+    le colonne necessarie: è la stessa durata media che data_cleaning calcola leggendo l'intero dataset, da passare
+    a data_cleaning quando il dataset viene letto con il filtro FILTRO_DISDETTE.
+    :param file_path: percorso del file Parquet
+    :return: Series 'durata_media' (Timedelta) indicizzata per 'codice_descrizione_attivita'
+    """
+    return calcola_media_durata(load_dataset(file_path, columns=COLONNE_DURATA))
+
+
+def iter_batch_parquet(file_path, batch_size=None, columns=None, filtro=None):
+    """
+    Legge il file Parquet un batch alla volta, senza mai caricarlo interamente in memoria.
+    Ogni batch viene restituito come DataFrame con un indice che prosegue quello del batch precedente, in modo che
+    l'indice di ogni campione coincida con quello che avrebbe leggendo l'intero file con pd.read_parquet
+    (o con load_dataset, se viene specificato un filtro). Le colonne temporali vengono convertite in
+    datetime64[ns, UTC] (applica_schema).
+    :param file_path: percorso del file Parquet
+    :param batch_size: numero di righe per batch. Se None, ogni batch corrisponde a un row group del file.
+    :param columns: colonne da leggere (opzionale, di default tutte)
+    :param filtro: espressione pyarrow da applicare in lettura (es. FILTRO_DISDETTE)
+    :return: generatore di DataFrame
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    logging.info(f"Lettura in streaming di {file_path}: {parquet_file.metadata.num_rows} righe, "
+                 f"{parquet_file.num_row_groups} row group")
+
+    dataset = ds.dataset(file_path, format='parquet')
+    if batch_size is None:
+        # Un batch per row group: i row group esclusi dal filtro in base alle statistiche non vengono letti
+        batches = (row_group.to_table(columns=columns, filter=filtro)
+                   for fragment in dataset.get_fragments()
+                   for row_group in fragment.split_by_row_group(filtro))
+    else:
+        batches = dataset.to_batches(columns=columns, filter=filtro, batch_size=batch_size)
+
+    offset = 0
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        df = applica_schema(batch.to_pandas())
+        df.index = range(offset, offset + len(df))
+        offset += len(df)
+        yield df
@@ -1,38 +1,49 @@
 import pandas as pd
 import logging
 import numpy as np
+from instrumentation.instrumentation import misura
 
 # Configuro il logger
 logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
                     format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
 
 
+# Coppie (codice, descrizione) su cui viene verificata la correlazione univoca
+FEATURES_PAIRS = [
+    ('codice_provincia_residenza', 'provincia_residenza'),
+    ('codice_provincia_erogazione', 'provincia_erogazione'),
+    ('codice_regione_residenza', 'regione_residenza'),
+    ('codice_asl_residenza', 'asl_residenza'),
+    ('codice_comune_residenza', 'comune_residenza'),
+    ('codice_descrizione_attivita', 'descrizione_attivita'),
+    ('codice_regione_erogazione', 'regione_erogazione'),
+    ('codice_asl_erogazione', 'asl_erogazione'),
+    ('codice_struttura_erogazione', 'struttura_erogazione'),
+    ('codice_tipologia_struttura_erogazione', 'tipologia_struttura_erogazione'),
+    ('codice_tipologia_professionista_sanitario', 'tipologia_professionista_sanitario')
+]
+
+# Feature rimosse sempre, indipendentemente dai dati
+FEATURES_RIMOSSE = ['data_disdetta', 'id_prenotazione']
+
+# Feature rimosse in base ai dati dell'intero dataset (correlazioni univoche, 'regione_erogazione',
+# 'tipologia_servizio'), salvate per applicare le stesse decisioni ai nuovi dati (modalità incrementale)
+FILE_SELEZIONE_FEATURES = 'datasets/selezione_features.parquet'
+
+
 def unique_correlation_analisys(df: pd.DataFrame) -> pd.DataFrame:
     """
     Funzione che controlla se c'è correlazione univoca tra due features e in caso affermativo ne rimuove una.
     :param df:
     :return:
     """
-    features_pairs = [
-        ('codice_provincia_residenza', 'provincia_residenza'),
-        ('codice_provincia_erogazione', 'provincia_erogazione'),
-        ('codice_regione_residenza', 'regione_residenza'),
-        ('codice_asl_residenza', 'asl_residenza'),
-        ('codice_comune_residenza', 'comune_residenza'),
-        ('codice_descrizione_attivita', 'descrizione_attivita'),
-        ('codice_regione_erogazione', 'regione_erogazione'),
-        ('codice_asl_erogazione', 'asl_erogazione'),
-        ('codice_struttura_erogazione', 'struttura_erogazione'),
-        ('codice_tipologia_struttura_erogazione', 'tipologia_struttura_erogazione'),
-        ('codice_tipologia_professionista_sanitario', 'tipologia_professionista_sanitario')
-    ]
-
-    for pair in features_pairs:
-        codice_univoco = df.groupby(pair[0])[pair[1]].nunique() == 1
-        descrizione_univoca = df.groupby(pair[1])[pair[0]].nunique() == 1
+    for pair in FEATURES_PAIRS:
+        # Coppia non caricata (es. lettura con proiezione delle colonne): non c'è nulla da verificare
+        if pair[0] not in df.columns or pair[1] not in df.columns:
+            continue
 
         # Se entrambi i controlli sono veri per tutte le righe, puoi eliminare la colonna codice
-        if codice_univoco.all() and descrizione_univoca.all():
+        if check_unique_correlation(df, pair[0], pair[1]):
             df = df.drop(columns=[pair[0]])
             logging.info(f"Feature {pair[0]} eliminata correlazione univoca con la feature {pair[1]}")
         else:
@@ -41,6 +52,21 @@ def unique_correlation_analisys(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def check_unique_correlation(df: pd.DataFrame, codice: str, descrizione: str) -> bool:
+    """
+    Verifica se fra le feature 'codice' e 'descrizione' c'è correlazione univoca. Il risultato dipende solo dalle
+    coppie distinte (codice, descrizione), quindi la funzione può essere applicata anche alle sole coppie distinte
+    raccolte da più batch.
+    :param df:
+    :param codice: feature contenente il codice
+    :param descrizione: feature contenente la descrizione
+    :return: bool
+    """
+    codice_univoco = df.groupby(codice)[descrizione].nunique() == 1
+    descrizione_univoca = df.groupby(descrizione)[codice].nunique() == 1
+    return codice_univoco.all() and descrizione_univoca.all()
+
+
 def remove_data_disdetta(df) -> pd.DataFrame:
     """
     Rimuove i campioni con 'data_disdetta' non nullo.
@@ -106,22 +132,73 @@ def check_tipologia_servizio(df: pd.DataFrame) -> pd.DataFrame:
     return (df['tipologia_servizio'] == 'Teleassistenza').all()
 
 
-def feature_selection(df: pd.DataFrame) -> pd.DataFrame:
+@misura()
+def feature_selection(df: pd.DataFrame, selezione=None, salva_selezione=False) -> pd.DataFrame:
     """
     Esegue la feature selection
     :param df:
+    :param selezione: feature da rimuovere già decise sull'intero dataset (opzionale, es. caricate con
+                      carica_selezione_features). Se None, le decisioni vengono prese sul dataset.
+    :param salva_selezione: se True salva le feature rimosse in base ai dati (salva_selezione_features)
     :return:
     """
-    df = unique_correlation_analisys(df)
-    df = remove_data_disdetta(df)
-    df = remove_id_prenotazione(df)
+    if selezione is not None:
+        df = applica_selezione_features(df, selezione)
+    else:
+        colonne = list(df.columns)
+        df = unique_correlation_analisys(df)
+        df = remove_data_disdetta(df)
+
+        # 'id_prenotazione' e 'tipologia_servizio' possono mancare se il dataset è letto con un sottoinsieme delle
+        # colonne
+        if 'id_prenotazione' in df.columns:
+            df = remove_id_prenotazione(df)
+
+        # Se le due features hanno sempre valori uguali, rimuovo 'regione_erogazione'
+        if check_regione_residenza_equals_regione_erogazione(df):
+            df = remove_regione_erogazione(df)
+
+        # Se 'tipologia_servizio' ha sempre lo stesso valore, rimuovo la colonna
+        if 'tipologia_servizio' in df.columns and check_tipologia_servizio(df):
+            df = remove_tipologia_servizio(df)
 
-    # Se le due features hanno sempre valori uguali, rimuovo 'regione_erogazione'
-    if check_regione_residenza_equals_regione_erogazione(df):
-        df = remove_regione_erogazione(df)
+        selezione = [col for col in colonne if col not in df.columns and col not in FEATURES_RIMOSSE]
 
-    # Se 'tipologia_servizio' ha sempre lo stesso valore, rimuovo la colonna
-    if check_tipologia_servizio(df):
-        df = remove_tipologia_servizio(df)
+    if salva_selezione:
+        salva_selezione_features(selezione)
 
     return df
+
+
+def applica_selezione_features(df: pd.DataFrame, selezione) -> pd.DataFrame:
+    """
+    Rimuove le feature rimosse sempre e quelle decise sull'intero dataset, senza ricalcolare le decisioni sul
+    DataFrame (es. un nuovo mese, su cui una correlazione univoca potrebbe valere anche se non vale sullo storico).
+    :param df:
+    :param selezione: feature rimosse in base ai dati (es. caricate con carica_selezione_features)
+    :return: df senza le feature rimosse
+    """
+    rimosse = [col for col in FEATURES_RIMOSSE + list(selezione) if col in df.columns]
+    for col in rimosse:
+        logging.info(f"Eliminazione della feature: {col}")
+    return df.drop(columns=rimosse)
+
+
+def salva_selezione_features(selezione, file_path=FILE_SELEZIONE_FEATURES):
+    """
+    Salva in formato Parquet le feature rimosse in base ai dati dalla Features Selection.
+    :param selezione: lista delle feature rimosse
+    :param file_path: percorso del file Parquet
+    :return: None
+    """
+    pd.DataFrame({'feature': pd.Series(selezione, dtype=object)}).to_parquet(file_path, index=False)
+    logging.info(f"Feature rimosse dalla Features Selection salvate in {file_path}")
+
+
+def carica_selezione_features(file_path=FILE_SELEZIONE_FEATURES) -> list:
+    """
+    Carica le feature rimosse salvate con salva_selezione_features.
+    :param file_path: percorso del file Parquet
+    :return: lista delle feature rimosse
+    """
+    return pd.read_parquet(file_path)['feature'].tolist()
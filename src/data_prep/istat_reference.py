@@ -0,0 +1,142 @@
+from functools import lru_cache
+import hashlib
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import logging
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# File contenente i codici ISTAT dei comuni italiani, usato per l'imputazione dei dati geografici
+FILE_CODICI_ISTAT = 'datasets/Codici-statistici-e-denominazioni-al-30_06_2024.xlsx'
+
+# Cache in formato Parquet della tabella compatta dei comuni estratta dal file excel
+FILE_CACHE_ISTAT = 'datasets/cache/codici_istat.parquet'
+
+# Colonne del file excel da mantenere nella tabella compatta e relativi nuovi nomi
+COLONNE_ISTAT = {
+    'Codice Comune formato alfanumerico': 'codice_comune',
+    'Denominazione in italiano': 'comune',
+    'Codice Regione': 'codice_regione',
+    'Denominazione Regione': 'regione',
+    'Codice dell\'Unità territoriale sovracomunale \n(valida a fini statistici)': 'codice_provincia',
+    'Denominazione dell\'Unità territoriale sovracomunale \n(valida a fini statistici)': 'provincia',
+    'Sigla automobilistica': 'sigla_provincia'
+}
+
+
+def carica_comuni_istat(file_path=FILE_CODICI_ISTAT, cache_path=FILE_CACHE_ISTAT) -> pd.DataFrame:
+    """
+    Restituisce la tabella compatta dei comuni ISTAT (codice e nome del comune, della provincia e della regione,
+    sigla della provincia). Il file excel viene letto solo la prima volta: la tabella viene salvata in cache_path ed
+    è memorizzata nel processo, quindi le chiamate successive non rileggono né il file excel né la cache.
+    La tabella restituita è condivisa e non deve essere modificata.
+    :param file_path: percorso del file excel dei codici ISTAT
+    :param cache_path: percorso della cache in formato Parquet
+    :return: DataFrame con una riga per comune
+    """
+    return leggi_comuni_istat(file_path, cache_path, os.stat(file_path).st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def leggi_comuni_istat(file_path, cache_path, mtime_ns) -> pd.DataFrame:
+    """
+    Legge la tabella dei comuni dalla cache, se valida, altrimenti dal file excel, aggiornando la cache.
+    La cache è valida se è stata creata da un file con la stessa data di modifica o, in alternativa, con lo stesso
+    hash SHA-256. Memorizzata nel processo per (file_path, cache_path, mtime_ns).
+    :param file_path: percorso del file excel dei codici ISTAT
+    :param cache_path: percorso della cache in formato Parquet
+    :param mtime_ns: data di modifica del file excel, in nanosecondi
+    :return: DataFrame con una riga per comune
+    """
+    metadata = leggi_metadata_cache(cache_path)
+
+    if metadata.get(b'mtime_ns') == str(mtime_ns).encode():
+        return pd.read_parquet(cache_path)
+
+    sha256 = calcola_sha256(file_path)
+    if metadata.get(b'sha256') == sha256.encode():
+        # File non modificato (es. solo copiato): aggiorno la data di modifica salvata nella cache
+        df_comuni = pd.read_parquet(cache_path)
+    else:
+        logging.info(f"Lettura dei codici ISTAT da {file_path}")
+        df_comuni = estrai_comuni_istat(pd.read_excel(file_path))
+
+    salva_cache(df_comuni, cache_path, {'mtime_ns': str(mtime_ns), 'sha256': sha256})
+    return df_comuni
+
+
+def estrai_comuni_istat(df_istat) -> pd.DataFrame:
+    """
+    Estrae dal dataset dei codici ISTAT la tabella compatta dei comuni.
+    Caso particolare: 'Napoli' ha sigla nulla perché Pandas interpreta il codice 'NA' come NaN.
+    :param df_istat: dataset letto dal file excel dei codici ISTAT
+    :return: DataFrame con una riga per comune
+    """
+    df_comuni = df_istat[list(COLONNE_ISTAT)].rename(columns=COLONNE_ISTAT)
+
+    # Rimpiazzo il valore relativo a Napoli con NA poiché Pandas tende ad interpretarlo automaticamente come un nan.
+    df_comuni.loc[df_comuni['provincia'] == 'Napoli', 'sigla_provincia'] = 'NA'
+
+    return df_comuni.reset_index(drop=True)
+
+
+def leggi_metadata_cache(cache_path) -> dict:
+    """
+    Legge i metadati della cache senza leggerne il contenuto.
+    :param cache_path: percorso della cache in formato Parquet
+    :return: dizionario dei metadati (vuoto se la cache non esiste)
+    """
+    if not os.path.isfile(cache_path):
+        return {}
+    return pq.read_schema(cache_path).metadata or {}
+
+
+def salva_cache(df_comuni, cache_path, metadata):
+    """
+    Salva la tabella dei comuni in formato Parquet, insieme ai metadati del file da cui è stata estratta.
+    :param df_comuni: tabella compatta dei comuni
+    :param cache_path: percorso della cache in formato Parquet
+    :param metadata: dizionario con data di modifica e hash del file excel
+    :return: None
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    table = pa.Table.from_pandas(df_comuni, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, **metadata})
+    pq.write_table(table, cache_path)
+
+
+def calcola_sha256(file_path) -> str:
+    """
+    Calcola l'hash SHA-256 del file specificato.
+    :param file_path: percorso del file
+    :return: hash esadecimale
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for blocco in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(blocco)
+    return sha256.hexdigest()
+
+
+def codice_comune_to_nome(file_path=FILE_CODICI_ISTAT) -> pd.Series:
+    """
+    Restituisce la Series che associa il codice ISTAT di ogni comune al suo nome.
+    :param file_path: percorso del file excel dei codici ISTAT
+    :return: Series indicizzata per codice del comune
+    """
+    df_comuni = carica_comuni_istat(file_path)
+    return pd.Series(df_comuni['comune'].values, index=df_comuni['codice_comune'])
+
+
+def dict_province(file_path=FILE_CODICI_ISTAT) -> dict:
+    """
+    Restituisce il dizionario che associa il nome di ogni provincia alla sua sigla (con 'NA' per Napoli).
+    :param file_path: percorso del file excel dei codici ISTAT
+    :return: dizionario {provincia: sigla}
+    """
+    df_comuni = carica_comuni_istat(file_path)
+    return dict(zip(df_comuni['provincia'], df_comuni['sigla_provincia']))
@@ -0,0 +1,202 @@
+import math
+import numpy as np
+import pandas as pd
+import logging
+from data_prep.data_cleaning import limiti_da_quartili
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Errore di rango normalizzato di default degli sketch (circa k = 200)
+ERRORE_DEFAULT = 0.0133
+
+# Seme di default dei generatori casuali degli sketch, per limiti riproducibili fra esecuzioni
+SEED_SKETCH = 42
+
+# Rapporto fra le capacità di due livelli consecutivi dello sketch KLL
+RAPPORTO_CAPACITA = 2 / 3
+
+
+class SketchKLL:
+    """
+    Sketch KLL (Karnin, Lang, Liberty) per il calcolo approssimato dei quantili di una colonna numerica letta un
+    batch alla volta. Lo sketch occupa O(k) valori indipendentemente dal numero di campioni; il quantile restituito
+    ha, con alta probabilità, un errore di rango normalizzato non superiore a errore_per_k(k).
+    Due sketch costruiti su parti diverse del dataset (batch, partizioni anno/mese, processi diversi) possono essere
+    uniti con unisci: il risultato equivale a uno sketch costruito sull'unione dei dati. Lo sketch è serializzabile
+    con pickle, quindi può essere restituito da un processo worker.
+    """
+
+    def __init__(self, k=None, errore=None, seed=None):
+        """
+        :param k: numero di valori mantenuti dal livello più alto (opzionale, alternativo a errore)
+        :param errore: errore di rango normalizzato desiderato (opzionale, di default ERRORE_DEFAULT)
+        :param seed: seme del generatore casuale usato nelle compattazioni (opzionale)
+        """
+        if k is None:
+            k = k_per_errore(ERRORE_DEFAULT if errore is None else errore)
+        self.k = int(k)
+        self.n = 0
+        self.livelli = [np.empty(0, dtype=np.float64)]
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.n
+
+    def capacita(self, livello) -> int:
+        """
+        Capacità del livello specificato: il livello più alto contiene fino a k valori, ogni livello inferiore
+        RAPPORTO_CAPACITA volte quelli del livello superiore (almeno 2).
+        :param livello: indice del livello (0 = valori con peso 1)
+        :return: numero massimo di valori del livello
+        """
+        profondita = len(self.livelli) - 1 - livello
+        return max(int(math.ceil(self.k * RAPPORTO_CAPACITA ** profondita)), 2)
+
+    def aggiorna(self, valori):
+        """
+        Aggiunge allo sketch i valori specificati. I valori mancanti (NaN) vengono ignorati.
+        :param valori: array o Serie numerica
+        :return: lo sketch aggiornato
+        """
+        valori = np.asarray(valori, dtype=np.float64)
+        valori = valori[~np.isnan(valori)]
+        if len(valori) == 0:
+            return self
+
+        self.n += len(valori)
+        self.livelli[0] = np.concatenate([self.livelli[0], valori])
+        self.compatta()
+        return self
+
+    def unisci(self, altro):
+        """
+        Unisce allo sketch i valori riassunti da un altro sketch (es. di un'altra partizione o di un altro processo).
+        :param altro: SketchKLL
+        :return: lo sketch aggiornato
+        """
+        while len(self.livelli) < len(altro.livelli):
+            self.livelli.append(np.empty(0, dtype=np.float64))
+        for livello, valori in enumerate(altro.livelli):
+            self.livelli[livello] = np.concatenate([self.livelli[livello], valori])
+
+        self.n += altro.n
+        self.k = max(self.k, altro.k)
+        self.compatta()
+        return self
+
+    def compatta(self):
+        """
+        Compatta i livelli che superano la propria capacità: i valori del livello vengono ordinati e ne viene
+        promosso al livello successivo (con peso doppio) uno ogni due, a partire da una posizione casuale. Se il numero
+        di valori è dispari, il maggiore resta nel livello.
+        :return: None
+        """
+        livello = 0
+        while livello < len(self.livelli):
+            valori = self.livelli[livello]
+            if len(valori) < self.capacita(livello):
+                livello += 1
+                continue
+
+            if livello + 1 == len(self.livelli):
+                self.livelli.append(np.empty(0, dtype=np.float64))
+
+            valori = np.sort(valori)
+            resto = valori[len(valori) - len(valori) % 2:]
+            promossi = valori[self.rng.integers(2):len(valori) - len(resto):2]
+
+            self.livelli[livello] = resto
+            self.livelli[livello + 1] = np.concatenate([self.livelli[livello + 1], promossi])
+
+            # L'aggiunta di un livello riduce la capacità di quelli inferiori: riparto dal primo
+            livello = 0
+
+    def quantile(self, q):
+        """
+        Calcola il quantile (o i quantili) approssimato dei valori riassunti dallo sketch.
+        :param q: quantile o lista di quantili in [0, 1]
+        :return: valore (o array di valori) del quantile; NaN se lo sketch è vuoto
+        """
+        scalare = np.ndim(q) == 0
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.n == 0:
+            risultato = np.full(len(q), np.nan)
+            return risultato[0] if scalare else risultato
+
+        valori = np.concatenate(self.livelli)
+        pesi = np.concatenate([np.full(len(v), 2 ** livello, dtype=np.int64) for livello, v in enumerate(self.livelli)])
+        ordine = np.argsort(valori, kind='stable')
+        valori = valori[ordine]
+        pesi_cumulati = np.cumsum(pesi[ordine])
+
+        # Primo valore il cui peso cumulato supera il rango richiesto
+        posizioni = np.searchsorted(pesi_cumulati, q * (pesi_cumulati[-1] - 1), side='right')
+        risultato = valori[np.minimum(posizioni, len(valori) - 1)]
+        return risultato[0] if scalare else risultato
+
+
+def errore_per_k(k) -> float:
+    """
+    Errore di rango normalizzato di un singolo quantile per uno sketch KLL con parametro k (stima empirica).
+    :param k: parametro dello sketch
+    :return: errore di rango normalizzato
+    """
+    return 2.296 / k ** 0.9723
+
+
+def k_per_errore(errore) -> int:
+    """
+    Parametro k minimo per ottenere l'errore di rango normalizzato specificato.
+    :param errore: errore di rango normalizzato desiderato (es. 0.01 per l'1%)
+    :return: k
+    """
+    return max(int(math.ceil((2.296 / errore) ** (1 / 0.9723))), 8)
+
+
+def crea_sketch_colonne(columns, errore=None, seed=SEED_SKETCH) -> dict:
+    """
+    Crea uno sketch per ciascuna colonna. Con un seme fissato, a parità di dati e di batch, i quantili (e quindi i
+    limiti IQR) sono gli stessi in ogni esecuzione.
+    :param columns: colonne
+    :param errore: errore di rango normalizzato desiderato (opzionale)
+    :param seed: seme dei generatori casuali (di default SEED_SKETCH; None per un seme casuale)
+    :return: dizionario {colonna: SketchKLL}
+    """
+    return {column: SketchKLL(errore=errore, seed=seed) for column in columns}
+
+
+def aggiorna_sketch_colonne(sketches, valori):
+    """
+    Aggiunge agli sketch delle colonne i valori di un batch o di una partizione.
+    :param sketches: dizionario {colonna: SketchKLL}
+    :param valori: vista numerica del batch (vista_numerica), con le colonne nell'ordine di sketches
+    :return: sketches
+    """
+    for i, sketch in enumerate(sketches.values()):
+        sketch.aggiorna(valori[:, i])
+    return sketches
+
+
+def unisci_sketch_colonne(sketches, altri):
+    """
+    Unisce gli sketch di due partizioni (o di due processi), colonna per colonna.
+    :param sketches: dizionario {colonna: SketchKLL}
+    :param altri: dizionario {colonna: SketchKLL} con le stesse colonne
+    :return: sketches
+    """
+    for column, sketch in sketches.items():
+        sketch.unisci(altri[column])
+    return sketches
+
+
+def limiti_da_sketch(sketches) -> pd.DataFrame:
+    """
+    Calcola i limiti IQR approssimati delle colonne dai rispettivi sketch.
+    :param sketches: dizionario {colonna: SketchKLL}
+    :return: DataFrame indicizzato per colonna con 'lower_bound' e 'upper_bound', come calcola_limiti_outliers
+    """
+    quartili = pd.DataFrame({column: sketch.quantile([0.25, 0.75]) for column, sketch in sketches.items()},
+                            index=[0.25, 0.75])
+    return limiti_da_quartili(quartili)
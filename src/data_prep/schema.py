@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import logging
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Colonne temporali del dataset: vengono convertite in datetime64[ns, UTC] una sola volta al caricamento e su di
+# esse vengono applicate la rimozione degli outliers e lo smoothing
+COLONNE_TEMPORALI = ['data_nascita', 'data_contatto', 'data_erogazione', 'ora_inizio_erogazione',
+                     'ora_fine_erogazione']
+
+# Valore intero con cui NaT viene rappresentato nella vista int64 di una colonna datetime
+NAT_INT64 = np.iinfo(np.int64).min
+
+
+def applica_schema(df, columns=None) -> pd.DataFrame:
+    """
+    Converte le colonne temporali presenti nel DataFrame in datetime64[ns, UTC]. I valori non validi diventano NaT.
+    Le colonne già convertite non vengono rielaborate, quindi la funzione può essere applicata più volte.
+    'data_disdetta' non viene convertita: la pipeline ne usa solo la presenza.
+    :param df: dataFrame letto dal file Parquet
+    :param columns: colonne da convertire (opzionale, di default COLONNE_TEMPORALI)
+    :return: dataFrame con le colonne temporali in datetime64[ns, UTC]
+    """
+    for column in COLONNE_TEMPORALI if columns is None else columns:
+        if column in df.columns and not is_datetime_utc(df[column]):
+            df[column] = pd.to_datetime(df[column], errors='coerce', utc=True)
+    return df
+
+
+def is_datetime_utc(serie) -> bool:
+    """
+    Verifica se la serie è già in formato datetime64[ns, UTC].
+    :param serie: Serie da verificare
+    :return: True se la serie è in datetime64[ns, UTC]
+    """
+    return serie.dtype == pd.DatetimeTZDtype('ns', 'UTC')
+
+
+def epoch_ns(serie) -> np.ndarray:
+    """
+    Restituisce la vista int64 di una colonna datetime: nanosecondi dal 1970-01-01 UTC, NaT come NAT_INT64.
+    Non viene creata una copia dei dati.
+    :param serie: Serie datetime64[ns, UTC]
+    :return: array int64
+    """
+    return serie.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def da_epoch_ns(valori, index=None) -> pd.Series:
+    """
+    Costruisce una Serie datetime64[ns, UTC] dai nanosecondi dal 1970-01-01 UTC (NAT_INT64 diventa NaT).
+    :param valori: array int64
+    :param index: indice della Serie (opzionale)
+    :return: Serie datetime64[ns, UTC]
+    """
+    return pd.Series(np.asarray(valori, dtype=np.int64).view('datetime64[ns]'), index=index).dt.tz_localize('UTC')
@@ -1,13 +1,22 @@
-from sklearn.preprocessing import LabelEncoder
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from data_prep.schema import epoch_ns
+from data_transformation.encoding import CARTELLA_VOCABOLARI, codifica_colonne
+from instrumentation.instrumentation import misura
 
+# Colonne delle date, convertite in secondi UNIX
+COLONNE_DATE = ['data_contatto', 'data_erogazione']
 
-def data_transformation(df):
+
+@misura()
+def data_transformation(df, cartella_vocabolari=CARTELLA_VOCABOLARI, aggiorna_vocabolari=False):
     """
     Esegue la trasformazione dei dati (normalizzazione e aggregazione) sul DataFrame.
     :param df: DataFrame da trasformare
-    :return: DataFrame trasformato
+    :param cartella_vocabolari: cartella dei vocabolari delle feature categoriche
+    :param aggiorna_vocabolari: se True aggiunge ai vocabolari i valori nuovi (altrimenti codificati come sconosciuti)
+    :return: DataFrame trasformato, vocabolari, reverse_mapping, feature numeriche e categoriche
     """
 
     # Elimina le feature poco significative
@@ -17,9 +26,10 @@ def data_transformation(df):
     categorical_features, numerical_features = define_features_types()
 
     # Applica la trasformazione (encoding) delle feature categoriche
-    df, label_encoders, reverse_mapping = transform_and_preprocess_data(df, categorical_features)
+    df, vocabolari, reverse_mapping = transform_and_preprocess_data(df, categorical_features, cartella_vocabolari,
+                                                                    aggiorna_vocabolari)
 
-    return df, label_encoders, reverse_mapping, numerical_features, categorical_features
+    return df, vocabolari, reverse_mapping, numerical_features, categorical_features
 
 
 def remove_features(df: pd.DataFrame) -> pd.DataFrame:
@@ -47,36 +57,98 @@ def define_features_types() -> (list, list):
     return categorical_features, numerical_features
 
 
-def transform_and_preprocess_data(df: pd.DataFrame, categorical_features: list):
+def transform_and_preprocess_data(df: pd.DataFrame, categorical_features: list, cartella_vocabolari=CARTELLA_VOCABOLARI,
+                                  aggiorna_vocabolari=False):
     """
-    Effettua l'encoding delle feature categoriche con metodo LabelEncoder, e crea un dizionario
-    che mappa l'encoding delle feature ad ogni feature.
+    Effettua l'encoding delle feature categoriche con i vocabolari salvati (codifica_colonne): i codici restano
+    gli stessi fra un'esecuzione e l'altra, e il reverse_mapping viene costruito dai vocabolari.
     :param df: dataFrame
     :param categorical_features: colonne delle feature categoriche
-    :return: df, label_encoders, reverse_mapping
+    :param cartella_vocabolari: cartella dei vocabolari
+    :param aggiorna_vocabolari: se True aggiunge ai vocabolari i valori nuovi
+    :return: df, vocabolari, reverse_mapping
     """
-    label_encoders = {}
-    reverse_mapping = {}
-
-    # Gestione delle colonne temporali (converte in timestamp con utc=True)
-    for col in ['data_contatto', 'data_erogazione']:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce', utc=True)
-            df[col] = df[col].astype('int64') // 10 ** 9  # Convert to UNIX timestamp safely
-
-    # Applica LabelEncoder a ciascuna colonna categorica
-    for col in categorical_features:
-        if col in df.columns and (df[col].dtype == 'object' or isinstance(df[col].dtype, pd.StringDtype)):
-            le = LabelEncoder()
-            df[col] = le.fit_transform(df[col])
-            label_encoders[col] = le
-            # Aggiungi la mappatura inversa per ogni feature categorica
-            reverse_mapping[col] = {i: label for i, label in enumerate(le.classes_)}
+    # Gestione delle colonne temporali (converte in UNIX timestamp dalla vista int64 in nanosecondi)
+    for col in COLONNE_DATE:
+        if col in df.columns and pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = epoch_ns(df[col]) // 10 ** 9
+
+    # Codifica ciascuna colonna categorica con il suo vocabolario
+    colonne = [col for col in categorical_features
+               if col in df.columns and (df[col].dtype == 'object' or isinstance(df[col].dtype, pd.StringDtype)
+                                         or isinstance(df[col].dtype, pd.CategoricalDtype))]
+    df, vocabolari, reverse_mapping = codifica_colonne(df, colonne, cartella_vocabolari, aggiorna_vocabolari)
 
     # Verifica che tutte le colonne siano numeriche dopo l'encoding
     if not all(np.issubdtype(df[col].dtype, np.number) for col in df.columns):
         raise ValueError("Ci sono ancora colonne non numeriche nel DataFrame dopo l'encoding.")
 
-    return df, label_encoders, reverse_mapping
+    return df, vocabolari, reverse_mapping
+
+
+@misura()
+def costruisci_matrice(df) -> np.ndarray:
+    """
+    Costruisce la matrice delle feature usata dal clustering e dalle metriche: un unico array float32 contiguo in
+    ordine C (una riga per campione), da condividere fra elbow method, clustering e silhouette invece di convertire
+    il DataFrame in float64 in ogni fase. I valori sono quelli del DataFrame: le date restano in secondi UNIX
+    (TruncatedSVD non centra i dati, quindi una traslazione ne cambierebbe le componenti) e in float32 vengono
+    arrotondate a multipli di 128 secondi (circa 1.7e9).
+    :param df: DataFrame numerico (data_transformation)
+    :return: matrice float32 di forma (campioni, feature), con le colonne nell'ordine di df
+    """
+    matrice = np.empty(df.shape, dtype=np.float32, order='C')
+    for j, col in enumerate(df.columns):
+        matrice[:, j] = df[col].to_numpy()
+    return matrice
 
 
+@misura()
+def costruisci_matrice_sparsa(df, categorical_features, vocabolari, pesi_frequenza=False) -> sparse.csr_matrix:
+    """
+    Costruisce la matrice delle feature in formato CSR con codifica one-hot delle feature categoriche, alternativa a
+    costruisci_matrice: i codici non introducono un ordinamento fra regioni o tipologie, e la matrice viene passata
+    a TruncatedSVD senza essere mai convertita in densa. Ogni riga contiene un valore per ogni feature numerica
+    (standardizzata) e un solo valore non nullo per ogni feature categorica, nella colonna del suo codice: la memoria
+    è proporzionale al numero di valori non nulli anche con feature di molti valori. Ogni feature categorica occupa
+    una colonna per valore del vocabolario più una per CODICE_SCONOSCIUTO.
+    Con pesi_frequenza ogni codice vale 1 / sqrt(frequenza relativa) invece di 1, quindi ogni colonna one-hot ha
+    varianza vicina a 1 come le feature numeriche e i valori rari non vengono schiacciati da quelli frequenti.
+    :param df: DataFrame numerico (data_transformation)
+    :param categorical_features: feature categoriche (codificate con i vocabolari)
+    :param vocabolari: vocabolari delle feature categoriche (data_transformation)
+    :param pesi_frequenza: se True pesa i codici con l'inverso della radice della frequenza
+    :return: matrice CSR float32 di forma (campioni, feature numeriche + valori delle feature categoriche)
+    """
+    categoriche = [col for col in categorical_features if col in df.columns and col in vocabolari]
+    numeriche = [col for col in df.columns if col not in categoriche]
+    righe, valori_per_riga = len(df), len(df.columns)
+    colonne_totali = len(numeriche) + sum(len(vocabolari[col]['valori']) + 1 for col in categoriche)
+    tipo_indici = np.int32 if max(righe * valori_per_riga, colonne_totali) < 2 ** 31 else np.int64
+
+    # Valori e indici di colonna delle righe: le colonne di ogni riga sono già ordinate
+    dati = np.empty((righe, valori_per_riga), dtype=np.float32)
+    indici = np.empty((righe, valori_per_riga), dtype=tipo_indici)
+
+    for j, col in enumerate(numeriche):
+        valori = df[col].to_numpy(dtype=np.float64)
+        if righe:
+            valori = (valori - valori.mean()) / (valori.std() or 1.0)
+        dati[:, j] = valori
+        indici[:, j] = j
+
+    inizio = len(numeriche)
+    for j, col in enumerate(categoriche, start=len(numeriche)):
+        # L'ultima colonna del blocco è quella di CODICE_SCONOSCIUTO (-1)
+        larghezza = len(vocabolari[col]['valori']) + 1
+        codici = np.mod(df[col].to_numpy().astype(tipo_indici), larghezza)
+        indici[:, j] = inizio + codici
+        if pesi_frequenza:
+            conteggi = np.bincount(codici, minlength=larghezza)
+            dati[:, j] = np.sqrt(righe / np.maximum(conteggi, 1))[codici]
+        else:
+            dati[:, j] = 1.0
+        inizio += larghezza
+
+    indptr = np.arange(0, righe * valori_per_riga + 1, valori_per_riga, dtype=tipo_indici)
+    return sparse.csr_matrix((dati.ravel(), indici.ravel(), indptr), shape=(righe, colonne_totali))
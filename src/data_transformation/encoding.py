@@ -0,0 +1,137 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import logging
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Cartella dei vocabolari delle feature categoriche (un file JSON per colonna), generati alla prima esecuzione e
+# non versionati con git (.gitignore)
+CARTELLA_VOCABOLARI = 'datasets/vocabolari'
+
+# Codice dei valori assenti dal vocabolario e dei valori mancanti, e relativa etichetta nel reverse_mapping
+CODICE_SCONOSCIUTO = -1
+ETICHETTA_SCONOSCIUTO = 'Sconosciuto'
+
+
+def codifica_colonne(df, colonne, cartella=CARTELLA_VOCABOLARI, aggiorna=False):
+    """
+    Codifica le colonne categoriche con i vocabolari salvati in cartella: il codice di un valore è la sua posizione
+    nel vocabolario, quindi resta lo stesso in tutte le esecuzioni, e viene salvato nel tipo intero più piccolo
+    (tipo_codici). I vocabolari mancanti vengono creati con i valori ordinati (gli stessi codici di LabelEncoder); i
+    valori assenti dal vocabolario ricevono CODICE_SCONOSCIUTO, a meno che aggiorna sia True: in quel caso vengono
+    aggiunti in fondo al vocabolario, di cui aumenta la versione, senza cambiare i codici esistenti.
+    :param df: dataFrame (le colonne vengono sostituite dai codici)
+    :param colonne: colonne da codificare
+    :param cartella: cartella dei vocabolari
+    :param aggiorna: se True aggiunge ai vocabolari i valori nuovi
+    :return df: dataFrame codificato
+    :return vocabolari: dizionario {colonna: vocabolario}
+    :return reverse_mapping: dizionario {colonna: {codice: valore}}
+    """
+    vocabolari = {}
+    reverse_mapping = {}
+
+    for col in colonne:
+        codici, valori = fattorizza(df[col])
+        vocabolario = carica_vocabolario(col, cartella)
+
+        nuovi = valori[~valori.isin(vocabolario['valori'])] if vocabolario else valori
+        if vocabolario is None or (aggiorna and len(nuovi)):
+            vocabolario = estendi_vocabolario(vocabolario, col, nuovi)
+            salva_vocabolario(vocabolario, cartella)
+
+        # Codici del vocabolario per ogni valore distinto, poi per ogni campione con un accesso per indici interi
+        mappa = np.append(pd.Index(vocabolario['valori']).get_indexer(valori), CODICE_SCONOSCIUTO)
+        df[col] = mappa.astype(tipo_codici(vocabolario))[codici]
+
+        sconosciuti = int((df[col].to_numpy() == CODICE_SCONOSCIUTO).sum())
+        if sconosciuti:
+            logging.warning(f"{col}: {sconosciuti} campioni con valori mancanti o assenti dal vocabolario "
+                            f"(versione {vocabolario['versione']})")
+
+        vocabolari[col] = vocabolario
+        reverse_mapping[col] = {**dict(enumerate(vocabolario['valori'])), CODICE_SCONOSCIUTO: ETICHETTA_SCONOSCIUTO}
+
+    return df, vocabolari, reverse_mapping
+
+
+def tipo_codici(vocabolario) -> np.dtype:
+    """
+    Tipo intero più piccolo che contiene i codici di un vocabolario (da 0 a numero di valori - 1) e
+    CODICE_SCONOSCIUTO: int8 fino a 128 valori, int16 fino a 32768, altrimenti int32.
+    :param vocabolario: vocabolario
+    :return: dtype dei codici
+    """
+    return np.result_type(np.min_scalar_type(-max(len(vocabolario['valori']), 1)), np.int8)
+
+
+def fattorizza(colonna):
+    """
+    Restituisce i codici dei campioni (-1 per i valori mancanti) e i valori distinti di una colonna. Per una
+    colonna categorica vengono riutilizzati codici e categorie; negli altri casi ogni valore viene convertito con
+    pd.factorize, senza ordinare.
+    :param colonna: Series
+    :return codici: array dei codici dei campioni, da usare come indici dei valori distinti
+    :return valori: Index dei valori distinti
+    """
+    if isinstance(colonna.dtype, pd.CategoricalDtype):
+        return colonna.cat.codes.to_numpy(), colonna.cat.categories
+    codici, valori = pd.factorize(colonna)
+    return codici, pd.Index(valori)
+
+
+def estendi_vocabolario(vocabolario, colonna, nuovi) -> dict:
+    """
+    Crea il vocabolario di una colonna, o aggiunge in fondo i valori nuovi aumentandone la versione. I valori nuovi
+    vengono ordinati, in modo che il primo vocabolario assegni gli stessi codici di LabelEncoder.
+    :param vocabolario: vocabolario esistente (o None)
+    :param colonna: nome della colonna
+    :param nuovi: valori da aggiungere
+    :return: vocabolario {'colonna', 'versione', 'valori'}
+    """
+    valori = [] if vocabolario is None else list(vocabolario['valori'])
+    versione = 0 if vocabolario is None else vocabolario['versione']
+    logging.info(f"Vocabolario di {colonna}: {len(nuovi)} valori aggiunti (versione {versione + 1})")
+    return {'colonna': colonna, 'versione': versione + 1, 'valori': valori + sorted(nuovi.tolist())}
+
+
+def percorso_vocabolario(colonna, cartella=CARTELLA_VOCABOLARI) -> str:
+    """
+    Percorso del file del vocabolario di una colonna.
+    :param colonna: nome della colonna
+    :param cartella: cartella dei vocabolari
+    :return: percorso del file
+    """
+    return os.path.join(cartella, f'{colonna}.json')
+
+
+def carica_vocabolario(colonna, cartella=CARTELLA_VOCABOLARI):
+    """
+    Legge il vocabolario di una colonna.
+    :param colonna: nome della colonna
+    :param cartella: cartella dei vocabolari
+    :return: vocabolario, o None se non esiste
+    """
+    file_path = percorso_vocabolario(colonna, cartella)
+    if not os.path.isfile(file_path):
+        return None
+    with open(file_path) as file:
+        return json.load(file)
+
+
+def salva_vocabolario(vocabolario, cartella=CARTELLA_VOCABOLARI):
+    """
+    Salva il vocabolario di una colonna (scritto con un nome temporaneo e poi rinominato).
+    :param vocabolario: vocabolario {'colonna', 'versione', 'valori'}
+    :param cartella: cartella dei vocabolari
+    :return: None
+    """
+    os.makedirs(cartella, exist_ok=True)
+    file_path = percorso_vocabolario(vocabolario['colonna'], cartella)
+    with open(file_path + '.tmp', 'w') as file:
+        json.dump(vocabolario, file, indent=1, ensure_ascii=False)
+    os.replace(file_path + '.tmp', file_path)
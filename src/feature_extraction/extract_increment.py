@@ -1,28 +1,46 @@
+import logging
+import numpy as np
 import pandas as pd
+from feature_extraction.features_extraction import conta_professionisti
+from instrumentation.instrumentation import misura
 
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
 
-def incremento(df):
+# Granularità dei periodi su cui viene calcolato l'incremento e relativa durata in mesi
+GRANULARITA = {'mese': 1, 'trimestre': 3, 'semestre': 6, 'anno': 12}
+
+# Incremento associato ad ogni tipologia, anno e mese salvato da incremento
+FILE_INCREMENTO = 'datasets/df_incremento_percentuale_esteso.parquet'
+
+
+@misura()
+def incremento(df, df_aggregato=None, granularita='semestre'):
     """
     Funzione principale che calcola la variabile di incremento, estende i risultati per ciascun mese
-    e li unisce al DataFrame originale. Alla fine elimina i dati relativi all'anno 2019,
-    poiché l'incremento si applica solo a partire dal 2020.
+    e li unisce al DataFrame originale. Alla fine elimina i dati relativi al primo anno (il 2019),
+    poiché l'incremento si applica solo a partire dall'anno successivo.
     :param df: DataFrame contenente i dati originali.
+    :param df_aggregato: conteggi dei professionisti per mese (conta_professionisti o save_monthly_aggregates);
+                         se non specificato vengono calcolati da df
+    :param granularita: periodo su cui viene calcolato l'incremento fra anni successivi (chiave di GRANULARITA)
     :return df_finale: DataFrame finale con la variabile 'incremento' calcolata e unita ai dati originali.
     """
     # Definisco i dati da utilizzare
-    tipologie, DaF, intervalli_anni_mese = dati_da_utilizzare(df)
+    tipologie, DaF = dati_da_utilizzare(df, df_aggregato)
 
-    # Calcola le occorrenze totali di ogni professionista per l'intervallo di mesi specificato
-    risultato = somma_per_intervallo_mesi(DaF, tipologie)
+    # Calcola le occorrenze totali di ogni professionista per ogni periodo di ogni anno
+    risultato = somma_per_intervallo_mesi(DaF, tipologie, granularita)
 
     # Calcola l'incremento fra anni successivi e associa ad ogni anno una label  "alta", "media", "bassa" o "costante"
-    risultato_con_incremento = calcola_incremento(risultato, intervalli_anni_mese)
+    risultato_con_incremento = calcola_incremento(risultato)
 
     # Associa la label "alta", "media", "bassa" o "costante" ad ogni mese
-    risultato_esteso = estendi_incremento(risultato_con_incremento)
+    risultato_esteso = estendi_incremento(risultato_con_incremento, granularita)
 
     # Salva il dataFrame esteso in un nuovo file
-    risultato_esteso.to_parquet('datasets/df_incremento_percentuale_esteso.parquet', index=False)
+    risultato_esteso.to_parquet(FILE_INCREMENTO, index=False)
 
     # Unisce la colonna incremento al DataFrame: associa ad ogni campione una label alta, media, bassa, costante
     df_finale = unisci_incremento(df, risultato_esteso)
@@ -30,165 +48,142 @@ def incremento(df):
     return df_finale
 
 
-def dati_da_utilizzare(df):
+def dati_da_utilizzare(df, df_aggregato=None):
     """
-    Definisce i dati da utilizzare per calcolare l'incremento
+    Definisce i dati da utilizzare per calcolare l'incremento. Gli anni e i periodi su cui viene calcolato
+    l'incremento sono quelli presenti nei dati.
     :param df: DataFrame contenente i dati iniziali
+    :param df_aggregato: conteggi dei professionisti per mese (opzionale, altrimenti calcolati da df)
     :return tipologie: lista delle tipologie di professionista sanitario
     :return dF_occorrenze: DataFrame che contiene il numero di occorrenze di ogni professionista sanitario per mese
-    :return intervalli_anni_mesi: lista di tuple che definiscono intervalli di anni e mesi in formato semestrale
         """
     tipologie = df['tipologia_professionista_sanitario'].unique()  # Estrae le tipologie uniche di professionista
 
-    dF_occorrenze = pd.read_parquet('datasets/df_aggregato.parquet')  # Lettura del file contente le occorrenze
+    # Occorrenze di ogni professionista per mese, calcolate in memoria se non fornite (la copia evita di modificare
+    # il DataFrame ricevuto)
+    dF_occorrenze = conta_professionisti(df) if df_aggregato is None else df_aggregato.copy()
 
-    # Lista degli intervalli di anni e mesi in formato semestrale
-    intervalli_anni_mesi = [
-        (2019, 2020, '1, 2, 3, 4, 5, 6'),
-        (2019, 2020, '7, 8, 9, 10, 11, 12'),
-        (2020, 2021, '1, 2, 3, 4, 5, 6'),
-        (2020, 2021, '7, 8, 9, 10, 11, 12'),
-        (2021, 2022, '1, 2, 3, 4, 5, 6'),
-        (2021, 2022, '7, 8, 9, 10, 11, 12')
-    ]
-    return tipologie, dF_occorrenze, intervalli_anni_mesi
+    return tipologie, dF_occorrenze
 
 
-def get_intervallo_mesi(mese):
+def etichette_periodi(granularita) -> np.ndarray:
     """
-    Restituisce l'intervallo di mesi a cui appartiene il mese specificato.
-    :param mese: Mese per il quale si desidera ottenere l'intervallo
-    :return intervallo: Intervallo di mesi in cui il mese rientra
-       """
-    intervalli_mesi = {
-        (1, 2, 3, 4, 5, 6): '1, 2, 3, 4, 5, 6',
-        (7, 8, 9, 10, 11, 12): '7, 8, 9, 10, 11, 12'
-    }
-    for mesi, intervallo in intervalli_mesi.items():
-        if mese in mesi:
-            return intervallo
-    return "Intervallo non trovato"
+    Restituisce l'intervallo di mesi di ogni periodo dell'anno (es. per i semestri '1, 2, 3, 4, 5, 6' e
+    '7, 8, 9, 10, 11, 12'), indicizzato per numero del periodo (da 0).
+    :param granularita: chiave di GRANULARITA
+    :return: array degli intervalli di mesi
+    """
+    durata = GRANULARITA[granularita]
+    return np.array([', '.join(str(mese) for mese in range(inizio + 1, inizio + durata + 1))
+                     for inizio in range(0, 12, durata)], dtype=object)
 
 
-def somma_per_intervallo_mesi(df, tipologie):
+def somma_per_intervallo_mesi(df, tipologie, granularita='semestre'):
     """
-       Calcola la somma delle occorrenze di ogni professionista sanitario per l'intervallo di
-       mesi specificato (semestre). I risultati vengono raggruppati in un dataframe che ha come colonne
-       'tipologia_professionista_sanitario', 'anno', 'intervallo_mesi' e 'conteggio'.
+       Calcola la somma delle occorrenze di ogni professionista sanitario per ogni periodo (di default il
+       semestre) di ogni anno. I risultati vengono raggruppati in un dataframe che ha come colonne
+       'tipologia_professionista_sanitario', 'anno', 'periodo' (numero del periodo nell'anno, da 0), 'intervallo_mesi'
+       e 'conteggio'.
        :param df: DataFrame contenente i dati
        :param tipologie: Lista di tipologie di professionisti sanitari
+       :param granularita: chiave di GRANULARITA
        :return risultato: DataFrame con la somma delle occorrenze per tipologia, anno e intervallo di mesi
        """
-    # Aggiungo la colonna 'intervallo_mesi'
-    df['intervallo_mesi'] = df['mese'].apply(get_intervallo_mesi)
+    # Aggiungo la colonna 'periodo'
+    df['periodo'] = (df['mese'] - 1) // GRANULARITA[granularita]
 
     # Verifico che le tipolgie di professionista sanitario siano quelle estratte in precedenza
     df_filtrato = df[df['tipologia_professionista_sanitario'].isin(tipologie)]
 
-    # Raggruppa e somma i dati che hanno stesso tipologia di professionista sanitario, anno e intervallo di mesi
+    # Raggruppa e somma i dati che hanno stesso tipologia di professionista sanitario, anno e periodo
     risultato = df_filtrato.groupby(['tipologia_professionista_sanitario', 'anno',
-                                     'intervallo_mesi'])['conteggio'].sum().reset_index()
+                                     'periodo'])['conteggio'].sum().reset_index()
+    risultato.insert(3, 'intervallo_mesi', etichette_periodi(granularita)[risultato['periodo'].to_numpy()])
 
     return risultato
 
 
-def calcola_incremento(df, intervalli_anni_mesi):
+def calcola_incremento(df, anni=None):
     """
-    Crea una tabella che ha come colonne 'tipologia_professionista_sanitario', 'intervallo_mesi', e 'anno',
-    e calcola l'incremento percentuale fra due anni successivi.
-    :param df: dataFrame contenente i dati raggruppati per anno e mese
-    :param intervalli_anni_mesi: Intervalli di anni e mesi per cui calcolare l'incremento
-    :return risultato_con_incremento: dataFrame contenente l'incremento percentuale per ciascun intervallo
+    Calcola l'incremento percentuale fra due anni successivi per ogni tipologia di professionista sanitario e
+    periodo. I conteggi vengono disposti in un array (tipologia, periodo, anno) e l'incremento viene calcolato in
+    un'unica operazione fra l'array e lo stesso array spostato di un anno. Se l'anno precedente non ha occorrenze
+    l'incremento è infinito; un anno senza alcun dato conta zero occorrenze.
+    :param df: dataFrame con i conteggi per tipologia, anno e periodo (somma_per_intervallo_mesi)
+    :param anni: anni con dati (opzionale, di default quelli di df). Va specificato se df contiene solo alcuni periodi
+    :return risultato_con_incremento: dataFrame con le colonne 'tipologia_professionista_sanitario', 'anno'
+                                      (es. '2019-2020'), 'intervallo_mesi', 'incremento_percentuale' e 'incremento',
+                                      e con 'year' (secondo anno) e 'periodo'
     """
-
-    # Crea una tabella pivot per avere anni come colonne
-    df_pivot = df.pivot_table(index=['tipologia_professionista_sanitario', 'intervallo_mesi'], columns='anno',
-                              values='conteggio').reset_index()
-
-    def incremento_percentuale(row, anno1, anno2):
-        """
-        Calcola l'incremento percentuale del conteggio di professionisti sanitari tra due anni consecutivi.
-
-        """
-        conteggio_anno1 = row.get(anno1, 0)
-        conteggio_anno2 = row.get(anno2, 0)
-
-        # Calcolo dell'incremento percentuale
-        return ((conteggio_anno2 - conteggio_anno1) / conteggio_anno1) * 100 if conteggio_anno1 > 0 else float('inf')
-
-    risultati = []
-    # Itera su ciascuna coppia di 'anno' e 'intervallo mesi' presente in 'intervalli_anni_mesi'.
-    for (anno1, anno2, intervallo) in intervalli_anni_mesi:
-        df_intervallo = df_pivot[df_pivot['intervallo_mesi'] == intervallo]
-
-        # Itera su ciascuna riga del DataFrame filtrato.
-        for _, row in df_intervallo.iterrows():
-            incremento = incremento_percentuale(row, anno1,
-                                                anno2)  # Calcola l'incremento percentuale tra 'anno1' e 'anno2'
-            classificazione = classifica_incremento(
-                incremento)  # Classifica l'incremento in una delle categorie: alto, medio, basso, costante
-
-            # Aggiunge un dizionario con i risultati per la riga corrente nella lista 'risultati'.
-            risultati.append({
-                'tipologia_professionista_sanitario': row['tipologia_professionista_sanitario'],
-                'anno': f"{anno1}-{anno2}",
-                'intervallo_mesi': intervallo,
-                'incremento_percentuale': incremento,
-                'incremento': classificazione
-            })
-    risultato_con_incremento = pd.DataFrame(risultati)
+    codici, tipologie = pd.factorize(df['tipologia_professionista_sanitario'], sort=True)
+    anni_con_dati = df['anno'].to_numpy(np.int64) if anni is None else np.asarray(anni, dtype=np.int64)
+    anno_iniziale = anni_con_dati.min()
+    tutti_gli_anni = np.arange(anno_iniziale, anni_con_dati.max() + 1)
+    anni = df['anno'].to_numpy(np.int64)
+    periodi = df['periodo'].to_numpy(np.int64)
+
+    # Conteggi per (tipologia, periodo, anno): NaN se la tipologia non compare nel periodo di un anno con dati
+    conteggi = np.full((len(tipologie), periodi.max() + 1, len(tutti_gli_anni)), np.nan)
+    conteggi[codici, periodi, anni - anno_iniziale] = df['conteggio'].to_numpy(np.float64)
+    conteggi[:, :, ~np.isin(tutti_gli_anni, anni_con_dati)] = 0
+    etichette = np.empty(conteggi.shape[1], dtype=object)
+    etichette[periodi] = df['intervallo_mesi'].to_numpy()
+
+    precedente, successivo = conteggi[:, :, :-1], conteggi[:, :, 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentuale = np.where(precedente > 0, ((successivo - precedente) / precedente) * 100, np.inf)
+
+    # Una riga per ogni coppia di anni e per ogni tipologia e periodo con occorrenze, ordinate per coppia di anni,
+    # periodo e tipologia
+    presenti = (conteggi > 0).any(axis=2)
+    coppia, periodo, tipologia = np.nonzero(np.broadcast_to(presenti.T, (len(tutti_gli_anni) - 1, *presenti.T.shape)))
+    percentuale = percentuale[tipologia, periodo, coppia]
+    anno = tutti_gli_anni[coppia + 1]
+
+    risultato_con_incremento = pd.DataFrame({
+        'tipologia_professionista_sanitario': tipologie.to_numpy()[tipologia],
+        'anno': [f"{anno1}-{anno2}" for anno1, anno2 in zip((anno - 1).tolist(), anno.tolist())],
+        'intervallo_mesi': etichette[periodo],
+        'incremento_percentuale': percentuale,
+        'incremento': classifica_incremento(percentuale),
+        'year': anno,
+        'periodo': periodo
+    })
 
     return risultato_con_incremento
 
 
-def classifica_incremento(percentuale):
+def classifica_incremento(percentuale) -> np.ndarray:
     """
-    Classifica la percentuale dell'incremento in "alta", "media", "bassa" e "costante".
-    :param percentuale: La percentuale di incremento da classificare.
-    :return str: La classificazione dell'incremento ('alta', 'media', 'costante', 'bassa').
+    Classifica le percentuali di incremento in "alta", "media", "bassa" e "costante". Le percentuali non definite
+    (NaN, quando la tipologia non compare nel periodo del secondo anno) e infinite sono classificate "alta".
+    :param percentuale: array delle percentuali di incremento da classificare.
+    :return: array delle classificazioni ('alta', 'media', 'costante', 'bassa').
     """
-    if percentuale < 0:
-        return 'costante'
-    elif 0 <= percentuale <= 35:
-        return 'bassa'
-    elif 35 < percentuale <= 80:
-        return 'media'
-    else:
-        return 'alta'
+    percentuale = np.asarray(percentuale, dtype=np.float64)
+    return np.select([percentuale < 0, percentuale <= 35, percentuale <= 80], ['costante', 'bassa', 'media'],
+                     default='alta').astype(object)
 
 
-def estendi_incremento(df):
+def estendi_incremento(df, granularita='semestre'):
     """
     Associa l'incremento associato a ciascun intervallo di mesi, assegnandolo a ogni mese individualmente.
-    Per fare questo, considera il dataFrame che contiene l'incremento percentuale per intervalli di mesi
-    e lo "estende": divide gli intervalli di mesi in mesi separati e associa l'incremento ad ognuno di essi.
-    :param df: dataframe
+    Per fare questo, considera il dataFrame che contiene l'incremento percentuale per periodi e lo "estende":
+    ripete ogni riga per ciascun mese del periodo.
+    :param df: dataframe prodotto da calcola_incremento
+    :param granularita: chiave di GRANULARITA
     :return df_esteso: dataframe in cui ad ogni mese è associato un valore di incremento
     """
-    # Crea un DataFrame vuoto per i dati estesi
-    dati_estesi = []
-
-    # Itera su ogni riga del DataFrame esistente
-    for _, row in df.iterrows():
-        # Considera due anni consecutivi e prende solo il secondo (es. 2019-2020, prende 2020)
-        anno_intervallo = row['anno'].split('-')
-        anno_fine = int(anno_intervallo[1])
-
-        # Ottieni l'intervallo di mesi come lista (es. ['1', '2', '3', ...])
-        mesi = row['intervallo_mesi'].split(', ')
+    durata = GRANULARITA[granularita]
+    mesi = df['periodo'].to_numpy(np.int64)[:, np.newaxis] * durata + np.arange(1, durata + 1)
 
-        # Aggiungi una riga per ogni mese dell'intervallo
-        for mese in mesi:
-            dati_estesi.append({
-                'tipologia_professionista_sanitario': row['tipologia_professionista_sanitario'],
-                'year': anno_fine,
-                'month': int(mese),
-                'incremento_percentuale': row['incremento_percentuale'],
-                'incremento': row['incremento']
-            })
-
-    # Converti la lista di dizionari in un DataFrame
-    df_esteso = pd.DataFrame(dati_estesi)
+    df_esteso = pd.DataFrame({
+        'tipologia_professionista_sanitario': np.repeat(df['tipologia_professionista_sanitario'].to_numpy(), durata),
+        'year': np.repeat(df['year'].to_numpy(np.int64), durata),
+        'month': mesi.ravel(),
+        'incremento_percentuale': np.repeat(df['incremento_percentuale'].to_numpy(), durata),
+        'incremento': np.repeat(df['incremento'].to_numpy(), durata)
+    })
 
     # Ordina i dati per tipologia, anno e mese
     df_esteso = df_esteso.sort_values(by=['tipologia_professionista_sanitario', 'year', 'month']).reset_index(drop=True)
@@ -198,22 +193,166 @@ def estendi_incremento(df):
 
 def unisci_incremento(df_originale, risultato_esteso):
     """
-    Unisce il DataFrame originale con il DataFrame esteso (risultato_esteso) basandosi sulle colonne
-    'tipologia_professionista_sanitario', 'year', e 'month'.In questo modo, l'incremento calcolato per
-     ogni combinazione di tipologia, anno e mese verrà aggiunto al DataFrame originale.
-     Inoltre, associa a tutti i dati del 2019 la vari
+    Associa ad ogni campione del DataFrame originale l'incremento calcolato per la sua combinazione di
+    'tipologia_professionista_sanitario', 'year' e 'month'. Invece di un join sulle tre colonne, l'incremento viene
+    letto da una tabella densa (tabella_incremento) con un unico accesso per indici interi: il DataFrame non viene
+    copiato se non per eliminare i campioni del primo anno. I campioni senza incremento ricevono NaN, come con un
+    left join; l'indice del risultato è la posizione del campione nel DataFrame originale.
     :param df_originale: dataFrame iniziale
-    :paramrisultato_esteso: dataFrame con incremento associato ad ogni mese
-    :retur df_unito: dataFrame in cui ogni campione ha associata una feature incremento
+    :param risultato_esteso: dataFrame con incremento associato ad ogni mese
+    :return df_unito: dataFrame in cui ogni campione ha associata una feature incremento
     """
+    etichette = etichette_incremento(df_originale['tipologia_professionista_sanitario'], df_originale['year'],
+                                     df_originale['month'], risultato_esteso)
+
+    # Elimina i dati del primo anno (il 2019), per cui non c'è un anno precedente con cui calcolare l'incremento
+    # (tutti i campioni, se i dati coprono un solo anno e risultato_esteso è vuoto)
+    if risultato_esteso.empty:
+        logging.warning("Nessuna coppia di anni successivi: l'incremento non è definito per alcun campione")
+        posizioni = np.array([], dtype=np.int64)
+    else:
+        posizioni = np.flatnonzero(df_originale['year'].to_numpy() >= risultato_esteso['year'].min())
+    df_unito = df_originale.take(posizioni)
+    df_unito['incremento'] = etichette[posizioni]
+    df_unito.index = pd.Index(posizioni)
 
-    # Unisce il DataFrame originale con il risultato esteso, mantenendo tipologia, anno e mese
-    df_unito = pd.merge(df_originale,
-                        risultato_esteso[['tipologia_professionista_sanitario', 'year', 'month', 'incremento']],
-                        on=['tipologia_professionista_sanitario', 'year', 'month'],
-                        how='left')
+    return df_unito
 
-    # Elimina i dati del 2019
-    df_unito = df_unito[df_unito['year'] != 2019]
 
-    return df_unito
+def etichette_incremento(tipologia, anni, mesi, risultato_esteso) -> np.ndarray:
+    """
+    Legge l'incremento di ogni campione dalla tabella densa di risultato_esteso (tabella_incremento) con un unico
+    accesso per indici interi. I campioni senza incremento ricevono NaN.
+    :param tipologia: Series delle tipologie di professionista sanitario dei campioni
+    :param anni: anni dei campioni
+    :param mesi: mesi dei campioni
+    :param risultato_esteso: dataFrame con incremento associato ad ogni mese
+    :return: array delle label
+    """
+    tabella, tipologie, anno_iniziale = tabella_incremento(risultato_esteso)
+
+    # Indici (tipologia, anno, mese) di ogni campione nella tabella; i campioni senza incremento puntano a una cella
+    # NaN aggiunta in fondo alla tabella appiattita
+    codici = codici_tipologie(tipologia, tipologie)
+    anni = np.asarray(anni, dtype=np.int64) - anno_iniziale
+    mesi = np.asarray(mesi, dtype=np.int64) - 1
+    validi = (codici >= 0) & (anni >= 0) & (anni < tabella.shape[1]) & (mesi >= 0) & (mesi < tabella.shape[2])
+    celle = np.append(tabella.ravel(), np.nan)
+    indici = np.where(validi, np.ravel_multi_index((codici, anni, mesi), tabella.shape, mode='clip'), len(celle) - 1)
+    return celle[indici]
+
+
+def tabella_incremento(risultato_esteso):
+    """
+    Dispone le label di incremento in un array denso indicizzato per (codice della tipologia, anno - anno iniziale,
+    mese - 1). Le combinazioni senza incremento valgono NaN. Se risultato_esteso è vuoto (es. dataset di un solo anno,
+    senza coppie di anni successivi) la tabella ha un'unica tipologia fittizia con tutte le celle NaN e nessuna
+    tipologia nell'Index: ogni campione riceve il codice -1 e quindi NaN.
+    :param risultato_esteso: dataFrame con incremento associato ad ogni mese (estendi_incremento)
+    :return tabella: array delle label
+    :return tipologie: Index delle tipologie, la cui posizione è il codice usato nella tabella
+    :return anno_iniziale: anno corrispondente al primo indice della tabella
+    """
+    if risultato_esteso.empty:
+        return np.full((1, 1, 12), np.nan, dtype=object), pd.Index([], dtype=object), 0
+
+    codici, tipologie = pd.factorize(risultato_esteso['tipologia_professionista_sanitario'])
+    anni = risultato_esteso['year'].to_numpy(np.int64)
+    anno_iniziale = anni.min()
+
+    tabella = np.full((len(tipologie), anni.max() - anno_iniziale + 1, 12), np.nan, dtype=object)
+    tabella[codici, anni - anno_iniziale, risultato_esteso['month'].to_numpy(np.int64) - 1] = \
+        risultato_esteso['incremento'].to_numpy()
+
+    return tabella, pd.Index(tipologie), anno_iniziale
+
+
+def codici_tipologie(colonna, tipologie) -> np.ndarray:
+    """
+    Converte la colonna delle tipologie nei codici di tabella_incremento (-1 per le tipologie assenti e i valori
+    mancanti). Per una colonna categorica vengono convertite solo le categorie e i codici vengono riutilizzati; negli
+    altri casi ogni valore distinto viene convertito una sola volta.
+    :param colonna: Series delle tipologie di professionista sanitario
+    :param tipologie: Index delle tipologie della tabella
+    :return: array dei codici
+    """
+    if isinstance(colonna.dtype, pd.CategoricalDtype):
+        codici, valori = colonna.cat.codes.to_numpy(), colonna.cat.categories
+    else:
+        codici, valori = pd.factorize(colonna)
+    return np.append(tipologie.get_indexer(valori), -1)[codici]
+
+
+@misura()
+def aggiorna_incremento(df_nuovo, df_aggregato, granularita='semestre'):
+    """
+    Modalità incrementale di incremento: etichetta i campioni di un nuovo mese senza rielaborare lo storico.
+    Vengono ricalcolati dai conteggi solo i periodi (es. semestri) in cui cadono i nuovi campioni, oppure tutti se i
+    nuovi campioni sono i primi di un anno (un nuovo anno aggiunge una coppia di anni a tutti i periodi). Le altre
+    righe di 'datasets/df_incremento_percentuale_esteso.parquet', salvato da un'esecuzione precedente con la stessa
+    granularità, restano invariate: il file aggiornato è uguale a quello che produrrebbe incremento sull'intero
+    dataset. I campioni dello storico le cui label sono cambiate possono essere aggiornati con rietichetta.
+    :param df_nuovo: DataFrame dei nuovi campioni (feature_extraction)
+    :param df_aggregato: conteggi dei professionisti per mese, storico e nuovi campioni (append_monthly_aggregates)
+    :param granularita: chiave di GRANULARITA
+    :return df_finale: nuovi campioni con la variabile 'incremento'
+    :return celle_modificate: dataFrame delle combinazioni di tipologia, anno e mese la cui label è cambiata o nuova
+    """
+    durata = GRANULARITA[granularita]
+    chiavi = ['tipologia_professionista_sanitario', 'year', 'month']
+    esteso_precedente = pd.read_parquet(FILE_INCREMENTO)
+
+    # Periodi da ricalcolare: quelli dei nuovi campioni, o tutti se un anno riceve i suoi primi campioni
+    df_aggregato_nuovo = conta_professionisti(df_nuovo)
+    totali = df_aggregato.groupby('anno')['conteggio'].sum()
+    totali_nuovi = df_aggregato_nuovo.groupby('anno')['conteggio'].sum()
+    if (totali.reindex(totali_nuovi.index) == totali_nuovi).any():
+        periodi = np.arange(12 // durata)
+    else:
+        periodi = np.unique((df_aggregato_nuovo['mese'].to_numpy() - 1) // durata)
+
+    DaF = df_aggregato[((df_aggregato['mese'] - 1) // durata).isin(periodi)].copy()
+    risultato = somma_per_intervallo_mesi(DaF, DaF['tipologia_professionista_sanitario'].unique(), granularita)
+    risultato_periodi = estendi_incremento(calcola_incremento(risultato, anni=df_aggregato['anno'].unique()),
+                                           granularita)
+
+    invariati = esteso_precedente[~((esteso_precedente['month'] - 1) // durata).isin(periodi)]
+    risultato_esteso = pd.concat([invariati, risultato_periodi], ignore_index=True)
+    risultato_esteso = risultato_esteso.sort_values(by=chiavi).reset_index(drop=True)
+    risultato_esteso.to_parquet(FILE_INCREMENTO, index=False)
+
+    # Combinazioni la cui label è cambiata (o che non esistevano)
+    confronto = risultato_esteso[chiavi + ['incremento']].merge(esteso_precedente[chiavi + ['incremento']], on=chiavi,
+                                                                how='left', suffixes=('', '_precedente'))
+    celle_modificate = confronto.loc[confronto['incremento'] != confronto['incremento_precedente'],
+                                     chiavi + ['incremento']].reset_index(drop=True)
+    logging.info(f"Incremento ricalcolato per {len(periodi)} periodi: {len(celle_modificate)} label modificate")
+
+    df_finale = unisci_incremento(df_nuovo, risultato_esteso)
+
+    return df_finale, celle_modificate
+
+
+def rietichetta(df, celle_modificate) -> int:
+    """
+    Aggiorna sul posto la colonna 'incremento' dei campioni dello storico che cadono nelle combinazioni di tipologia,
+    anno e mese la cui label è cambiata (aggiorna_incremento). Vengono letti solo i campioni dei mesi interessati.
+    :param df: DataFrame già etichettato (con la colonna 'incremento')
+    :param celle_modificate: dataFrame restituito da aggiorna_incremento
+    :return: numero di campioni aggiornati
+    """
+    if celle_modificate.empty:
+        return 0
+
+    # Campioni dei mesi con label modificate
+    mesi = celle_modificate['year'].to_numpy(np.int64) * 100 + celle_modificate['month'].to_numpy(np.int64)
+    candidati = np.flatnonzero(np.isin(df['year'].to_numpy(np.int64) * 100 + df['month'].to_numpy(np.int64),
+                                       np.unique(mesi)))
+
+    etichette = etichette_incremento(df['tipologia_professionista_sanitario'].iloc[candidati],
+                                     df['year'].to_numpy()[candidati], df['month'].to_numpy()[candidati],
+                                     celle_modificate)
+    modificati = pd.notna(etichette)
+    df.iloc[candidati[modificati], df.columns.get_loc('incremento')] = etichette[modificati]
+
+    return int(modificati.sum())
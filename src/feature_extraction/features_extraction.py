@@ -1,16 +1,65 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+import functools
+import glob
+import hashlib
+import json
+import operator
+import shutil
+import time
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import os
 import logging
+from data_prep.schema import NAT_INT64, epoch_ns
+from instrumentation.instrumentation import misura
 
 # Configuro il logger
 logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
                     format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
 
-def feature_extraction(df):
+# Cartella del dataset partizionato per anno e mese e relativo partizionamento hive ('year=2021/month=3')
+CARTELLA_MESI = 'month_dataset'
+PARTIZIONAMENTO_MESI = ds.partitioning(pa.schema([('year', pa.int32()), ('month', pa.int32())]), flavor='hive')
+
+# Manifest del dataset partizionato: schema, righe, hash e conteggi dei professionisti di ogni mese
+FILE_MANIFEST = '_manifest.json'
+
+# Conteggi dei professionisti per ogni mese salvati da save_monthly_aggregates
+FILE_AGGREGATO = 'datasets/df_aggregato.parquet'
+
+# Chiave dei metadati di FILE_AGGREGATO con le impronte dei campioni aggiunti da append_monthly_aggregates
+METADATA_AGGIUNTE = b'aggiunte'
+
+@misura()
+def feature_extraction(df, salva_mesi=False):
     """
-    Aggiunge nuove features al DataFrame, elimina quelle ridondanti e crea dei grafici
-    della richiesta di ogni professionista sanitario per ogni mese.
+    Aggiunge nuove features al DataFrame ed elimina quelle ridondanti. Se richiesto, salva il dataset diviso per anno
+    e mese e il conteggio della richiesta di ogni professionista sanitario per ogni mese.
+    :param df: dataFrame
+    :param salva_mesi: se True salva su disco il dataset mensile e 'datasets/df_aggregato.parquet'
+    :return df: dataFrame
+    """
+    # Estrae le feature che dipendono solo dal singolo campione
+    df = extract_row_features(df)
+
+    # Divide il dataset per anno e mese e conta la richiesta di ogni professionista per ogni mese
+    if salva_mesi:
+        save_monthly_aggregates(df)
+
+    return df
+
+
+@misura()
+def extract_row_features(df):
+    """
+    Estrae le feature che dipendono solo dal singolo campione (età del paziente, durata della televisita, anno e
+    mese) e rimuove le colonne da cui sono state estratte. Può essere applicata indipendentemente a ciascun batch.
     :param df: dataFrame
     :return df: dataFrame
     """
@@ -22,39 +71,157 @@ def feature_extraction(df):
     df = extract_durata_televisita(df)
     df = remove_ora_erogazione(df)
 
-    # Divide il dataset per anno e mese, e crea grafici della richiesta di professionisti per ogni mese
+    # Estrae anno e mese dalla data di erogazione
     df = extract_year_and_month(df)
-    save_grouped_by_year_and_month(df)
-
-    # Aggiunge al dataset il conteggio della richiesta di ogni professionista per ogni mese
-    df_aggregato = conta_professionisti_per_mese('month_dataset')
-    df_aggregato.to_parquet('datasets/df_aggregato.parquet', index=False)
 
     return df
 
+
+@misura()
+def save_monthly_aggregates(df, thread=None) -> pd.DataFrame:
+    """
+    Salva il dataset diviso per anno e mese e il conteggio della richiesta di ogni professionista per ogni mese
+    in 'datasets/df_aggregato.parquet'. I conteggi vengono calcolati dal DataFrame in memoria e salvati anche nel
+    manifest del dataset mensile: il dataset scritto non viene riletto.
+    :param df: dataFrame con le colonne 'year' e 'month'
+    :param thread: 1 per scrivere il dataset partizionato con un solo thread (opzionale, di default tutti i core)
+    :return df_aggregato: conteggi dei professionisti per ogni mese (conta_professionisti)
+    """
+    df_aggregato = conta_professionisti(df)
+
+    # Divide il dataset per anno e mese
+    save_grouped_by_year_and_month(df, thread=thread, df_aggregato=df_aggregato)
+
+    df_aggregato.to_parquet(FILE_AGGREGATO, index=False)
+    return df_aggregato
+
+
+@misura()
+def append_monthly_aggregates(df_nuovo, directory=CARTELLA_MESI, thread=None, mesi_esistenti=False) -> pd.DataFrame:
+    """
+    Modalità incrementale di save_monthly_aggregates: aggiunge i campioni di un nuovo mese senza rielaborare lo
+    storico. I conteggi dei nuovi campioni vengono sommati a quelli salvati in 'datasets/df_aggregato.parquet' e, se
+    il dataset mensile esiste, i campioni vengono aggiunti alle sue partizioni (aggiungi_al_dataset_mensile).
+    Per non contare due volte gli stessi campioni, prima di qualsiasi scrittura vengono rifiutati i campioni di mesi
+    già presenti nei conteggi (salvo mesi_esistenti) e i campioni già aggiunti, riconosciuti dalla loro impronta
+    (righe e hash di ogni mese) salvata nei metadati di 'datasets/df_aggregato.parquet'.
+    :param df_nuovo: dataFrame dei nuovi campioni, con le colonne 'year' e 'month'
+    :param directory: cartella del dataset partizionato
+    :param thread: 1 per scrivere il dataset partizionato con un solo thread (opzionale, di default tutti i core)
+    :param mesi_esistenti: se True consente di aggiungere campioni a mesi già presenti (es. prenotazioni registrate
+                           in ritardo)
+    :return df_aggregato: conteggi aggiornati dei professionisti per ogni mese
+    """
+    df_aggregato = pd.read_parquet(FILE_AGGREGATO)
+    aggiunte = leggi_aggiunte(FILE_AGGREGATO)
+    nuove = hash_partizioni(df_nuovo)
+    impronta = impronta_aggiunta(nuove)
+
+    if impronta in aggiunte:
+        raise ValueError(f"I campioni dei mesi {', '.join(nuove)} sono già stati aggiunti a {FILE_AGGREGATO}")
+    salvati = set(zip(df_aggregato['anno'].tolist(), df_aggregato['mese'].tolist()))
+    presenti = [mese for mese, voce in nuove.items() if (voce['year'], voce['month']) in salvati]
+    if presenti and not mesi_esistenti:
+        raise ValueError(f"I mesi {', '.join(presenti)} sono già presenti in {FILE_AGGREGATO}: per aggiungere "
+                         f"campioni registrati in ritardo usare mesi_esistenti=True (run.py --campioni-tardivi)")
+
+    df_aggregato_nuovo = conta_professionisti(df_nuovo)
+
+    if leggi_manifest(directory):
+        aggiungi_al_dataset_mensile(df_nuovo, directory, thread=thread, df_aggregato=df_aggregato_nuovo)
+
+    df_aggregato = somma_conteggi(df_aggregato, df_aggregato_nuovo)
+    salva_aggregato(df_aggregato, FILE_AGGREGATO, aggiunte + [impronta])
+    return df_aggregato
+
+
+def impronta_aggiunta(partizioni) -> str:
+    """
+    Calcola l'impronta di un insieme di campioni dalle righe e dagli hash dei suoi mesi (hash_partizioni): non
+    dipende dall'ordine delle righe né dal file da cui i campioni sono stati letti.
+    :param partizioni: dizionario restituito da hash_partizioni
+    :return: impronta esadecimale
+    """
+    contenuto = {mese: [voce['righe'], voce['hash']] for mese, voce in partizioni.items()}
+    return hashlib.sha256(json.dumps(contenuto, sort_keys=True).encode()).hexdigest()
+
+
+def leggi_aggiunte(file_path) -> list:
+    """
+    Legge dai metadati dei conteggi salvati le impronte dei campioni aggiunti da append_monthly_aggregates.
+    :param file_path: percorso del file Parquet dei conteggi
+    :return: lista delle impronte (vuota dopo save_monthly_aggregates)
+    """
+    metadata = pq.read_schema(file_path).metadata or {}
+    return json.loads(metadata.get(METADATA_AGGIUNTE, b'[]'))
+
+
+def salva_aggregato(df_aggregato, file_path, aggiunte):
+    """
+    Salva i conteggi dei professionisti per mese con le impronte dei campioni aggiunti nei metadati.
+    :param df_aggregato: conteggi dei professionisti per ogni mese
+    :param file_path: percorso del file Parquet
+    :param aggiunte: lista delle impronte (impronta_aggiunta)
+    :return: None
+    """
+    table = pa.Table.from_pandas(df_aggregato, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, METADATA_AGGIUNTE: json.dumps(aggiunte)})
+    pq.write_table(table, file_path)
+
+
+def somma_conteggi(df_aggregato, df_aggregato_nuovo) -> pd.DataFrame:
+    """
+    Somma due tabelle di conteggi dei professionisti per mese (es. lo storico e un nuovo mese).
+    :param df_aggregato: conteggi salvati
+    :param df_aggregato_nuovo: conteggi da aggiungere
+    :return: conteggi sommati, con l'ordine di ordina_aggregato
+    """
+    chiavi = ['tipologia_professionista_sanitario', 'anno', 'mese']
+    somma = pd.concat([df_aggregato, df_aggregato_nuovo]).groupby(chiavi, as_index=False)['conteggio'].sum()
+    return ordina_aggregato(somma)
+
+
+@misura()
+def conta_professionisti(df) -> pd.DataFrame:
+    """
+    Conta per ogni mese il numero di volte in cui compare ogni professionista sanitario, con un unico conteggio
+    raggruppato sul DataFrame in memoria. Il risultato è identico a quello di conta_professionisti_per_mese sul
+    dataset mensile salvato.
+    :param df: dataFrame con le colonne 'tipologia_professionista_sanitario', 'year' e 'month'
+    :return df_aggregato: dataFrame con le colonne 'tipologia_professionista_sanitario', 'conteggio', 'anno' e 'mese'
+    """
+    conteggi = df.groupby(['year', 'month', 'tipologia_professionista_sanitario'], observed=True).size()
+    df_aggregato = conteggi.rename('conteggio').reset_index().rename(columns={'year': 'anno', 'month': 'mese'})
+    return ordina_aggregato(df_aggregato)
+
+
+def ordina_aggregato(df_aggregato) -> pd.DataFrame:
+    """
+    Uniforma tipi e ordine delle righe dei conteggi dei professionisti per mese: anno e mese crescenti, conteggio
+    decrescente e tipologia. L'ordine non dipende da come i conteggi sono stati calcolati.
+    :param df_aggregato: dataFrame con le colonne 'tipologia_professionista_sanitario', 'conteggio', 'anno' e 'mese'
+    :return: dataFrame ordinato
+    """
+    df_aggregato = df_aggregato[['tipologia_professionista_sanitario', 'conteggio', 'anno', 'mese']].astype(
+        {'tipologia_professionista_sanitario': object, 'conteggio': 'int64', 'anno': 'int64', 'mese': 'int64'})
+    return df_aggregato.sort_values(['anno', 'mese', 'conteggio', 'tipologia_professionista_sanitario'],
+                                    ascending=[True, True, False, True], ignore_index=True)
+
+
 def extract_durata_televisita(df):
     """
-    Calcola la durata della televisita.
+    Calcola la durata della televisita in minuti (troncati) fra 'ora_inizio_erogazione' e 'ora_fine_erogazione',
+    in formato datetime. La differenza viene calcolata sulla vista int64 delle due colonne.
     :param df: dataFrame
     :return: dataFrame che associa ad ogni campione la durata della televisita
      """
-    # Assicurarsi che 'ora_inizio_erogazione' e 'ora_fine_erogazione' siano in formato datetime
-    df['ora_inizio_erogazione'] = pd.to_datetime(df['ora_inizio_erogazione'], errors='coerce')
-    df['ora_fine_erogazione'] = pd.to_datetime(df['ora_fine_erogazione'], errors='coerce')
-
-    def calcola_durata(row):
-        """
-        Calcola la durata della televisita in secondi tra 'ora_inizio_erogazione' e 'ora_fine_erogazione'.
-        :param row: una riga del DataFrame
-        :return: durata in secondi
-        """
-        if pd.notnull(row['ora_inizio_erogazione']) and pd.notnull(row['ora_fine_erogazione']):
-            durata = row['ora_fine_erogazione'] - row['ora_inizio_erogazione']
-            return int(durata.total_seconds() / 60)
-        else:
-            return None
+    ora_inizio = epoch_ns(df['ora_inizio_erogazione'])
+    ora_fine = epoch_ns(df['ora_fine_erogazione'])
+    noti = (ora_inizio != NAT_INT64) & (ora_fine != NAT_INT64)
 
-    df['durata_televisita'] = df.apply(calcola_durata, axis=1)
+    # Secondi troncati al microsecondo, come Timedelta.total_seconds(), poi minuti troncati
+    secondi = ((ora_fine - ora_inizio) // 1000) / 1e6
+    df['durata_televisita'] = intero_o_nan(np.trunc(secondi / 60), noti, df.index)
 
     return df
 
@@ -71,34 +238,36 @@ def remove_ora_erogazione(df: pd.DataFrame) -> pd.DataFrame:
 
 def extract_eta_paziente(df):
     """
-    Estrae l'età del paziente.
+    Estrae l'età del paziente da 'data_nascita', in formato datetime.
     :param df: dataFrame
     :return df: dataFrame con la colonna 'età'
     """
-    # Assicurarsi che 'data_nascita' sia in formato datetime
-    df['data_nascita'] = pd.to_datetime(df['data_nascita'], errors='coerce')
-
     # Calcolare l'età in anni
     current_date = datetime.now()
 
-    def calcola_eta(row):
-        """
-        Calcola l'età.
-        :param row: una riga del DataFrame.
-        :return age: età del paziente.
-        """
-        birth_date = row['data_nascita']
-        if pd.isnull(birth_date):
-            return None
-        age = current_date.year - birth_date.year - (
-                (current_date.month, current_date.day) < (birth_date.month, birth_date.day))
-        return age
-
-    df['eta_paziente'] = df.apply(calcola_eta, axis=1)
+    data_nascita = df['data_nascita']
+    compleanno_futuro = ((data_nascita.dt.month > current_date.month) |
+                         ((data_nascita.dt.month == current_date.month) & (data_nascita.dt.day > current_date.day)))
+    eta = current_date.year - data_nascita.dt.year - compleanno_futuro
+    df['eta_paziente'] = intero_o_nan(eta.to_numpy(dtype=float), data_nascita.notna().to_numpy(), df.index)
 
     return df
 
 
+def intero_o_nan(valori, noti, index) -> pd.Series:
+    """
+    Costruisce una feature intera: se tutti i valori sono noti la Serie è int64, altrimenti float64 con NaN per i
+    valori mancanti.
+    :param valori: array dei valori (float)
+    :param noti: maschera dei valori noti
+    :param index: indice della Serie
+    :return: Serie
+    """
+    if noti.all():
+        return pd.Series(valori.astype(np.int64), index=index)
+    return pd.Series(np.where(noti, valori, np.nan), index=index)
+
+
 def remove_data_nascita(df: pd.DataFrame) -> pd.DataFrame:
     """
     Rimuove la feature 'data_nascita' dal dataframe.
@@ -115,9 +284,6 @@ def extract_year_and_month(df):
     :param df: dataFrame originale contenente la colonna 'data_erogazione'
     :return df: dataFrame originale con le nuove colonne 'year' e 'month'
     """
-    # Assicurati che la colonna 'data_erogazione' sia nel formato datetime
-    df['data_erogazione'] = pd.to_datetime(df['data_erogazione'], errors='coerce')
-
     # Crea nuove colonne 'year' e 'month' estraendo l'anno e il mese dalla colonna 'data_erogazione'
     df['year'] = df['data_erogazione'].dt.year
     df['month'] = df['data_erogazione'].dt.month
@@ -125,76 +291,286 @@ def extract_year_and_month(df):
     return df
 
 
-def save_grouped_by_year_and_month(df, directory='month_dataset'):
+def save_grouped_by_year_and_month(df, directory=CARTELLA_MESI, thread=None, df_aggregato=None) -> list:
     """
-    Raggruppa il DataFrame per anno e mese e salva ogni gruppo in un file Parquet separato
-    nella directory 'month_dataset'.
-    :param df: dataFrame originale contenente la colonna 'data_erogazione'
-    :return df: dataFrame con le nuove colonne 'year' e 'month'
+    Salva il DataFrame come dataset Parquet partizionato per anno e mese in formato hive
+    ('year=2021/month=3/part-0.parquet') con un'unica scrittura pyarrow. Vengono riscritti solo i mesi il cui
+    contenuto è cambiato rispetto al manifest della cartella (righe e hash di ogni partizione, FILE_MANIFEST); le
+    partizioni dei mesi non più presenti vengono eliminate. Non viene riletto nulla: il dataset può essere aperto con
+    apri_dataset_mensile.
+    :param df: dataFrame con le colonne 'year' e 'month'
+    :param directory: cartella del dataset partizionato
+    :param thread: 1 per scrivere con un solo thread, altrimenti la scrittura usa il pool di thread di Arrow
+                   (tutti i core; il pool globale di Arrow non viene modificato)
+    :param df_aggregato: conteggi dei professionisti per mese di df (conta_professionisti), salvati nel manifest
+                         (opzionale: altrimenti vengono calcolati da conta_professionisti_per_mese)
+    :return: lista dei mesi (anno, mese) riscritti
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Le colonne di partizionamento devono avere il tipo dello schema delle partizioni
+    for campo in PARTIZIONAMENTO_MESI.schema:
+        indice = table.schema.get_field_index(campo.name)
+        table = table.set_column(indice, campo.name, table.column(indice).cast(campo.type))
+
+    schema = table.schema.remove_metadata().to_string()
+    partizioni = hash_partizioni(df)
+
+    # Senza manifest (o con uno schema diverso) le partizioni presenti non sono affidabili: vengono riscritte tutte
+    manifest = leggi_manifest(directory)
+    precedenti = manifest['partizioni'] if manifest.get('schema') == schema else {}
+    if not precedenti and os.path.isdir(directory):
+        for partizione in glob.glob(os.path.join(glob.escape(directory), 'year=*')):
+            shutil.rmtree(partizione)
+
+    modificati = [mese for mese, voce in partizioni.items()
+                  if precedenti.get(mese, {}).get('hash') != voce['hash']]
+    for mese in set(precedenti) - set(partizioni):
+        shutil.rmtree(percorso_partizione(directory, *chiave_da_mese(mese)), ignore_errors=True)
+
+    # Le partizioni non modificate mantengono i conteggi già calcolati da conta_professionisti_per_mese
+    for mese, voce in partizioni.items():
+        if mese not in modificati and 'conteggi' in precedenti[mese]:
+            voce['conteggi'] = precedenti[mese]['conteggi']
+    if df_aggregato is not None:
+        for mese, voce in partizioni.items():
+            voce['conteggi'] = {}
+        for tipologia, conteggio, anno, mese in df_aggregato.itertuples(index=False):
+            partizioni[f'{anno}/{mese}']['conteggi'][tipologia] = int(conteggio)
+
+    if modificati:
+        anni, mesi = zip(*(chiave_da_mese(mese) for mese in modificati))
+        maschera = pc.is_in(pc.add(pc.multiply(table['year'], 100), table['month']),
+                            value_set=pa.array(np.array(anni) * 100 + np.array(mesi), pa.int32()))
+        ds.write_dataset(table.filter(maschera), directory, format='parquet', partitioning=PARTIZIONAMENTO_MESI,
+                         basename_template='part-{i}.parquet', existing_data_behavior='delete_matching',
+                         use_threads=thread != 1)
+
+    salva_manifest(directory, {'schema': schema, 'partizioni': partizioni})
+    logging.info(f"Dataset mensile: {len(modificati)} mesi riscritti su {len(partizioni)}")
+    return [chiave_da_mese(mese) for mese in modificati]
+
+
+def aggiungi_al_dataset_mensile(df_nuovo, directory=CARTELLA_MESI, thread=None, df_aggregato=None) -> list:
+    """
+    Aggiunge i campioni di df_nuovo al dataset partizionato, scrivendo un nuovo file nelle partizioni dei loro mesi
+    senza riscrivere quelli presenti. Righe, hash e conteggi del manifest vengono aggiornati sommando quelli dei
+    nuovi campioni (l'hash di un mese è la somma degli hash delle sue righe): il manifest resta uguale a quello che
+    produrrebbe save_grouped_by_year_and_month sull'intero dataset.
+    :param df_nuovo: dataFrame dei nuovi campioni, con le colonne 'year' e 'month'
+    :param directory: cartella del dataset partizionato (con manifest)
+    :param thread: 1 per scrivere con un solo thread, altrimenti la scrittura usa il pool di thread di Arrow
+                   (tutti i core; il pool globale di Arrow non viene modificato)
+    :param df_aggregato: conteggi dei professionisti per mese di df_nuovo (opzionale, altrimenti calcolati)
+    :return: lista dei mesi (anno, mese) a cui sono stati aggiunti campioni
+    """
+    table = pa.Table.from_pandas(df_nuovo, preserve_index=False)
+    for campo in PARTIZIONAMENTO_MESI.schema:
+        indice = table.schema.get_field_index(campo.name)
+        table = table.set_column(indice, campo.name, table.column(indice).cast(campo.type))
+
+    manifest = leggi_manifest(directory)
+    if manifest.get('schema') != table.schema.remove_metadata().to_string():
+        raise ValueError(f"I nuovi campioni hanno uno schema diverso da quello del dataset mensile {directory}")
+
+    if df_aggregato is None:
+        df_aggregato = conta_professionisti(df_nuovo)
+    conteggi = {}
+    for tipologia, conteggio, anno, mese in df_aggregato.itertuples(index=False):
+        conteggi.setdefault(f'{anno}/{mese}', {})[tipologia] = int(conteggio)
+
+    partizioni = manifest['partizioni']
+    nuove = hash_partizioni(df_nuovo)
+    for mese, voce in nuove.items():
+        precedente = partizioni.get(mese)
+        if precedente is None:
+            voce['conteggi'] = conteggi.get(mese, {})
+            partizioni[mese] = voce
+            continue
+        precedente['righe'] += voce['righe']
+        precedente['hash'] = f"{(int(precedente['hash'], 16) + int(voce['hash'], 16)) % 2 ** 64:016x}"
+        if 'conteggi' in precedente:
+            for tipologia, conteggio in conteggi.get(mese, {}).items():
+                precedente['conteggi'][tipologia] = precedente['conteggi'].get(tipologia, 0) + conteggio
+    manifest['partizioni'] = dict(sorted(partizioni.items(), key=lambda voce: chiave_da_mese(voce[0])))
+
+    # Nome dei file univoco: i file già presenti nelle partizioni non vengono sovrascritti
+    ds.write_dataset(table, directory, format='parquet', partitioning=PARTIZIONAMENTO_MESI,
+                     basename_template=f'part-{time.time_ns()}-{{i}}.parquet',
+                     existing_data_behavior='overwrite_or_ignore', use_threads=thread != 1)
+
+    salva_manifest(directory, manifest)
+    logging.info(f"Dataset mensile: campioni aggiunti a {len(nuove)} mesi")
+    return [chiave_da_mese(mese) for mese in nuove]
+
+
+def hash_partizioni(df) -> dict:
+    """
+    Calcola numero di righe e hash del contenuto di ogni mese. L'hash di un mese è la somma (modulo 2^64) degli hash
+    delle sue righe, quindi non dipende dall'ordine delle righe.
+    :param df: dataFrame con le colonne 'year' e 'month'
+    :return: dizionario {'anno/mese': {'year', 'month', 'righe', 'hash'}}, ordinato per anno e mese
     """
-    # Crea la directory se non esiste
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-        logging.info(f"Directory '{directory}' creata.")
+    hash_righe = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    codici = df['year'].to_numpy(np.int64) * 100 + df['month'].to_numpy(np.int64)
 
-    # Raggruppa il DataFrame per anno e mese e salva ogni gruppo in un file Parquet separato
-    for (year, month), group in df.groupby(['year', 'month']):
-        output_path = f'month_dataset/Anno_{year}_Mese_{month}.parquet'
+    ordine = np.argsort(codici, kind='stable')
+    codici = codici[ordine]
+    inizi = np.flatnonzero(np.r_[True, codici[1:] != codici[:-1]]) if len(codici) else np.empty(0, np.int64)
+    somme = np.add.reduceat(hash_righe[ordine], inizi) if len(codici) else np.empty(0, np.uint64)
+    righe = np.diff(np.r_[inizi, len(codici)])
 
-        # Se il file esiste, salta la creazione
-        if not os.path.isfile(output_path):
-            group.to_parquet(output_path, index=False)
+    return {f'{codice // 100}/{codice % 100}': {'year': int(codice // 100), 'month': int(codice % 100),
+                                                'righe': int(n), 'hash': f'{somma:016x}'}
+            for codice, n, somma in zip(codici[inizi], righe, somme)}
 
-    for file_name in os.listdir(directory):
-        if file_name.endswith('.parquet'):
-            file_path = os.path.join(directory, file_name)
-            df = pd.read_parquet(file_path)
-    return df
 
+def chiave_da_mese(mese) -> tuple:
+    """
+    Converte la chiave 'anno/mese' del manifest in (anno, mese).
+    :param mese: chiave del manifest
+    :return: (anno, mese)
+    """
+    anno, mese = mese.split('/')
+    return int(anno), int(mese)
 
-def conta_professionisti_per_mese(cartella):
+
+def percorso_partizione(directory, anno, mese) -> str:
     """
-    Conta per ogni mese il numero di volte in cui compare ogni professionista sanitario.
-    :param cartella (str): percorso della cartella contenente i file Parquet divisi per mese e anno.
-    :return df_aggregato: dataFrame contenente il numero di occorrenze per ogni tipologia di professionista
-                          sanitario per ogni mese.
+    Percorso della partizione hive di un mese.
+    :param directory: cartella del dataset partizionato
+    :param anno: anno
+    :param mese: mese
+    :return: percorso della cartella della partizione
+    """
+    return os.path.join(directory, f'year={anno}', f'month={mese}')
+
+
+def leggi_manifest(directory) -> dict:
+    """
+    Legge il manifest del dataset partizionato.
+    :param directory: cartella del dataset partizionato
+    :return: manifest (vuoto se non esiste o non è leggibile)
+    """
+    file_path = os.path.join(directory, FILE_MANIFEST)
+    if not os.path.isfile(file_path):
+        return {}
+    try:
+        with open(file_path) as file:
+            return json.load(file)
+    except ValueError:
+        logging.warning(f"Manifest {file_path} non valido: il dataset mensile verrà riscritto")
+        return {}
+
+
+def salva_manifest(directory, manifest):
+    """
+    Salva il manifest del dataset partizionato (scritto con un nome temporaneo e poi rinominato).
+    :param directory: cartella del dataset partizionato
+    :param manifest: dizionario con lo schema e le partizioni
+    :return: None
+    """
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, FILE_MANIFEST)
+    with open(file_path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(file_path + '.tmp', file_path)
+
+
+def apri_dataset_mensile(directory=CARTELLA_MESI) -> ds.Dataset:
+    """
+    Apre il dataset partizionato per anno e mese scritto da save_grouped_by_year_and_month. I filtri su 'year' e
+    'month' (es. ds.field('year') == 2021) vengono applicati alle partizioni: i file degli altri mesi non vengono letti.
+    Il manifest non fa parte del dataset (i file che iniziano con '_' vengono ignorati).
+    :param directory: cartella del dataset partizionato
+    :return: dataset pyarrow
     """
-    dati_aggregati = []
+    return ds.dataset(directory, format='parquet', partitioning=PARTIZIONAMENTO_MESI)
 
-    def conta_occorrenze_professionisti(df, colonna='tipologia_professionista_sanitario'):
-        """
-        Conta il numero di occorrenze di ciascuna tipologia di professionista sanitario in un DataFrame.
-        :param df: dataFrame
-        :param colonna: colonna relativa alla tipologia di professionista sanitario
-        :return: conteggio delle occorrenze per ogni tipologia di professionista sanitario
-        """
-        return df[colonna].value_counts()
 
-    # Scorri tutti i file Parquet nella cartella
-    for file in os.listdir(cartella):
-        if file.endswith(".parquet"):
-            percorso_file = os.path.join(cartella, file)
+def conta_professionisti_per_mese(cartella, thread=None):
+    """
+    Conta per ogni mese il numero di volte in cui compare ogni professionista sanitario. I conteggi sono salvati nel
+    manifest del dataset: vengono letti solo i mesi riscritti da save_grouped_by_year_and_month (o tutti, se il
+    dataset non ha un manifest), con conta_professionisti_partizioni.
+    :param cartella (str): percorso del dataset partizionato per anno e mese.
+    :param thread: numero di thread usati per la lettura dei file (opzionale, di default tutti i core)
+    :return df_aggregato: dataFrame contenente il numero di occorrenze per ogni tipologia di professionista
+                          sanitario per ogni mese.
+    """
+    manifest = leggi_manifest(cartella)
+    partizioni = manifest.get('partizioni', {})
+    da_leggere = [mese for mese, voce in partizioni.items() if 'conteggi' not in voce]
+
+    if not manifest or da_leggere:
+        filtro = None
+        if manifest:
+            # Lettura dei soli mesi senza conteggi: le altre partizioni non vengono aperte
+            filtro = functools.reduce(operator.or_, [(ds.field('year') == anno) & (ds.field('month') == mese)
+                                                     for anno, mese in map(chiave_da_mese, da_leggere)])
+        letti = conta_professionisti_partizioni(apri_dataset_mensile(cartella).get_fragments(filter=filtro), thread)
+
+        if manifest:
+            for mese in da_leggere:
+                partizioni[mese]['conteggi'] = letti.get(mese, {})
+            salva_manifest(cartella, manifest)
+        else:
+            partizioni = {mese: {'conteggi': valori} for mese, valori in letti.items()}
 
-            # Leggi il file Parquet in un DataFrame
-            df = pd.read_parquet(percorso_file)
+    righe = [(tipologia, conteggio, *chiave_da_mese(mese))
+             for mese, voce in partizioni.items() for tipologia, conteggio in voce['conteggi'].items()]
+    df_aggregato = pd.DataFrame(righe, columns=['tipologia_professionista_sanitario', 'conteggio', 'anno', 'mese'])
 
-            # Estrai anno e mese dal nome del file
-            nome_file = os.path.splitext(file)[0]
-            parti_nome = nome_file.split('_')
-            anno = int(parti_nome[1])
-            mese = int(parti_nome[3])
+    # Ordine indipendente da quali conteggi sono stati letti e quali riutilizzati
+    return ordina_aggregato(df_aggregato)
 
-            # Conta il numero di occorrenze di ciascuna tipologia
-            conteggio_occorrenze = conta_occorrenze_professionisti(df).reset_index()
-            conteggio_occorrenze.columns = ['tipologia_professionista_sanitario', 'conteggio']
-            conteggio_occorrenze['anno'] = anno
-            conteggio_occorrenze['mese'] = mese
 
-            # Aggiungi al DataFrame aggregato
-            dati_aggregati.append(conteggio_occorrenze)
+def conta_professionisti_partizioni(frammenti, thread=None) -> dict:
+    """
+    Conta i professionisti sanitari dei file del dataset mensile distribuendo i file su un pool di thread: i
+    conteggi di ogni file vengono sommati a quelli del suo mese appena sono disponibili. La lettura dei file (I/O e
+    decompressione) rilascia il GIL, quindi il tempo totale è vicino a quello del file più grande.
+    :param frammenti: file del dataset partizionato (es. apri_dataset_mensile(cartella).get_fragments())
+    :param thread: numero di thread (opzionale, di default tutti i core)
+    :return: dizionario {'anno/mese': {tipologia: conteggio}}
+    """
+    letti = {}
+    with ThreadPoolExecutor(max_workers=thread or os.cpu_count()) as executor:
+        mesi = {executor.submit(conta_professionisti_file, frammento.path):
+                ds.get_partition_keys(frammento.partition_expression) for frammento in frammenti}
+        for futuro in as_completed(mesi):
+            mese = f"{mesi[futuro]['year']}/{mesi[futuro]['month']}"
+            letti.setdefault(mese, Counter()).update(futuro.result())
+    return {mese: dict(conteggi) for mese, conteggi in letti.items()}
 
-    # Concatena tutti i risultati in un unico DataFrame
-    df_aggregato = pd.concat(dati_aggregati, ignore_index=True)
-    pd.set_option('display.max_rows', None)
 
-    return df_aggregato
+def conta_professionisti_file(file_path) -> Counter:
+    """
+    Conta le occorrenze di ogni professionista sanitario in un file Parquet del dataset mensile. I row group in cui
+    la colonna 'tipologia_professionista_sanitario' ha un solo valore e nessun nullo (statistiche con minimo uguale
+    al massimo) vengono contati dai metadati, senza leggerli. Per gli altri viene letta solo la colonna, come
+    dizionario: si contano gli indici con np.bincount, senza convertire le stringhe.
+    :param file_path: percorso del file
+    :return: Counter {tipologia: conteggio}
+    """
+    colonna = 'tipologia_professionista_sanitario'
+    parquet = pq.ParquetFile(file_path, read_dictionary=[colonna])
+    indice = parquet.metadata.schema.names.index(colonna)
+
+    conteggi = Counter()
+    da_leggere = []
+    for i in range(parquet.metadata.num_row_groups):
+        row_group = parquet.metadata.row_group(i)
+        statistiche = row_group.column(indice).statistics
+        if (statistiche is not None and statistiche.has_min_max and statistiche.has_null_count
+                and statistiche.null_count == 0 and statistiche.min == statistiche.max):
+            conteggi[statistiche.min] += row_group.num_rows
+        else:
+            da_leggere.append(i)
+
+    if da_leggere:
+        for blocco in parquet.read_row_groups(da_leggere, columns=[colonna], use_threads=False).column(0).chunks:
+            frequenze = np.bincount(blocco.indices.drop_null().to_numpy(), minlength=len(blocco.dictionary))
+            for tipologia, frequenza in zip(blocco.dictionary.to_pylist(), frequenze.tolist()):
+                if frequenza:
+                    conteggi[tipologia] += frequenza
+    return conteggi
@@ -0,0 +1,377 @@
+from contextlib import contextmanager
+from datetime import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import logging
+
+try:
+    import resource
+except ImportError:  # Non disponibile su Windows: il picco di RSS non viene misurato
+    resource = None
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+# Colonne del report, nell'ordine in cui vengono salvate
+COLONNE_REPORT = ['fase', 'padre', 'livello', 'inizio', 'tempo_s', 'cpu_s', 'picco_rss_mb', 'delta_picco_rss_mb',
+                  'rss_iniziale_mb', 'picco_rss_fase_mb', 'picco_tracemalloc_mb', 'righe_in', 'righe_out',
+                  'memoria_in_mb', 'memoria_out_mb']
+
+# Intervallo di default fra due campionamenti della memoria residente, in secondi
+INTERVALLO_CAMPIONAMENTO = 0.005
+
+# Stato della strumentazione, condiviso da tutti i moduli della pipeline
+_stato = {
+    'attiva': True,  # Se False, misura e fase non registrano nulla
+    'tracemalloc': False,  # Se True, viene misurato anche il picco di memoria allocata da Python
+    'campionatore': None,  # Thread che campiona la memoria residente durante le fasi (CampionatoreRSS)
+    'fasi': [],  # Misure delle fasi concluse
+    'locale': threading.local(),  # Pila delle fasi in corso di ciascun thread (per la misura delle fasi annidate)
+    'in_corso': []  # Fasi in corso in tutti i thread, campionate da CampionatoreRSS
+}
+
+# Protegge le fasi in corso e concluse, aggiornate anche dai thread worker (es. un pool dell'elbow method)
+_lock = threading.Lock()
+
+
+def configura_strumentazione(attiva=True, usa_tracemalloc=False, campiona_rss=False,
+                             intervallo_campionamento=INTERVALLO_CAMPIONAMENTO):
+    """
+    Attiva o disattiva la strumentazione delle fasi della pipeline e azzera le misure raccolte.
+    Di default vengono misurati tempo, tempo di CPU, picco di RSS, righe e memoria dei DataFrame: operazioni di costo
+    trascurabile rispetto alle fasi. tracemalloc rallenta le allocazioni ed è quindi disattivato di default.
+    Il picco di RSS del processo non diminuisce mai, quindi non misura la memoria delle fasi successive alla più
+    onerosa: con campiona_rss un thread campiona la memoria residente corrente e registra il picco di ogni fase
+    (inclusa la memoria allocata fuori da Python, es. da pyarrow). Disponibile solo su Linux.
+    :param attiva: se False, le fasi non vengono misurate
+    :param usa_tracemalloc: se True, misura anche il picco di memoria allocata da Python in ogni fase
+    :param campiona_rss: se True, misura il picco di memoria residente di ogni fase campionandola
+    :param intervallo_campionamento: intervallo fra due campionamenti, in secondi
+    :return: None
+    """
+    _stato['attiva'] = attiva
+    _stato['tracemalloc'] = attiva and usa_tracemalloc
+    with _lock:
+        _stato['fasi'] = []
+        _stato['locale'] = threading.local()
+        _stato['in_corso'] = []
+
+    if _stato['campionatore'] is not None:
+        _stato['campionatore'].ferma()
+        _stato['campionatore'] = None
+    if attiva and campiona_rss and rss_corrente_mb() is not None:
+        _stato['campionatore'] = CampionatoreRSS(intervallo_campionamento)
+        _stato['campionatore'].start()
+
+    if _stato['tracemalloc'] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not _stato['tracemalloc'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def misura(nome=None):
+    """
+    Decoratore che registra una misura per ogni chiamata della funzione decorata. Le righe in ingresso e la memoria
+    vengono lette dal primo argomento, se è un DataFrame; le righe in uscita dal risultato (o dal primo DataFrame
+    restituito, se il risultato è una tupla).
+    :param nome: nome della fase (di default il nome della funzione)
+    :return: decoratore
+    """
+    def decoratore(funzione):
+        nome_fase = nome or funzione.__name__
+
+        @functools.wraps(funzione)
+        def wrapper(*args, **kwargs):
+            if not _stato['attiva']:
+                return funzione(*args, **kwargs)
+
+            with fase(nome_fase, args[0] if args else None) as misure:
+                risultato = funzione(*args, **kwargs)
+                misure.output(risultato)
+            return risultato
+
+        return wrapper
+
+    return decoratore
+
+
+class MisuraFase:
+    """
+    Misure di una singola fase, registrate da fase() all'uscita dal blocco.
+    """
+
+    def __init__(self, nome, padre, livello, df_in):
+        self.nome = nome
+        self.padre = padre
+        self.livello = livello
+        self.righe_in, self.memoria_in_mb = dimensioni(df_in)
+        self.righe_out, self.memoria_out_mb = None, None
+        self.picco_figli = 0  # Picco di tracemalloc delle fasi annidate già concluse
+        self.rss_iniziale, self.picco_rss_fase = None, None  # Memoria residente campionata (CampionatoreRSS)
+
+    def output(self, risultato):
+        """
+        Registra il risultato della fase, da cui vengono lette righe e memoria in uscita.
+        :param risultato: DataFrame o tupla contenente un DataFrame
+        :return: il risultato
+        """
+        if isinstance(risultato, tuple):
+            risultato = next((valore for valore in risultato if isinstance(valore, pd.DataFrame)), None)
+        self.righe_out, self.memoria_out_mb = dimensioni(risultato)
+        return risultato
+
+    def campiona_rss(self, rss):
+        """
+        Aggiorna il picco di memoria residente della fase con un nuovo campione.
+        :param rss: memoria residente corrente in MB
+        :return: None
+        """
+        if self.rss_iniziale is None:
+            self.rss_iniziale = rss
+        if self.picco_rss_fase is None or rss > self.picco_rss_fase:
+            self.picco_rss_fase = rss
+
+
+class CampionatoreRSS(threading.Thread):
+    """
+    Thread che campiona periodicamente la memoria residente del processo e aggiorna il picco delle fasi in corso.
+    I picchi più brevi dell'intervallo di campionamento (o raggiunti mentre un'operazione nativa trattiene il GIL)
+    possono non essere registrati: la misura è una stima per difetto.
+    """
+
+    def __init__(self, intervallo):
+        super().__init__(name='campionatore_rss', daemon=True)
+        self.intervallo = intervallo
+        self.fermo = threading.Event()
+
+    def run(self):
+        while not self.fermo.wait(self.intervallo):
+            with _lock:
+                fasi = list(_stato['in_corso'])
+            campiona_fasi(fasi)
+
+    def ferma(self):
+        """
+        Ferma il campionamento e attende la fine del thread.
+        :return: None
+        """
+        self.fermo.set()
+        self.join()
+
+
+@contextmanager
+def fase(nome, df=None):
+    """
+    Context manager che misura il blocco di codice come una fase della pipeline: tempo, tempo di CPU, picco di RSS
+    (e di tracemalloc, se attivo), righe e memoria del DataFrame in ingresso e in uscita (registrato con
+    misure.output(df)). Le fasi possono essere annidate: ogni thread ha la propria pila di fasi in corso, quindi una
+    fase eseguita in un thread worker non ha come padre la fase in corso nel thread principale.
+    :param nome: nome della fase
+    :param df: DataFrame in ingresso (opzionale)
+    :return: MisuraFase
+    """
+    if not _stato['attiva']:
+        yield MisuraFase(nome, None, 0, None)
+        return
+
+    pila = pila_corrente()
+    padre = pila[-1] if pila else None
+    misure = MisuraFase(nome, padre.nome if padre else None, len(pila), df)
+
+    if _stato['tracemalloc']:
+        # Il picco viene azzerato all'inizio della fase: salvo prima quello raggiunto finora dalla fase padre
+        if padre is not None:
+            padre.picco_figli = max(padre.picco_figli, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    if _stato['campionatore'] is not None:
+        campiona_fasi([misure])
+    pila.append(misure)
+    with _lock:
+        _stato['in_corso'].append(misure)
+    rss_iniziale = picco_rss_mb()
+    inizio = datetime.now()
+    tempo_iniziale = time.perf_counter()
+    cpu_iniziale = time.process_time()
+    try:
+        yield misure
+    finally:
+        tempo = time.perf_counter() - tempo_iniziale
+        cpu = time.process_time() - cpu_iniziale
+        rss = picco_rss_mb()
+        pila.pop()
+        with _lock:
+            _stato['in_corso'].remove(misure)
+        if _stato['campionatore'] is not None:
+            campiona_fasi([misure])
+
+        picco_tracemalloc = None
+        if _stato['tracemalloc']:
+            picco = max(tracemalloc.get_traced_memory()[1], misure.picco_figli)
+            picco_tracemalloc = picco / 2 ** 20
+            if padre is not None:
+                padre.picco_figli = max(padre.picco_figli, picco)
+
+        misura_fase = {
+            'fase': nome,
+            'padre': misure.padre,
+            'livello': misure.livello,
+            'inizio': inizio.isoformat(timespec='milliseconds'),
+            'tempo_s': tempo,
+            'cpu_s': cpu,
+            'picco_rss_mb': rss,
+            'delta_picco_rss_mb': None if rss is None else rss - rss_iniziale,
+            'rss_iniziale_mb': misure.rss_iniziale,
+            'picco_rss_fase_mb': misure.picco_rss_fase,
+            'picco_tracemalloc_mb': picco_tracemalloc,
+            'righe_in': misure.righe_in,
+            'righe_out': misure.righe_out,
+            'memoria_in_mb': misure.memoria_in_mb,
+            'memoria_out_mb': misure.memoria_out_mb
+        }
+        with _lock:
+            _stato['fasi'].append(misura_fase)
+
+
+def pila_corrente() -> list:
+    """
+    Restituisce la pila delle fasi in corso nel thread corrente, creandola alla prima fase del thread.
+    :return: lista di MisuraFase, dalla più esterna alla più interna
+    """
+    locale = _stato['locale']
+    if not hasattr(locale, 'pila'):
+        locale.pila = []
+    return locale.pila
+
+
+def dimensioni(df):
+    """
+    Numero di righe e memoria occupata (senza il contenuto delle stringhe, per non doverle scorrere) di un DataFrame
+    o di una matrice NumPy o CSR (es. costruisci_matrice, costruisci_matrice_sparsa).
+    :param df: DataFrame, array NumPy, matrice CSR o qualsiasi altro oggetto
+    :return: (righe, memoria in MB), o (None, None) se df non è un DataFrame né una matrice
+    """
+    if isinstance(df, np.ndarray) and df.ndim:
+        return len(df), df.nbytes / 2 ** 20
+    if sparse.isspmatrix_csr(df):
+        return df.shape[0], (df.data.nbytes + df.indices.nbytes + df.indptr.nbytes) / 2 ** 20
+    if not isinstance(df, pd.DataFrame):
+        return None, None
+    memoria = df.index.nbytes + sum(serie.array.nbytes for _, serie in df.items())
+    return len(df), memoria / 2 ** 20
+
+
+def picco_rss_mb():
+    """
+    Picco della memoria residente (RSS) del processo dall'avvio.
+    :return: picco di RSS in MB, o None se non disponibile
+    """
+    if resource is None:
+        return None
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in KB su Linux e in byte su macOS
+    return picco / 2 ** 20 if sys.platform == 'darwin' else picco / 2 ** 10
+
+
+def rss_corrente_mb():
+    """
+    Memoria residente (RSS) corrente del processo, letta da /proc/self/statm.
+    :return: RSS in MB, o None se non disponibile (sistemi diversi da Linux)
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            pagine = int(file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pagine * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def campiona_fasi(fasi):
+    """
+    Campiona la memoria residente corrente e aggiorna il picco delle fasi specificate.
+    :param fasi: lista di MisuraFase
+    :return: None
+    """
+    rss = rss_corrente_mb()
+    if rss is not None:
+        for misure in fasi:
+            misure.campiona_rss(rss)
+
+
+def report_fasi() -> pd.DataFrame:
+    """
+    Restituisce le misure delle fasi concluse, una riga per chiamata, nell'ordine in cui sono terminate.
+    :return: DataFrame con le colonne COLONNE_REPORT
+    """
+    with _lock:
+        fasi = list(_stato['fasi'])
+    return pd.DataFrame(fasi, columns=COLONNE_REPORT)
+
+
+def riepilogo_fasi() -> pd.DataFrame:
+    """
+    Riepilogo delle misure per fase: numero di chiamate, tempi totali, picco di RSS massimo e righe totali.
+    Utile per le fasi eseguite su ogni batch in modalità streaming.
+    :return: DataFrame indicizzato per fase, ordinato per tempo totale decrescente
+    """
+    report = report_fasi()
+    riepilogo = report.groupby('fase', sort=False).agg(
+        chiamate=('tempo_s', 'size'), tempo_s=('tempo_s', 'sum'), cpu_s=('cpu_s', 'sum'),
+        picco_rss_mb=('picco_rss_mb', 'max'), picco_rss_fase_mb=('picco_rss_fase_mb', 'max'),
+        picco_tracemalloc_mb=('picco_tracemalloc_mb', 'max'),
+        righe_in=('righe_in', somma_righe), righe_out=('righe_out', somma_righe))
+    return riepilogo.sort_values('tempo_s', ascending=False)
+
+
+def somma_righe(righe):
+    """
+    Somma le righe delle chiamate di una fase; NaN se la fase non riceve o non restituisce un DataFrame.
+    :param righe: Serie delle righe di ogni chiamata
+    :return: somma delle righe
+    """
+    return righe.sum(min_count=1)
+
+
+def salva_report(file_path):
+    """
+    Salva le misure delle fasi in formato JSON (misure e riepilogo) o CSV (solo misure), in base all'estensione.
+    :param file_path: percorso del report (.json o .csv)
+    :return: None
+    """
+    cartella = os.path.dirname(file_path)
+    if cartella:
+        os.makedirs(cartella, exist_ok=True)
+
+    report = report_fasi()
+    if file_path.endswith('.csv'):
+        report.to_csv(file_path, index=False)
+    else:
+        contenuto = {
+            'fasi': json.loads(report.to_json(orient='records')),
+            'riepilogo': json.loads(riepilogo_fasi().reset_index().to_json(orient='records'))
+        }
+        with open(file_path, 'w') as file:
+            json.dump(contenuto, file, indent=2)
+
+    logging.info(f"Report delle fasi salvato in {file_path}")
+
+
+def log_riepilogo():
+    """
+    Visualizza nel log il riepilogo delle misure per fase.
+    :return: None
+    """
+    if not _stato['fasi']:
+        return
+    logging.info("Riepilogo delle fasi della pipeline:")
+    logging.info(riepilogo_fasi().round(3).to_string())
+    logging.info('-----------------------------------')
@@ -1,35 +1,204 @@
-import pandas as pd
-from data_prep.data_cleaning import data_cleaning
-from data_prep.features_selection import feature_selection
-from feature_extraction.features_extraction import feature_extraction
-from feature_extraction.extract_increment import incremento
+import argparse
+import os
+from data_prep.data_loading import FILTRO_DISDETTE, colonne_utilizzate, load_dataset, media_durata_dataset
+from data_prep.data_cleaning import FILE_LIMITI_OUTLIERS, FILE_MEDIA_DURATA, carica_parametri_pulizia, data_cleaning
+from data_prep.features_selection import FILE_SELEZIONE_FEATURES, carica_selezione_features, feature_selection
+from data_prep.istat_reference import FILE_CODICI_ISTAT, calcola_sha256, carica_comuni_istat
+from data_prep.quantile_sketch import SketchKLL
+from data_prep.schema import applica_schema
+from feature_extraction.features_extraction import (FILE_AGGREGATO, append_monthly_aggregates, conta_professionisti,
+                                                    feature_extraction)
+from feature_extraction.extract_increment import GRANULARITA, aggiorna_incremento, incremento
 from clustering.clustering_execution import execute_clustering
+from src.clustering.shared_matrix import MODI_CONDIVISIONE
 from data_transformation.data_transformation import data_transformation
+from streaming.streaming_execution import streaming_execution
+from instrumentation.instrumentation import configura_strumentazione, log_riepilogo, salva_report
+from checkpoint.checkpoint import CARTELLA_CHECKPOINT, esegui_con_checkpoint, impronta_dataset, versione_codice
 import logging
 
 # Configuro il logger
 logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
                     format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
 
-# Caricamento del dataset
-file_path = '../src/datasets/challenge_campus_biomedico_2024.parquet'
-df = pd.read_parquet(file_path)
+# Argomenti da riga di comando
+parser = argparse.ArgumentParser(description="Pipeline di clustering delle teleassistenze")
+parser.add_argument('--streaming', action='store_true',
+                    help="Legge il dataset un batch alla volta invece di caricarlo interamente in memoria. Senza "
+                         "--errore-quantili i limiti IQR esatti richiedono le colonne temporali di tutto il dataset "
+                         "in memoria (memoria proporzionale al numero di righe)")
+parser.add_argument('--batch-size', type=int, default=None,
+                    help="Numero di righe per batch in modalità streaming (di default un row group per batch)")
+parser.add_argument('--errore-quantili', type=float, default=None,
+                    help="In modalità streaming stima i limiti IQR con sketch dei quantili con l'errore di rango "
+                         "indicato (es. 0.001), con memoria costante, invece di mantenere in memoria le colonne "
+                         "temporali di tutto il dataset")
+parser.add_argument('--tutte-le-colonne', action='store_true',
+                    help="Legge tutte le colonne e tutte le righe del dataset, senza proiezione delle colonne "
+                         "né filtro delle televisite disdette in lettura")
+parser.add_argument('--salva-mesi', action='store_true',
+                    help="Salva su disco il dataset diviso per anno e mese (month_dataset), i conteggi dei "
+                         "professionisti per mese (datasets/df_aggregato.parquet), la durata media per attività e i "
+                         "limiti IQR della pulizia e le feature rimosse dalla Features Selection, usati da --aggiorna")
+parser.add_argument('--granularita', choices=list(GRANULARITA), default='semestre',
+                    help="Periodo su cui viene calcolato l'incremento della richiesta fra anni successivi")
+parser.add_argument('--aggiorna', default=None, metavar='FILE',
+                    help="Modalità incrementale: elabora solo i campioni del file indicato (es. un nuovo mese), li "
+                         "pulisce con la durata media e i limiti IQR e ne rimuove le feature con le decisioni della "
+                         "Features Selection dell'intero dataset, li aggiunge ai conteggi salvati da un'esecuzione "
+                         "precedente con --salva-mesi e ricalcola solo gli incrementi dei periodi interessati. Data "
+                         "Transformation e Clustering vengono eseguiti solo sui nuovi campioni")
+parser.add_argument('--campioni-tardivi', action='store_true',
+                    help="Con --aggiorna consente di aggiungere campioni a mesi già presenti nei conteggi (es. "
+                         "prenotazioni registrate in ritardo); gli stessi campioni non possono comunque essere "
+                         "aggiunti due volte")
+parser.add_argument('--aggiorna-vocabolari', action='store_true',
+                    help="Aggiunge ai vocabolari delle feature categoriche (datasets/vocabolari) i valori nuovi, "
+                         "invece di codificarli come sconosciuti")
+parser.add_argument('--codifica', choices=['label', 'onehot'], default='label',
+                    help="Matrice delle feature del clustering: codici delle feature categoriche (label) o codifica "
+                         "one-hot in una matrice sparsa CSR passata a TruncatedSVD senza convertirla in densa (onehot)")
+parser.add_argument('--pesi-frequenza', action='store_true',
+                    help="Con --codifica onehot pesa ogni valore categorico con l'inverso della radice della sua "
+                         "frequenza")
+parser.add_argument('--cluster', type=lambda valore: valore if valore == 'auto' else int(valore), default=4,
+                    help="Numero di cluster del K-Means, o 'auto' per sceglierlo con il gomito della curva "
+                         "dell'inertia")
+parser.add_argument('--matrice-condivisa', choices=MODI_CONDIVISIONE, default=None,
+                    help="Scrive la matrice delle feature codificate una sola volta in un file .npy (memmap) o in "
+                         "memoria condivisa (shm) e valuta l'elbow method in processi separati che la aprono senza "
+                         "copiarla e ne calcolano la proiezione TruncatedSVD")
+parser.add_argument('--processi', type=int, default=None,
+                    help="Numero di processi worker con --matrice-condivisa (di default il numero di CPU)")
+parser.add_argument('--thread', type=int, default=None,
+                    help="Numero di thread dell'elbow method senza --matrice-condivisa (di default il numero di CPU)")
+parser.add_argument('--thread-blas', type=int, default=1,
+                    help="Numero massimo di thread BLAS e OpenMP di ogni worker dell'elbow method")
+parser.add_argument('--report', default=None,
+                    help="Salva il report delle fasi (tempo, CPU, memoria, righe) nel file indicato (.json o .csv)")
+parser.add_argument('--tracemalloc', action='store_true',
+                    help="Misura anche il picco di memoria allocata da Python in ogni fase (rallenta l'esecuzione)")
+parser.add_argument('--checkpoint', nargs='?', const=CARTELLA_CHECKPOINT, default=None,
+                    help="Salva l'output di ogni fase fino al calcolo dell'incremento nella cartella indicata "
+                         f"(di default {CARTELLA_CHECKPOINT}) e riprende dal checkpoint valido più profondo")
+parser.add_argument('--formato-checkpoint', choices=['parquet', 'arrow'], default='parquet',
+                    help="Formato dei checkpoint: Parquet (più compatto) o Arrow IPC (più veloce)")
 
-# STEP 1: Data Cleaning
-df = data_cleaning(df)
 
-# STEP 2: Features Selection
-df = feature_selection(df)
+def main():
+    """
+    Esegue la pipeline con gli argomenti da riga di comando. Lo script è protetto da if __name__ == '__main__':
+    con il metodo di avvio 'spawn' (Windows, macOS) i processi worker di --matrice-condivisa reimportano questo
+    modulo senza rieseguire la pipeline.
+    :return: None
+    """
+    args = parser.parse_args()
+    parametri_aggiornamento = (FILE_MEDIA_DURATA, FILE_LIMITI_OUTLIERS, FILE_SELEZIONE_FEATURES, FILE_AGGREGATO)
+    if args.aggiorna and not all(os.path.isfile(file) for file in parametri_aggiornamento):
+        parser.error(f"--aggiorna richiede {', '.join(parametri_aggiornamento)}, salvati da un'esecuzione completa "
+                     "con --salva-mesi")
 
-# STEP 3: Feature extraction
-df = feature_extraction(df)
+    # Strumentazione delle fasi della pipeline
+    configura_strumentazione(usa_tracemalloc=args.tracemalloc)
 
-# STEP 4: Calcolo dell'incremento
-df = incremento(df)
+    file_path = '../src/datasets/challenge_campus_biomedico_2024.parquet'
 
-# STEP 5: Data Transformation
-df, label_encoders, reverse_mapping, numerical_features, categorical_features = data_transformation(df)
+    # Colonne usate dalla pipeline e filtro delle televisite disdette, applicati durante la lettura del file
+    if args.tutte_le_colonne:
+        columns, filtro = None, None
+    else:
+        columns, filtro = colonne_utilizzate(file_path), FILTRO_DISDETTE
 
-# STEP 6: Clustering Execution
-df_clustered, cluster_labels, svd_transformed_data = execute_clustering(df, label_encoders, numerical_features,
-                                                                        categorical_features, reverse_mapping)
\ No newline at end of file
+    if args.streaming:
+        # STEP 1-3: Data Cleaning, Features Selection e Feature extraction un batch alla volta
+        fasi = [{
+            'nome': 'streaming_execution',
+            'funzione': lambda _: streaming_execution(file_path, batch_size=args.batch_size, columns=columns,
+                                                      filtro=filtro, errore_quantili=args.errore_quantili,
+                                                      salva_mesi=args.salva_mesi, salva_parametri=args.salva_mesi),
+            'codice': [streaming_execution, data_cleaning, feature_selection, feature_extraction, SketchKLL],
+            'parametri': {'batch_size': args.batch_size, 'errore_quantili': args.errore_quantili,
+                          'salva_mesi': args.salva_mesi},
+            'artefatti': [FILE_MEDIA_DURATA, FILE_LIMITI_OUTLIERS, FILE_SELEZIONE_FEATURES,
+                          FILE_AGGREGATO] if args.salva_mesi else []
+        }]
+    else:
+        # STEP 1: Data Cleaning (con il filtro in lettura le televisite disdette non vengono caricate, quindi la durata
+        # media per attività viene calcolata su tutti i campioni del file, come leggendo l'intero dataset)
+        # STEP 2: Features Selection
+        # STEP 3: Feature extraction
+        fasi = [
+            {'nome': 'data_cleaning', 'funzione': lambda df: data_cleaning(
+                df, media_durata=None if filtro is None else media_durata_dataset(file_path),
+                salva_parametri=args.salva_mesi),
+             'codice': [data_cleaning, carica_comuni_istat], 'parametri': {'salva_parametri': args.salva_mesi},
+             'artefatti': [FILE_MEDIA_DURATA, FILE_LIMITI_OUTLIERS] if args.salva_mesi else []},
+            {'nome': 'feature_selection',
+             'funzione': lambda df: feature_selection(df, salva_selezione=args.salva_mesi),
+             'codice': [feature_selection], 'parametri': {'salva_selezione': args.salva_mesi},
+             'artefatti': [FILE_SELEZIONE_FEATURES] if args.salva_mesi else []},
+            {'nome': 'feature_extraction', 'funzione': lambda df: feature_extraction(df, salva_mesi=args.salva_mesi),
+             'codice': [feature_extraction], 'parametri': {'salva_mesi': args.salva_mesi},
+             'artefatti': [FILE_AGGREGATO] if args.salva_mesi else []}
+        ]
+
+    # STEP 4: Calcolo dell'incremento, con i conteggi dei professionisti per mese calcolati in memoria
+    fasi.append({'nome': 'incremento', 'funzione': lambda df: incremento(df, granularita=args.granularita),
+                 'codice': [incremento, conta_professionisti], 'parametri': {'granularita': args.granularita},
+                 'artefatti': ['datasets/df_incremento_percentuale_esteso.parquet']})
+
+
+    def carica_input():
+        """
+        Carica il dataset (in modalità streaming viene letto dalla prima fase, un batch alla volta).
+        :return: DataFrame o None
+        """
+        return None if args.streaming else load_dataset(file_path, columns=columns, filtro=filtro)
+
+    if args.aggiorna:
+        # Modalità incrementale: vengono elaborati ed etichettati solo i nuovi campioni (le label dello storico non
+        # sono salvate, quindi le combinazioni modificate restituite da aggiorna_incremento non vengono usate)
+        df = load_dataset(args.aggiorna, columns=None if args.tutte_le_colonne else colonne_utilizzate(args.aggiorna),
+                          filtro=filtro)
+        # I nuovi campioni vengono puliti con la durata media e i limiti IQR calcolati sull'intero dataset, e ne vengono
+        # rimosse le stesse feature scartate dalla Features Selection dell'intero dataset
+        media_durata, limiti = carica_parametri_pulizia()
+        df = data_cleaning(df, media_durata=media_durata, limiti=limiti)
+        df = feature_extraction(feature_selection(df, selezione=carica_selezione_features()))
+        df_aggregato = append_monthly_aggregates(df, mesi_esistenti=args.campioni_tardivi)
+        df, _ = aggiorna_incremento(df, df_aggregato, granularita=args.granularita)
+    elif args.checkpoint:
+        # La versione del codice comprende i moduli interi (es. tutti gli helper di data_cleaning) e i moduli del
+        # progetto che importano; il contenuto del file excel dei codici ISTAT entra nell'impronta tramite il suo hash
+        impronta = impronta_dataset(file_path, columns=columns, filtro=filtro, streaming=args.streaming,
+                                    codice=versione_codice(load_dataset, applica_schema, carica_comuni_istat),
+                                    istat=calcola_sha256(FILE_CODICI_ISTAT))
+        df = esegui_con_checkpoint(fasi, carica_input, impronta, cartella=args.checkpoint,
+                                   formato=args.formato_checkpoint)
+    else:
+        df = carica_input()
+        for fase in fasi:
+            df = fase['funzione'](df)
+
+    # STEP 5: Data Transformation
+    df, vocabolari, reverse_mapping, numerical_features, categorical_features = data_transformation(
+        df, aggiorna_vocabolari=args.aggiorna_vocabolari)
+
+    # STEP 6: Clustering Execution
+    df_clustered, cluster_labels, svd_transformed_data = execute_clustering(df, vocabolari, numerical_features,
+                                                                            categorical_features, reverse_mapping,
+                                                                            condivisione=args.matrice_condivisa,
+                                                                            processi=args.processi,
+                                                                            codifica=args.codifica,
+                                                                            pesi_frequenza=args.pesi_frequenza,
+                                                                            n_clusters=args.cluster, thread=args.thread,
+                                                                            thread_blas=args.thread_blas)
+
+    # Riepilogo delle misure delle fasi
+    log_riepilogo()
+    if args.report:
+        salva_report(args.report)
+
+
+if __name__ == '__main__':
+    main()
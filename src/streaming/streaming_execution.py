@@ -0,0 +1,328 @@
+import logging
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from data_prep.data_loading import COLONNE_DURATA, iter_batch_parquet
+from data_prep.schema import COLONNE_TEMPORALI
+from data_prep.data_cleaning import (calcola_somme_durata,
+                                     media_durata_da_somme, applica_imputazioni,
+                                     imputate_ora_inizio_erogazione_and_ora_fine_erogazione, remove_disdette,
+                                     calcola_limiti_outliers, filtra_outliers, vista_numerica, smooth_noisy_data,
+                                     salva_parametri_pulizia)
+from data_prep.quantile_sketch import SEED_SKETCH, crea_sketch_colonne, aggiorna_sketch_colonne, limiti_da_sketch
+from data_prep.features_selection import (FEATURES_PAIRS, check_unique_correlation,
+                                          check_regione_residenza_equals_regione_erogazione, check_tipologia_servizio,
+                                          salva_selezione_features)
+from data_transformation.data_transformation import remove_features
+from feature_extraction.features_extraction import extract_row_features, save_monthly_aggregates
+from instrumentation.instrumentation import misura
+
+# Configuro il logger
+logging.basicConfig(level=logging.INFO,  # Imposto il livello minimo di log
+                    format='%(asctime)s - %(levelname)s - %(message)s')  # Formato del log
+
+
+@misura()
+def streaming_execution(file_path, batch_size=None, window_size=3, columns=None, filtro=None, limiti=None,
+                        errore_quantili=None, salva_mesi=False, salva_parametri=False):
+    """
+    Esegue Data Cleaning, Features Selection e Feature Extraction leggendo il dataset un batch alla volta.
+    Le operazioni che dipendono dal singolo campione (imputazioni, filtri, estrazione di età, durata, anno e mese)
+    vengono eseguite su ogni batch; le statistiche globali (durata media per attività, limiti IQR, correlazioni
+    univoche, duplicati) vengono ridotte fra i batch. Il dataset viene letto tre volte:
+    1) calcolo della durata media per attività (solo le colonne necessarie, su tutti i campioni come data_cleaning
+       sull'intero dataset, senza il filtro);
+    2) calcolo dei limiti IQR sulle colonne temporali imputate (saltato se i limiti vengono forniti);
+    3) pulizia ed estrazione delle feature per ogni batch.
+    Oltre al batch corrente vengono mantenuti in memoria le colonne temporali di tutto il dataset al passo 2 (o i soli
+    sketch dei quantili, se viene specificato errore_quantili), un hash per campione e il risultato compatto (solo le
+    feature usate nelle fasi successive, con le stringhe codificate come categorie). Se alcuni hash si ripetono, i
+    campioni corrispondenti vengono confrontati per intero con una quarta lettura (conferma_duplicati).
+    :param file_path: percorso del file Parquet
+    :param batch_size: numero di righe per batch. Se None, ogni batch corrisponde a un row group del file.
+    :param window_size: dimensione della finestra per la media mobile dello smoothing
+    :param columns: colonne da leggere (opzionale, es. colonne_utilizzate(file_path))
+    :param filtro: espressione pyarrow da applicare in lettura (opzionale, es. FILTRO_DISDETTE)
+    :param limiti: limiti IQR già calcolati (opzionale, es. caricati con carica_limiti_outliers)
+    :param errore_quantili: errore di rango normalizzato degli sketch usati per stimare i limiti IQR (opzionale).
+                            Se None, i limiti vengono calcolati in modo esatto.
+    :param salva_mesi: se True salva su disco il dataset mensile e 'datasets/df_aggregato.parquet'
+    :param salva_parametri: se True salva la durata media e i limiti IQR usati (salva_parametri_pulizia) e le
+                            feature rimosse dalla Features Selection (salva_selezione_features)
+    :return df: dataFrame equivalente a quello ottenuto con data_cleaning, feature_selection e feature_extraction
+    """
+    # Passo 1: durata media per attività
+    media_durata = calcola_media_durata_streaming(file_path, batch_size)
+
+    # Passo 2: limiti IQR per le colonne temporali
+    if limiti is None:
+        limiti = calcola_limiti_outliers_streaming(file_path, batch_size, media_durata, filtro, errore_quantili)
+    limiti = limiti.loc[COLONNE_TEMPORALI]
+    if salva_parametri:
+        salva_parametri_pulizia(media_durata, limiti)
+
+    # Passo 3: pulizia ed estrazione delle feature per ogni batch
+    parti = []
+    hash_campioni = []
+    coppie_distinte = {pair: [] for pair in FEATURES_PAIRS}
+    regione_uguale = True
+    tipologia_costante = True
+    valori_mancanti = None
+    scartati = pd.Series(0, index=COLONNE_TEMPORALI, name='scartati')  # Campioni scartati come outliers per colonna
+    rimossi = 0
+
+    for df, mancanti, rimossi_batch, scartati_batch in iter_batch_puliti(file_path, batch_size, columns, filtro,
+                                                                         media_durata, limiti, window_size):
+        valori_mancanti = mancanti if valori_mancanti is None else valori_mancanti.add(mancanti, fill_value=0)
+        rimossi += rimossi_batch
+        scartati += scartati_batch
+        if df.empty:
+            continue
+
+        # Hash del campione per la rimozione dei duplicati, eseguita alla fine su tutti i batch
+        hash_campioni.append(pd.util.hash_pandas_object(df, index=False).to_numpy())
+
+        # Statistiche per la Features Selection
+        for pair in coppie_distinte:
+            if pair[0] in df.columns and pair[1] in df.columns:
+                coppie_distinte[pair].append(df[list(pair)].drop_duplicates())
+        regione_uguale = regione_uguale and check_regione_residenza_equals_regione_erogazione(df)
+        tipologia_costante = tipologia_costante and (
+                'tipologia_servizio' in df.columns and check_tipologia_servizio(df))
+
+        # Rimozione delle feature che non vengono usate nelle fasi successive
+        df = df.drop(columns=[col for col in ['data_disdetta', 'id_prenotazione'] if col in df.columns])
+        df = remove_features(df)
+
+        # Feature Extraction per campione
+        df = extract_row_features(df)
+
+        # Codifica le stringhe come categorie per ridurre la memoria occupata dal risultato
+        for col in df.columns[df.dtypes == 'object']:
+            df[col] = df[col].astype('category')
+        parti.append(df)
+
+    logging.info("Statistiche valori mancanti dopo la rimozione dei campioni relativi a televisite disdette:")
+    logging.info(valori_mancanti[valori_mancanti > 0])
+    logging.info('-----------------------------------')
+
+    logging.info("Campioni scartati come outliers per colonna:")
+    logging.info(scartati)
+    logging.info(f"Campioni rimossi: {rimossi}")
+    logging.info('-----------------------------------')
+
+    df = concatena_batch(parti)
+
+    # Rimozione dei duplicati: gli hash uguali vengono confermati confrontando i campioni completi
+    duplicati = conferma_duplicati(hash_campioni, file_path, batch_size, columns, filtro, media_durata, limiti,
+                                   window_size)
+    df = df[~duplicati]
+
+    # Ordina le date di erogazione del servizio
+    df = df.sort_values(by='data_erogazione')
+
+    # Features Selection con le statistiche ridotte fra i batch
+    df = feature_selection_streaming(df, coppie_distinte, regione_uguale, tipologia_costante,
+                                     salva_selezione=salva_parametri)
+
+    # Divide il dataset per anno e mese e conta la richiesta di ogni professionista per ogni mese
+    if salva_mesi:
+        save_monthly_aggregates(df)
+
+    return df
+
+
+@misura()
+def calcola_media_durata_streaming(file_path, batch_size, filtro=None):
+    """
+    Calcola la durata media di ciascuna attività sommando le durate e il numero di attività di ogni batch.
+    :param file_path: percorso del file Parquet
+    :param batch_size: numero di righe per batch
+    :param filtro: espressione pyarrow da applicare in lettura (opzionale)
+    :return: Series 'durata_media' (Timedelta) indicizzata per 'codice_descrizione_attivita'
+    """
+    somme = None
+    for df in iter_batch_parquet(file_path, batch_size, columns=COLONNE_DURATA, filtro=filtro):
+        somme_batch = calcola_somme_durata(df)
+        somme = somme_batch if somme is None else somme.add(somme_batch, fill_value=0)
+
+    return media_durata_da_somme(somme)
+
+
+@misura()
+def calcola_limiti_outliers_streaming(file_path, batch_size, media_durata, filtro=None, errore_quantili=None):
+    """
+    Calcola i limiti IQR delle colonne temporali (dopo l'imputazione e la rimozione delle televisite disdette).
+    Se errore_quantili è None, da ogni batch vengono mantenute solo le colonne temporali, sulle quali i limiti vengono
+    calcolati con calcola_limiti_outliers; altrimenti ogni batch aggiorna uno sketch KLL per colonna e i limiti
+    vengono calcolati dai quartili approssimati, con memoria costante.
+    :param file_path: percorso del file Parquet
+    :param batch_size: numero di righe per batch
+    :param media_durata: durata media per attività, usata per l'imputazione degli orari
+    :param filtro: espressione pyarrow da applicare in lettura (opzionale)
+    :param errore_quantili: errore di rango normalizzato degli sketch (opzionale)
+    :return: DataFrame indicizzato per colonna con 'lower_bound' e 'upper_bound'
+    """
+    sketches = None
+    if errore_quantili is not None:
+        sketches = crea_sketch_colonne(COLONNE_TEMPORALI, errore_quantili, seed=SEED_SKETCH)
+    colonne_temporali = []
+    for df in iter_batch_parquet(file_path, batch_size, columns=COLONNE_TEMPORALI + ['codice_descrizione_attivita',
+                                                                                     'data_disdetta'],
+                                 filtro=filtro):
+        df = imputate_ora_inizio_erogazione_and_ora_fine_erogazione(df, media_durata)
+        df = remove_disdette(df)
+        if sketches is None:
+            colonne_temporali.append(df[COLONNE_TEMPORALI])
+        else:
+            aggiorna_sketch_colonne(sketches, vista_numerica(df, COLONNE_TEMPORALI))
+
+    if sketches is not None:
+        return limiti_da_sketch(sketches)
+    return calcola_limiti_outliers(pd.concat(colonne_temporali), COLONNE_TEMPORALI)
+
+
+def iter_batch_puliti(file_path, batch_size, columns, filtro, media_durata, limiti, window_size):
+    """
+    Legge il dataset un batch alla volta e applica a ogni batch le operazioni di pulizia per campione: imputazione,
+    rimozione delle televisite disdette, rimozione degli outliers con i limiti globali e smoothing (con la coda del
+    batch precedente). Il risultato è deterministico, quindi una seconda lettura produce gli stessi campioni.
+    :param file_path: percorso del file Parquet
+    :param batch_size: numero di righe per batch
+    :param columns: colonne da leggere (opzionale)
+    :param filtro: espressione pyarrow da applicare in lettura (opzionale)
+    :param media_durata: durata media per attività, usata per l'imputazione degli orari
+    :param limiti: limiti IQR delle colonne temporali
+    :param window_size: dimensione della finestra per la media mobile dello smoothing
+    :return: generatore di (batch pulito, valori mancanti per colonna, campioni rimossi, scartati per colonna)
+    """
+    coda = None  # Ultimi window_size - 1 campioni del batch precedente, necessari per la media mobile
+    for df in iter_batch_parquet(file_path, batch_size, columns, filtro):
+        # Imputazione dei valori mancanti e rimozione delle televisite disdette
+        df = applica_imputazioni(df, media_durata)
+        df = remove_disdette(df)
+        mancanti = df.isnull().sum()
+
+        # Rimozione degli outliers con i limiti globali
+        df, rimossi, scartati = filtra_outliers(df, limiti)
+
+        # Smoothing: la media mobile del primo campione del batch usa la coda del batch precedente
+        if not df.empty:
+            df, coda = smooth_batch(df, coda, window_size)
+
+        yield df, mancanti, rimossi, scartati
+
+
+@misura()
+def conferma_duplicati(hash_campioni, file_path, batch_size, columns, filtro, media_durata, limiti, window_size):
+    """
+    Individua i campioni duplicati. I campioni con hash diverso sono sicuramente distinti; quelli con lo stesso hash
+    (duplicati o, raramente, collisioni dell'hash a 64 bit) vengono confrontati per intero con una seconda lettura del
+    dataset, che mantiene in memoria solo questi campioni. La lettura viene saltata se non ci sono hash ripetuti.
+    :param hash_campioni: lista degli hash dei campioni di ogni batch (iter_batch_puliti)
+    :param file_path: percorso del file Parquet
+    :param batch_size: numero di righe per batch
+    :param columns: colonne da leggere (opzionale)
+    :param filtro: espressione pyarrow da applicare in lettura (opzionale)
+    :param media_durata: durata media per attività
+    :param limiti: limiti IQR delle colonne temporali
+    :param window_size: dimensione della finestra per la media mobile dello smoothing
+    :return: array booleano, True per i campioni uguali a un campione precedente (come drop_duplicates)
+    """
+    hash_tutti = pd.Series(np.concatenate(hash_campioni) if hash_campioni else np.empty(0, dtype=np.uint64))
+    candidati = hash_tutti.duplicated(keep=False).to_numpy()
+    duplicati = np.zeros(len(hash_tutti), dtype=bool)
+    if not candidati.any():
+        return duplicati
+
+    # Campioni completi con hash ripetuto, indicizzati per posizione
+    righe = []
+    inizio = 0
+    for df, *_ in iter_batch_puliti(file_path, batch_size, columns, filtro, media_durata, limiti, window_size):
+        selezionati = candidati[inizio:inizio + len(df)]
+        if selezionati.any():
+            righe.append(df[selezionati].set_axis(np.flatnonzero(selezionati) + inizio))
+        inizio += len(df)
+
+    righe = pd.concat(righe)
+    duplicati[righe.index[righe.duplicated().to_numpy()]] = True
+    logging.info(f"Duplicati: {int(candidati.sum())} campioni con hash ripetuto, {int(duplicati.sum())} duplicati "
+                 f"confermati")
+    return duplicati
+
+
+def smooth_batch(df, coda, window_size):
+    """
+    Applica smooth_noisy_data al batch anteponendo la coda del batch precedente, in modo che la media mobile
+    sia la stessa che si otterrebbe sull'intero dataset.
+    :param df: batch
+    :param coda: ultimi window_size - 1 campioni (non smussati) del batch precedente, o None
+    :param window_size: dimensione della finestra per la media mobile
+    :return: batch smussato, coda da passare al batch successivo
+    """
+    blocco = df[COLONNE_TEMPORALI] if coda is None else pd.concat([coda, df[COLONNE_TEMPORALI]])
+    nuova_coda = blocco.tail(window_size - 1)
+
+    smussato = smooth_noisy_data(blocco.copy(), COLONNE_TEMPORALI, window_size)
+    for col in COLONNE_TEMPORALI:
+        df[col] = smussato[col].to_numpy()[len(blocco) - len(df):]
+
+    return df, nuova_coda
+
+
+def concatena_batch(parti):
+    """
+    Concatena i batch elaborati. Le colonne categoriche vengono unite con le categorie di tutti i batch e
+    riconvertite in stringhe, come si aspettano le fasi successive della pipeline.
+    :param parti: lista di DataFrame
+    :return: DataFrame
+    """
+    colonne = parti[0].columns
+    colonne_categoriche = [col for col in colonne if isinstance(parti[0][col].dtype, pd.CategoricalDtype)]
+
+    df = pd.concat([parte.drop(columns=colonne_categoriche) for parte in parti])
+    for col in colonne_categoriche:
+        df[col] = np.asarray(union_categoricals([parte[col] for parte in parti]).astype(object))
+
+    return df[colonne]
+
+
+def feature_selection_streaming(df, coppie_distinte, regione_uguale, tipologia_costante, salva_selezione=False):
+    """
+    Applica le decisioni della Features Selection usando le statistiche raccolte sui batch.
+    :param df: dataFrame compatto
+    :param coppie_distinte: dizionario {coppia di feature: lista delle coppie distinte di ogni batch}
+    :param regione_uguale: True se 'regione_residenza' coincide con 'regione_erogazione' in ogni batch
+    :param tipologia_costante: True se 'tipologia_servizio' vale sempre 'Teleassistenza'
+    :param salva_selezione: se True salva le feature rimosse in base ai dati (salva_selezione_features)
+    :return: dataFrame senza le feature rimosse
+    """
+    selezione = []
+    for pair in FEATURES_PAIRS:
+        # Coppia non caricata (es. lettura con proiezione delle colonne): non c'è nulla da verificare
+        if not coppie_distinte[pair]:
+            continue
+
+        coppie = pd.concat(coppie_distinte[pair]).drop_duplicates()
+        if check_unique_correlation(coppie, pair[0], pair[1]):
+            # La feature potrebbe essere già stata rimossa da remove_features
+            df = df.drop(columns=[pair[0]], errors='ignore')
+            selezione.append(pair[0])
+            logging.info(f"Feature {pair[0]} eliminata correlazione univoca con la feature {pair[1]}")
+        else:
+            logging.info(f"Alcuni codici o descrizioni non sono univoci per le features {pair[0]} e {pair[1]}.")
+
+    if regione_uguale:
+        logging.info("Eliminazione della feature: regione_erogazione")
+        df = df.drop(columns=['regione_erogazione'])
+        selezione.append('regione_erogazione')
+
+    if tipologia_costante:
+        logging.info("Eliminazione della feature: tipologia_servizio")
+        df = df.drop(columns=['tipologia_servizio'])
+        selezione.append('tipologia_servizio')
+
+    if salva_selezione:
+        salva_selezione_features(selezione)
+
+    return df
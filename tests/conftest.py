@@ -0,0 +1,43 @@
+import os
+import sys
+import pytest
+
+# I moduli della pipeline vengono importati relativamente alla cartella src (come da run.py), quelli del clustering
+# con il prefisso src.
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for percorso in (os.path.join(RADICE, 'src'), RADICE):
+    if percorso not in sys.path:
+        sys.path.insert(0, percorso)
+
+# File excel dei codici ISTAT distribuito con la repository
+FILE_ISTAT = os.path.join(RADICE, 'src', 'datasets', 'Codici-statistici-e-denominazioni-al-30_06_2024.xlsx')
+
+
+@pytest.fixture
+def cartella_lavoro(tmp_path, monkeypatch):
+    """
+    Cartella di lavoro temporanea con la struttura attesa dalla pipeline (datasets con il file excel dei codici
+    ISTAT, graphs): i percorsi relativi della pipeline non scrivono nella repository.
+    """
+    os.makedirs(tmp_path / 'datasets')
+    os.makedirs(tmp_path / 'graphs')
+    os.symlink(FILE_ISTAT, tmp_path / 'datasets' / os.path.basename(FILE_ISTAT))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture(scope='session')
+def dataset_sintetico(tmp_path_factory):
+    """
+    Dataset sintetico di 3000 prenotazioni (benchmark.synthetic_dataset) in row group da 500 righe.
+    """
+    from benchmark.synthetic_dataset import genera_dataset
+    cartella = tmp_path_factory.mktemp('sintetico')
+    # La cache della tabella dei comuni viene scritta nella cartella temporanea
+    corrente = os.getcwd()
+    os.chdir(cartella)
+    try:
+        return genera_dataset(str(cartella / 'prenotazioni.parquet'), 3000, seed=1, righe_per_row_group=500,
+                              file_istat=FILE_ISTAT)
+    finally:
+        os.chdir(corrente)
@@ -0,0 +1,31 @@
+import numpy as np
+from sklearn.utils._openmp_helpers import _openmp_effective_n_threads
+from threadpoolctl import threadpool_info
+from src.clustering import clustering_execution
+
+
+class KMeansRegistrato:
+    """
+    K-Means fittizio che registra i thread OpenMP e BLAS disponibili nel thread in cui viene adattato.
+    """
+    thread = []
+
+    def __init__(self, n_clusters, random_state=None):
+        self.n_clusters = n_clusters
+
+    def fit(self, data):
+        blas = [info['num_threads'] for info in threadpool_info() if info['user_api'] == 'blas']
+        KMeansRegistrato.thread.append((_openmp_effective_n_threads(), max(blas, default=1)))
+        self.inertia_ = float(len(data)) / self.n_clusters
+        return self
+
+
+def test_limiti_dei_thread_in_ogni_worker_dell_elbow_method(cartella_lavoro, monkeypatch):
+    monkeypatch.setattr(clustering_execution, 'KMeans', KMeansRegistrato)
+    KMeansRegistrato.thread = []
+    data = np.random.default_rng(0).random((100, 3), dtype=np.float32)
+
+    modelli = clustering_execution.plot_elbow_method(data, max_clusters=6, thread=3, thread_blas=1)
+
+    assert list(modelli) == list(range(1, 7))
+    assert KMeansRegistrato.thread == [(1, 1)] * 6
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+import pytest
+from data_prep import data_cleaning
+from data_prep.schema import NAT_INT64
+
+# Tabelle ISTAT ridotte, al posto di quelle lette dal file excel
+COMUNI = {58091: 'Roma', 63049: 'Napoli', 15146: 'Milano', 1168: 'None'}
+PROVINCE = {'Roma': 'RM', 'Napoli': 'NA', 'Milano': 'MI', 'Torino': 'TO'}
+
+
+@pytest.fixture
+def df():
+    """
+    Campioni con comuni e sigle mancanti (None), valori NaN (che le imputazioni non considerano mancanti), codici e
+    province assenti dalle tabelle, il comune 1168 ('None', TO) e le righe di Napoli con la sigla 'NA' letta come
+    mancante.
+    """
+    return pd.DataFrame({
+        'comune_residenza': [None, 'Roma', None, None, np.nan, None, 'Napoli', None],
+        'codice_comune_residenza': [58091, 58091, 99999, 1168, 15146, 63049, 63049, 1168],
+        'codice_provincia_residenza': [None, 'RM', None, 'TO', np.nan, None, None, None],
+        'provincia_residenza': ['Roma', 'Roma', 'Atlantide', 'Torino', 'Milano', 'Napoli', 'Napoli', None],
+        'codice_provincia_erogazione': ['NA', None, None, np.nan, 'MI', None, None, None],
+        'provincia_erogazione': ['Napoli', 'Napoli', 'Atlantide', 'Milano', 'Milano', 'Roma', 'Napoli', 'Torino'],
+    })
+
+
+@pytest.fixture(autouse=True)
+def tabelle_istat(monkeypatch):
+    monkeypatch.setattr(data_cleaning, 'codice_comune_to_nome', lambda: COMUNI)
+    monkeypatch.setattr(data_cleaning, 'dict_province', lambda: PROVINCE)
+
+
+def imputate_comune_residenza_per_riga(df):
+    """Implementazione riga per riga precedente a imputa_con_mappa."""
+    codice_comune_to_nome_dict = data_cleaning.codice_comune_to_nome()
+
+    def fill_missing_comune_residenza(row):
+        if row['codice_comune_residenza'] == 1168:
+            return "NONE"
+        if row['comune_residenza'] is None:
+            return codice_comune_to_nome_dict.get(row['codice_comune_residenza'])
+        return row['comune_residenza']
+
+    df['comune_residenza'] = df.apply(fill_missing_comune_residenza, axis=1)
+    return df
+
+
+def imputate_codice_provincia_per_riga(df, colonna, colonna_provincia):
+    """Implementazione riga per riga precedente a imputa_con_mappa delle sigle di provincia."""
+    dict_province_sigle = data_cleaning.dict_province()
+
+    def fill_missing_codice_provincia(row):
+        if row[colonna] is None:
+            return dict_province_sigle.get(row[colonna_provincia])
+        return row[colonna]
+
+    df[colonna] = df.apply(fill_missing_codice_provincia, axis=1)
+    return df
+
+
+def test_imputate_comune_residenza(df):
+    atteso = imputate_comune_residenza_per_riga(df.copy())
+    pd.testing.assert_frame_equal(data_cleaning.imputate_comune_residenza(df.copy()), atteso)
+
+
+def test_imputate_codice_provincia_residenza(df):
+    atteso = imputate_codice_provincia_per_riga(df.copy(), 'codice_provincia_residenza', 'provincia_residenza')
+    risultato = data_cleaning.imputate_codice_provincia_residenza(df.copy())
+    pd.testing.assert_frame_equal(risultato, atteso)
+    assert risultato.loc[5, 'codice_provincia_residenza'] == 'NA'
+
+
+def test_imputate_codice_provincia_erogazione(df):
+    atteso = imputate_codice_provincia_per_riga(df.copy(), 'codice_provincia_erogazione', 'provincia_erogazione')
+    risultato = data_cleaning.imputate_codice_provincia_erogazione(df.copy())
+    pd.testing.assert_frame_equal(risultato, atteso)
+    assert risultato.loc[[1, 6], 'codice_provincia_erogazione'].tolist() == ['NA', 'NA']
+
+
+def test_imputa_con_mappa_mantiene_none_e_nan(df):
+    valori = data_cleaning.imputa_con_mappa(df['codice_provincia_residenza'], df['provincia_residenza'], PROVINCE)
+    # Provincia assente dalla tabella: resta None; NaN non è considerato mancante e resta NaN
+    assert valori[2] is None
+    assert isinstance(valori[4], float) and np.isnan(valori[4])
+    assert valori[7] is None
+
+
+def valori_ns(n, inizio, fine, seed=0):
+    """
+    Nanosecondi casuali fra le date indicate con circa il 10% di NaT, e codici di 4 gruppi alternati.
+    """
+    rng = np.random.default_rng(seed)
+    valori = rng.integers(pd.Timestamp(inizio).value, pd.Timestamp(fine).value, n)
+    valori[rng.random(n) < 0.1] = NAT_INT64
+    return valori, rng.integers(0, 4, n)
+
+
+def media_mobile_per_campione(valori, window_size, codici_gruppo):
+    """Media mobile calcolata con interi Python, campione per campione, arrotondata al ns (metà per eccesso)."""
+    media = np.empty(len(valori), dtype=np.int64)
+    for i in range(len(valori)):
+        # Ultimi window_size campioni del gruppo fino al campione corrente
+        gruppo = [j for j in range(i + 1) if codici_gruppo[j] == codici_gruppo[i]][-window_size:]
+        finestra = [int(valori[j]) for j in gruppo if valori[j] != NAT_INT64]
+        media[i] = (2 * sum(finestra) + len(finestra)) // (2 * len(finestra)) if finestra else NAT_INT64
+    return media
+
+
+@pytest.mark.parametrize('window_size', [1, 2, 3, 5])
+@pytest.mark.parametrize('con_gruppi', [False, True])
+def test_media_mobile_ns_esatta(window_size, con_gruppi):
+    valori, codici_gruppo = valori_ns(300, '1950-01-01', '2040-01-01')
+    # Finestre di soli NaT all'inizio e in mezzo ai dati
+    valori[:6] = NAT_INT64
+    valori[100:112] = NAT_INT64
+    gruppi = codici_gruppo if con_gruppi else np.zeros(len(valori), dtype=np.int64)
+
+    media = data_cleaning.media_mobile_ns(valori, window_size, codici_gruppo if con_gruppi else None)
+    np.testing.assert_array_equal(media, media_mobile_per_campione(valori, window_size, gruppi))
+
+
+@pytest.mark.parametrize('con_gruppi', [False, True])
+def test_media_mobile_ns_entro_la_tolleranza_di_rolling(con_gruppi):
+    valori, codici_gruppo = valori_ns(50000, '2019-01-01', '2023-01-01')
+    serie = pd.Series(np.where(valori == NAT_INT64, np.nan, valori.astype(np.float64)))
+    if con_gruppi:
+        attesa = serie.groupby(codici_gruppo).transform(lambda gruppo: gruppo.rolling(window=3, min_periods=1).mean())
+    else:
+        attesa = serie.rolling(window=3, min_periods=1).mean()
+    attesa = attesa.to_numpy()
+
+    media = data_cleaning.media_mobile_ns(valori, 3, codici_gruppo if con_gruppi else None)
+
+    # NaT dove rolling().mean() restituisce NaN (finestre di soli valori mancanti), altrimenti al più 4 ulp di scarto
+    nat = media == NAT_INT64
+    np.testing.assert_array_equal(nat, np.isnan(attesa))
+    assert nat.any()
+    scarto = np.abs(media[~nat] - np.round(attesa[~nat]).astype(np.int64))
+    assert (scarto <= 4 * np.spacing(attesa[~nat])).all()
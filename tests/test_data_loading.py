@@ -0,0 +1,37 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from data_prep.data_cleaning import data_cleaning
+from data_prep.data_loading import FILTRO_DISDETTE, colonne_utilizzate, load_dataset, media_durata_dataset
+from data_prep.features_selection import feature_selection
+
+
+@pytest.fixture
+def dataset_con_ripetizioni(dataset_sintetico, cartella_lavoro):
+    """
+    Dataset sintetico con 200 prenotazioni ripetute che differiscono dall'originale solo per gli identificativi
+    (prenotazioni distinte, da non rimuovere come duplicati) e 100 ripetute identiche (duplicati).
+    """
+    table = pq.read_table(dataset_sintetico)
+    ripetute = table.slice(0, 200)
+    for colonna in ['id_prenotazione', 'id_paziente', 'id_professionista_sanitario']:
+        indice = ripetute.schema.get_field_index(colonna)
+        valori = pa.array([f'{valore}-bis' for valore in ripetute.column(colonna).to_pylist()])
+        ripetute = ripetute.set_column(indice, colonna, valori)
+    file_path = str(cartella_lavoro / 'ripetizioni.parquet')
+    pq.write_table(pa.concat_tables([table, ripetute, table.slice(1000, 100)]), file_path)
+    return file_path
+
+
+def test_lettura_proiettata_uguale_a_lettura_completa(dataset_con_ripetizioni):
+    file_path = dataset_con_ripetizioni
+    proiettato = data_cleaning(load_dataset(file_path, columns=colonne_utilizzate(file_path), filtro=FILTRO_DISDETTE),
+                               media_durata=media_durata_dataset(file_path))
+    completo = data_cleaning(load_dataset(file_path))
+
+    # Il Data Cleaning rimuove gli stessi campioni, nello stesso ordine; l'indice è diverso perché il filtro in
+    # lettura esclude le televisite disdette prima di numerare i campioni
+    proiettato, completo = proiettato.reset_index(drop=True), completo.reset_index(drop=True)
+    pd.testing.assert_frame_equal(proiettato, completo[proiettato.columns])
+    pd.testing.assert_frame_equal(feature_selection(proiettato), feature_selection(completo))
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import pytest
+from feature_extraction.extract_increment import (calcola_incremento, estendi_incremento, somma_per_intervallo_mesi,
+                                                  unisci_incremento)
+from feature_extraction.features_extraction import conta_professionisti
+
+# Coppie di anni e semestri dell'implementazione precedente, fissati per i dati dal 2019 al 2022
+INTERVALLI_ANNI_MESI = [
+    (2019, 2020, '1, 2, 3, 4, 5, 6'),
+    (2019, 2020, '7, 8, 9, 10, 11, 12'),
+    (2020, 2021, '1, 2, 3, 4, 5, 6'),
+    (2020, 2021, '7, 8, 9, 10, 11, 12'),
+    (2021, 2022, '1, 2, 3, 4, 5, 6'),
+    (2021, 2022, '7, 8, 9, 10, 11, 12')
+]
+
+
+@pytest.fixture
+def df_aggregato():
+    """
+    Conteggi per mese dal 2019 al 2022 senza alcun dato nel 2021. 'Infermiere' ha sempre occorrenze; 'Logopedista'
+    non compare nel primo semestre del 2019 (anno precedente mancante) né nel secondo semestre del 2020 (anno
+    successivo mancante); 'Fisioterapista' ha zero occorrenze nel primo semestre del 2019 (denominatore nullo).
+    """
+    righe = [
+        ('Infermiere', 2019, 2, 10), ('Infermiere', 2019, 5, 4), ('Infermiere', 2019, 9, 8),
+        ('Infermiere', 2020, 3, 20), ('Infermiere', 2020, 11, 9), ('Infermiere', 2022, 1, 13),
+        ('Infermiere', 2022, 8, 30),
+        ('Logopedista', 2019, 7, 5), ('Logopedista', 2020, 4, 6), ('Logopedista', 2022, 6, 2),
+        ('Fisioterapista', 2019, 1, 0), ('Fisioterapista', 2019, 12, 7), ('Fisioterapista', 2020, 6, 3),
+        ('Fisioterapista', 2020, 7, 10), ('Fisioterapista', 2022, 2, 1),
+    ]
+    return pd.DataFrame(righe, columns=['tipologia_professionista_sanitario', 'anno', 'mese', 'conteggio'])
+
+
+def get_intervallo_mesi_precedente(mese):
+    """Implementazione precedente dell'intervallo di mesi (semestre) di un mese."""
+    intervalli_mesi = {
+        (1, 2, 3, 4, 5, 6): '1, 2, 3, 4, 5, 6',
+        (7, 8, 9, 10, 11, 12): '7, 8, 9, 10, 11, 12'
+    }
+    for mesi, intervallo in intervalli_mesi.items():
+        if mese in mesi:
+            return intervallo
+    return "Intervallo non trovato"
+
+
+def calcola_incremento_precedente(df):
+    """Implementazione precedente (groupby, pivot e ciclo sulle righe) dell'incremento per semestre."""
+    df['intervallo_mesi'] = df['mese'].apply(get_intervallo_mesi_precedente)
+    df = df.groupby(['tipologia_professionista_sanitario', 'anno',
+                     'intervallo_mesi'])['conteggio'].sum().reset_index()
+    df_pivot = df.pivot_table(index=['tipologia_professionista_sanitario', 'intervallo_mesi'], columns='anno',
+                              values='conteggio').reset_index()
+
+    risultati = []
+    for (anno1, anno2, intervallo) in INTERVALLI_ANNI_MESI:
+        for _, row in df_pivot[df_pivot['intervallo_mesi'] == intervallo].iterrows():
+            conteggio_anno1 = row.get(anno1, 0)
+            conteggio_anno2 = row.get(anno2, 0)
+            incremento = ((conteggio_anno2 - conteggio_anno1) / conteggio_anno1) * 100 if conteggio_anno1 > 0 \
+                else float('inf')
+            if incremento < 0:
+                classificazione = 'costante'
+            elif 0 <= incremento <= 35:
+                classificazione = 'bassa'
+            elif 35 < incremento <= 80:
+                classificazione = 'media'
+            else:
+                classificazione = 'alta'
+            risultati.append({
+                'tipologia_professionista_sanitario': row['tipologia_professionista_sanitario'],
+                'anno': f"{anno1}-{anno2}",
+                'intervallo_mesi': intervallo,
+                'incremento_percentuale': incremento,
+                'incremento': classificazione
+            })
+    return pd.DataFrame(risultati)
+
+
+def test_calcola_incremento_uguale_all_implementazione_precedente(df_aggregato):
+    atteso = calcola_incremento_precedente(df_aggregato.copy())
+    tipologie = df_aggregato['tipologia_professionista_sanitario'].unique()
+    risultato = somma_per_intervallo_mesi(df_aggregato.copy(), tipologie)
+    calcolato = calcola_incremento(risultato)[atteso.columns]
+
+    pd.testing.assert_frame_equal(calcolato, atteso)
+
+    # Casi limite: denominatore nullo e anno precedente mancante o senza dati (infinito), anno successivo mancante
+    # (NaN), anno successivo senza dati (-100)
+    incremento = calcolato.set_index(['tipologia_professionista_sanitario', 'anno', 'intervallo_mesi'])
+    incremento = incremento['incremento_percentuale']
+    assert incremento[('Fisioterapista', '2019-2020', '1, 2, 3, 4, 5, 6')] == np.inf
+    assert incremento[('Logopedista', '2019-2020', '1, 2, 3, 4, 5, 6')] == np.inf
+    assert incremento[('Infermiere', '2021-2022', '7, 8, 9, 10, 11, 12')] == np.inf
+    assert np.isnan(incremento[('Logopedista', '2019-2020', '7, 8, 9, 10, 11, 12')])
+    assert incremento[('Infermiere', '2020-2021', '1, 2, 3, 4, 5, 6')] == -100
+
+
+def campioni(anni, n=400, seed=0):
+    """
+    Campioni con tipologia, anno e mese casuali negli anni indicati, con una colonna di valori e un indice non
+    consecutivo.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'tipologia_professionista_sanitario': rng.choice(['Infermiere', 'Logopedista', 'Fisioterapista'], n),
+        'year': rng.choice(anni, n),
+        'month': rng.integers(1, 13, n),
+        'valore': np.arange(n)
+    }, index=np.arange(n) * 3)
+
+
+def incremento_esteso(df):
+    """Incremento per tipologia, anno e mese calcolato dai campioni."""
+    df_aggregato = conta_professionisti(df)
+    tipologie = df_aggregato['tipologia_professionista_sanitario'].unique()
+    return estendi_incremento(calcola_incremento(somma_per_intervallo_mesi(df_aggregato, tipologie)))
+
+
+def unisci_incremento_precedente(df_originale, risultato_esteso):
+    """Implementazione precedente (left join sulle tre colonne), senza l'eliminazione dei campioni del 2019."""
+    return pd.merge(df_originale,
+                    risultato_esteso[['tipologia_professionista_sanitario', 'year', 'month', 'incremento']],
+                    on=['tipologia_professionista_sanitario', 'year', 'month'], how='left')
+
+
+@pytest.mark.parametrize('anni', [[2019, 2020, 2021, 2022], [2020, 2021, 2022]])
+def test_unisci_incremento_uguale_al_merge(anni):
+    df = campioni(anni)
+    risultato_esteso = incremento_esteso(df)
+    # Tipologia e mese senza incremento: il campione riceve NaN come con il left join
+    df.iloc[0, df.columns.get_loc('tipologia_professionista_sanitario')] = 'Ostetrica'
+
+    unito = unisci_incremento(df, risultato_esteso)
+
+    # L'implementazione precedente eliminava sempre il 2019; vengono eliminati i campioni degli anni precedenti il
+    # primo anno con incremento (il 2020 se i dati iniziano nel 2020)
+    atteso = unisci_incremento_precedente(df.reset_index(drop=True), risultato_esteso)
+    atteso = atteso[atteso['year'] >= anni[1]]
+    assert atteso['year'].min() == anni[1]
+    pd.testing.assert_frame_equal(unito, atteso, check_index_type=False)
+    assert unito['incremento'].isna().sum() == (unito['tipologia_professionista_sanitario'] == 'Ostetrica').sum()
+
+
+def test_unisci_incremento_un_solo_anno(caplog):
+    df = campioni([2021])
+    risultato_esteso = incremento_esteso(df)
+    assert risultato_esteso.empty
+
+    unito = unisci_incremento(df, risultato_esteso)
+
+    # Nessuna coppia di anni successivi: nessun campione ha un incremento e vengono eliminati tutti, invece di
+    # restituire tutti i campioni con incremento NaN come il merge precedente
+    assert unisci_incremento_precedente(df, risultato_esteso)['incremento'].isna().all()
+    assert unito.empty
+    assert list(unito.columns) == list(df.columns) + ['incremento']
+    assert "Nessuna coppia di anni successivi" in caplog.text
@@ -0,0 +1,25 @@
+from data_prep.data_cleaning import data_cleaning
+from data_prep.data_loading import load_dataset
+from data_prep.features_selection import carica_selezione_features, feature_selection
+from streaming.streaming_execution import streaming_execution
+
+
+def test_selezione_salvata_applicata_ai_nuovi_campioni(cartella_lavoro, dataset_sintetico):
+    df = data_cleaning(load_dataset(dataset_sintetico))
+    # Nuovi campioni erogati nella regione di residenza: ricalcolata su di essi la Features Selection rimuoverebbe
+    # 'regione_erogazione', che sull'intero dataset contiene informazione
+    nuovi = df[df['regione_residenza'] == df['regione_erogazione']].head(50).copy()
+    completo = feature_selection(df, salva_selezione=True)
+    assert 'regione_erogazione' in completo.columns
+    assert 'regione_erogazione' not in feature_selection(nuovi.copy()).columns
+
+    aggiornato = feature_selection(nuovi, selezione=carica_selezione_features())
+    assert list(aggiornato.columns) == list(completo.columns)
+
+
+def test_selezione_streaming_uguale_a_selezione_in_memoria(cartella_lavoro, dataset_sintetico):
+    feature_selection(data_cleaning(load_dataset(dataset_sintetico)), salva_selezione=True)
+    in_memoria = carica_selezione_features()
+
+    streaming_execution(dataset_sintetico, batch_size=700, salva_parametri=True)
+    assert sorted(carica_selezione_features()) == sorted(in_memoria)
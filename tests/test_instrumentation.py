@@ -0,0 +1,33 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation.instrumentation import configura_strumentazione, fase, report_fasi
+
+
+def test_fasi_annidate_in_thread_concorrenti():
+    configura_strumentazione(campiona_rss=True, intervallo_campionamento=0.001)
+    barriera = threading.Barrier(2)
+
+    def lavoro(nome):
+        # Le fasi dei due thread si alternano: ognuna deve avere come padre la fase esterna del proprio thread
+        with fase(nome):
+            barriera.wait()
+            with fase(f'{nome}_interna'):
+                barriera.wait()
+            barriera.wait()
+
+    try:
+        with fase('principale'):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(lavoro, ['a', 'b']))
+        report = report_fasi().set_index('fase')
+    finally:
+        configura_strumentazione(attiva=True)
+
+    assert len(report) == 5
+    for nome in ['a', 'b']:
+        # La fase principale è in corso in un altro thread, quindi non è il padre delle fasi dei worker
+        assert report.loc[nome, 'padre'] is None and report.loc[nome, 'livello'] == 0
+        assert report.loc[f'{nome}_interna', 'padre'] == nome and report.loc[f'{nome}_interna', 'livello'] == 1
+    assert report.loc['principale', 'padre'] is None
+    # Il campionatore misura anche le fasi in corso nei thread worker
+    assert report['picco_rss_fase_mb'].notna().all()
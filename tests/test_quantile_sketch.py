@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+from data_prep.quantile_sketch import SketchKLL, crea_sketch_colonne, aggiorna_sketch_colonne, limiti_da_sketch, \
+    unisci_sketch_colonne
+
+QUANTILI = np.array([0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99])
+
+
+def valori_campione(n=200_000, seed=0):
+    """Timestamp in nanosecondi come float: una componente normale e una coda esponenziale, in ordine casuale."""
+    rng = np.random.default_rng(seed)
+    valori = np.concatenate([rng.normal(1.6e18, 3e16, n - n // 4), rng.exponential(1e15, n // 4) + 1.5e18])
+    rng.shuffle(valori)
+    return valori
+
+
+def errore_di_rango(valori, risultato, q):
+    """
+    Distanza del rango normalizzato dei valori restituiti dai quantili richiesti: 0 se il quantile esatto q cade fra
+    il primo e l'ultimo rango del valore restituito.
+    """
+    ordinati = np.sort(valori)
+    primo = np.searchsorted(ordinati, risultato, side='left') / len(valori)
+    ultimo = np.searchsorted(ordinati, risultato, side='right') / len(valori)
+    return np.maximum(0, np.maximum(primo - q, q - ultimo))
+
+
+@pytest.mark.parametrize('errore', [0.0133, 0.005])
+@pytest.mark.parametrize('seed', range(5))
+def test_quantili_entro_l_errore_di_rango(errore, seed):
+    valori = valori_campione(seed=seed)
+
+    # Sketch aggiornato un batch alla volta
+    sketch = SketchKLL(errore=errore, seed=seed)
+    for batch in np.array_split(valori, 37):
+        sketch.aggiorna(batch)
+    assert errore_di_rango(valori, sketch.quantile(QUANTILI), QUANTILI).max() <= errore
+
+    # Sketch di partizioni diverse, uniti
+    parti = [SketchKLL(errore=errore, seed=seed + i).aggiorna(parte) for i, parte in
+             enumerate(np.array_split(valori, 5))]
+    unito = parti[0]
+    for parte in parti[1:]:
+        unito.unisci(parte)
+    assert len(unito) == len(valori)
+    assert errore_di_rango(valori, unito.quantile(QUANTILI), QUANTILI).max() <= errore
+
+
+def test_limiti_da_sketch_entro_l_errore_e_riproducibili():
+    colonne = ['inizio', 'fine']
+    errore = 0.005
+    valori = np.column_stack([valori_campione(seed=10), valori_campione(seed=11)])
+
+    def limiti_in_batch():
+        sketches = crea_sketch_colonne(colonne, errore=errore)
+        altri = crea_sketch_colonne(colonne, errore=errore)
+        meta = len(valori) // 2
+        for batch in np.array_split(valori[:meta], 13):
+            aggiorna_sketch_colonne(sketches, batch)
+        for batch in np.array_split(valori[meta:], 13):
+            aggiorna_sketch_colonne(altri, batch)
+        return sketches, limiti_da_sketch(unisci_sketch_colonne(sketches, altri))
+
+    sketches, limiti = limiti_in_batch()
+    # Seme fissato di default: stessi limiti a ogni esecuzione
+    pd.testing.assert_frame_equal(limiti_in_batch()[1], limiti)
+
+    # Quartili stimati entro l'errore di rango; ciascun limite è monotono nei due quartili, quindi cade fra i limiti
+    # calcolati dai quartili esatti agli estremi dell'intervallo di errore
+    quartili = np.array([0.25, 0.75])
+    for i, colonna in enumerate(colonne):
+        assert errore_di_rango(valori[:, i], sketches[colonna].quantile(quartili), quartili).max() <= errore
+    Q1_min, Q1_max, Q3_min, Q3_max = np.quantile(valori, [0.25 - errore, 0.25 + errore, 0.75 - errore,
+                                                          0.75 + errore], axis=0)
+    assert (limiti['lower_bound'] >= 2.5 * Q1_min - 1.5 * Q3_max).all()
+    assert (limiti['lower_bound'] <= 2.5 * Q1_max - 1.5 * Q3_min).all()
+    assert (limiti['upper_bound'] >= 2.5 * Q3_min - 1.5 * Q1_max).all()
+    assert (limiti['upper_bound'] <= 2.5 * Q3_max - 1.5 * Q1_min).all()
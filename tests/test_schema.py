@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from data_prep import data_cleaning
+from data_prep.data_loading import load_dataset
+from data_prep.schema import COLONNE_TEMPORALI, epoch_ns
+
+
+def identify_and_remove_outliers_precedente(df, column):
+    """Limiti IQR della versione precedente, calcolati con quantile() sulla colonna datetime."""
+    Q1 = df[column].quantile(0.25)
+    Q3 = df[column].quantile(0.75)
+    IQR = Q3 - Q1
+    return df[(df[column] >= Q1 - 1.5 * IQR) & (df[column] <= Q3 + 1.5 * IQR)]
+
+
+def smooth_noisy_data_precedente(df, column, window_size=3):
+    """Media mobile della versione precedente sui secondi in float64, riconvertiti in datetime senza fuso orario."""
+    secondi = df[column].map(pd.Timestamp.timestamp)
+    return pd.to_datetime(secondi.rolling(window=window_size, min_periods=1).mean(), unit='s')
+
+
+@pytest.fixture(scope='module')
+def df_imputato(dataset_sintetico):
+    """
+    Dataset sintetico con le colonne temporali convertite da applica_schema, gli orari imputati (con frazioni di
+    secondo per 'ora_fine_erogazione') e senza televisite disdette.
+    """
+    df = load_dataset(dataset_sintetico)
+    df = data_cleaning.imputate_ora_inizio_erogazione_and_ora_fine_erogazione(df,
+                                                                               data_cleaning.calcola_media_durata(df))
+    return data_cleaning.remove_disdette(df)
+
+
+@pytest.mark.parametrize('column', COLONNE_TEMPORALI)
+def test_colonne_temporali_equivalenti_al_calcolo_in_secondi(df_imputato, column):
+    atteso = identify_and_remove_outliers_precedente(df_imputato.copy(), column)
+    filtrato = data_cleaning.identify_and_remove_outliers(df_imputato.copy(), [column])
+
+    # Stessi campioni scartati come outliers
+    pd.testing.assert_index_equal(filtrato.index, atteso.index)
+
+    # Media mobile: meno di 1 µs di scarto dal calcolo sui secondi in float64, stessi secondi interi (usati da
+    # data_transformation) e stesso istante, in UTC invece che senza fuso orario
+    precedente = smooth_noisy_data_precedente(atteso.copy(), column).to_numpy().view(np.int64)
+    smussato = data_cleaning.smooth_noisy_data(filtrato.copy(), [column])[column]
+    assert str(smussato.dt.tz) == 'UTC'
+    smussato = epoch_ns(smussato)
+    assert np.abs(smussato - precedente).max() < 1000
+    np.testing.assert_array_equal(smussato // 10 ** 9, precedente // 10 ** 9)
+
+
+def test_ora_fine_con_frazioni_di_secondo(df_imputato):
+    # Il confronto comprende orari non interi, su cui il calcolo in float64 arrotonda
+    assert (epoch_ns(df_imputato['ora_fine_erogazione']) % 10 ** 9 != 0).any()
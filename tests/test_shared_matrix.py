@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from src.clustering.clustering_execution import plot_elbow_method, riduci_dimensionalita
+from src.clustering.shared_matrix import apri_matrice, condividi_matrice, rilascia_matrice
+
+
+@pytest.fixture
+def matrice():
+    """
+    Matrice float32 di codici interi con 3 gruppi di campioni.
+    """
+    rng = np.random.default_rng(0)
+    centri = rng.integers(0, 50, size=(3, 8))
+    return (centri[rng.integers(0, 3, size=600)] + rng.integers(0, 3, size=(600, 8))).astype(np.float32)
+
+
+@pytest.mark.parametrize('modo', ['memmap', 'shm'])
+@pytest.mark.parametrize('sparsa', [False, True])
+def test_matrice_condivisa_aperta_senza_copia(tmp_path, matrice, modo, sparsa):
+    originale = sparse.csr_matrix(matrice) if sparsa else matrice
+    descrittore = condividi_matrice(originale, modo, cartella=str(tmp_path))
+    try:
+        aperta = apri_matrice(descrittore)
+        if sparsa:
+            assert sparse.issparse(aperta)
+            assert not aperta.data.flags.writeable
+            aperta = aperta.toarray()
+        else:
+            assert not aperta.flags.writeable
+        np.testing.assert_array_equal(aperta, matrice)
+    finally:
+        rilascia_matrice(descrittore)
+
+
+@pytest.mark.parametrize('sparsa', [False, True])
+def test_elbow_su_matrice_condivisa_uguale_al_pool_di_thread(cartella_lavoro, matrice, sparsa):
+    matrice = sparse.csr_matrix(matrice) if sparsa else matrice
+    svd_data = riduci_dimensionalita(matrice)
+    thread = plot_elbow_method(svd_data, max_clusters=4, thread=2)
+    processi = plot_elbow_method(svd_data, max_clusters=4, condivisione='shm', processi=2, matrice=matrice)
+
+    for k in thread:
+        np.testing.assert_array_equal(processi[k].labels_, thread[k].labels_)
+        assert processi[k].inertia_ == pytest.approx(thread[k].inertia_)
@@ -0,0 +1,45 @@
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from data_prep.data_cleaning import data_cleaning
+from data_prep.data_loading import FILTRO_DISDETTE, colonne_utilizzate, load_dataset, media_durata_dataset
+from data_prep.features_selection import feature_selection
+from feature_extraction.features_extraction import feature_extraction
+from streaming.streaming_execution import streaming_execution
+
+
+@pytest.fixture(scope='module')
+def dataset_con_duplicati(dataset_sintetico, tmp_path_factory):
+    """
+    Prime 600 prenotazioni del dataset sintetico con due campioni ripetuti quattro volte di seguito: dopo lo smoothing
+    (media mobile su 3 campioni) le ultime copie di ciascuno restano identiche e vengono rimosse come duplicati.
+    """
+    tabella = pq.read_table(dataset_sintetico)
+    indici = np.concatenate([np.arange(200), [199] * 3, np.arange(200, 450), [449] * 3, np.arange(450, 600)])
+    file_path = str(tmp_path_factory.mktemp('duplicati') / 'prenotazioni.parquet')
+    pq.write_table(tabella.take(indici), file_path, row_group_size=250)
+    return file_path
+
+
+@pytest.mark.parametrize('batch_size, proiezione', [(7, True), (100, True), (333, True), (100, False)])
+def test_streaming_uguale_alla_pipeline_in_memoria(cartella_lavoro, dataset_con_duplicati, batch_size, proiezione,
+                                                    caplog):
+    # Lettura con proiezione delle colonne e filtro delle televisite disdette (come run.py) o dell'intero file
+    if proiezione:
+        columns, filtro = colonne_utilizzate(dataset_con_duplicati), FILTRO_DISDETTE
+        media_durata = media_durata_dataset(dataset_con_duplicati)
+    else:
+        columns, filtro, media_durata = None, None, None
+    df = load_dataset(dataset_con_duplicati, columns=columns, filtro=filtro)
+    atteso = feature_extraction(feature_selection(data_cleaning(df, media_durata=media_durata)))
+
+    # Batch più piccoli dei row group e non allineati ad essi: la coda dello smoothing passa fra batch e le categorie
+    # di ogni batch vengono unite con union_categoricals
+    with caplog.at_level(logging.INFO):
+        risultato = streaming_execution(dataset_con_duplicati, batch_size=batch_size, columns=columns, filtro=filtro)
+
+    # Il risultato in streaming contiene solo le feature usate nelle fasi successive
+    pd.testing.assert_frame_equal(risultato, atteso[risultato.columns])
+    assert "2 duplicati confermati" in caplog.text